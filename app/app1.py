@@ -14,15 +14,19 @@ except:
 
 from app import app
 from config import settings
+from partitioned_store import read_table
 
 GRADIENT_INVERSION_PATH = settings.GRADIENT_INVERSION_PATH
 GRADIENT_INVERSION_URL = settings.GRADIENT_INVERSION_URL
 TASK_INFO_FILE = settings.TASK_INFO_FILE
+TASK_INFO_START = settings.TASK_INFO_START
 BAT_STATS_FILE = settings.BAT_STATS_FILE
 COMPLETED_PCT = settings.COMPLETED_PCT
 
 
-TASK_INFO_DF = pd.read_feather(TASK_INFO_FILE)
+# Only the partitions from TASK_INFO_START onwards are read
+TASK_INFO_DF = read_table(TASK_INFO_FILE, time_column='proj_date', start=TASK_INFO_START,
+                          replace_on='proj_name')
 
 # assign date_ids - the index of each date relative to the full date range
 # covered by the time series (without missing dates)
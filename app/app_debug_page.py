@@ -25,6 +25,7 @@ except ImportError:
 
 from app import app
 from config import settings
+from partitioned_store import read_table
 
 # conda install -c conda-forge dash-table
 # conda install -c conda-forge dash-bootstrap-components
@@ -37,6 +38,7 @@ re_pattern = re.compile('([0-9]+)([a-zA-Z]+)')
 
 # Define file paths
 task_info_file = settings.TASK_INFO_FILE
+task_info_start = settings.TASK_INFO_START
 ls_log_file = settings.LS_LOG_FILE
 supply_dat_ftr_file = settings.SUPPLY_DAT_FTR_FILE
 
@@ -55,7 +57,8 @@ log_df[0] = pd.to_datetime(log_df[0], format='%Y-%m-%d %H:%M:%S') #(GMT)')
 log_df.columns = ['Time', 'TZ', 'LogText', 'LineID']
 
 # Read task info data
-task_info_df = pd.read_feather(task_info_file)
+task_info_df = read_table(task_info_file, time_column='proj_date', start=task_info_start,
+                          replace_on='proj_name')
 
 # Get task timing and set up timeline dataframe
 timing = task_info_df[['Started', 'Completed', 'Quit', 'last_log_event']].copy()
@@ -90,7 +93,7 @@ timeline.columns = ['Time', 'Value']
 #power.name = 'Power on'
 
 # Read supply voltage data and set up dataframe
-df2 = pd.read_feather(supply_dat_ftr_file)
+df2 = read_table(supply_dat_ftr_file, time_column='DateTime')
 df2 = df2.set_index('DateTime')
 power = df2['Power on']
 
@@ -0,0 +1,64 @@
+"""Benchmark of pyabemls.condense_measurements against task size.
+
+Builds task DataFrames shaped like the output of ABEMLS_project.get_task()
+(12 data channels per measurement, with a multi-SeqNum datatype) and times
+condensing them. Run from the app folder:
+
+    python -m benchmarks.bench_condense
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+import pyabemls
+
+
+# Datatypes per data channel as (DatatypeID, number of SeqNums)
+CHANNEL_DATATYPES = [(2, 1), (4, 1), (5, 1), (7, 1), (3, 4)]
+N_CHANNELS = 12
+MEASURE_COUNTS = [100, 1000, 5000, 20000]
+
+
+def make_task(n_measures, seed=0):
+    """Return a synthetic task DataFrame with n_measures measurements."""
+    rng = np.random.default_rng(seed)
+
+    dt_ids = np.concatenate([[dtid]*nseq for dtid, nseq in CHANNEL_DATATYPES])
+    seq_nums = np.concatenate([np.arange(nseq) for dtid, nseq in CHANNEL_DATATYPES])
+    n_values = len(dt_ids)
+
+    mid = np.repeat(np.arange(1, n_measures+1), N_CHANNELS*n_values)
+    channel = np.tile(np.repeat(np.arange(1, N_CHANNELS+1), n_values), n_measures)
+    n = len(mid)
+
+    a = rng.integers(0, 60, size=n_measures*N_CHANNELS).repeat(n_values).astype(float)
+    df = pd.DataFrame({
+        'Time': pd.Timestamp('2022-07-01') + pd.to_timedelta(mid, unit='s'),
+        'TaskID': 2,
+        'MeasureID': mid,
+        'Channel': channel,
+        'SeqNum': np.tile(seq_nums, n_measures*N_CHANNELS),
+        'DatatypeID': np.tile(dt_ids, n_measures*N_CHANNELS),
+        'APosX': a, 'APosY': 0., 'APosZ': 0.,
+        'BPosX': a+3, 'BPosY': 0., 'BPosZ': 0.,
+        'MPosX': a+1, 'MPosY': 0., 'MPosZ': 0.,
+        'NPosX': a+2, 'NPosY': 0., 'NPosZ': 0.,
+        'DataValue': rng.random(n)*100,
+        'DataSDev': rng.random(n),
+        'MCycles': 3,
+        'SessionID': 2,
+    })
+    return df
+
+
+if __name__ == '__main__':
+    print('{0:>10} {1:>10} {2:>10} {3:>10} {4:>12}'.format(
+        'measures', 'rows in', 'rows out', 'time [s]', 'rows/s'))
+    for n_measures in MEASURE_COUNTS:
+        task = make_task(n_measures)
+        t0 = time.perf_counter()
+        condensed = pyabemls.condense_measurements(task, pyabemls.DATATYPES)
+        elapsed = time.perf_counter() - t0
+        print('{0:>10d} {1:>10d} {2:>10d} {3:>10.3f} {4:>12.0f}'.format(
+            n_measures, len(task), len(condensed), elapsed, len(task)/elapsed))
@@ -0,0 +1,67 @@
+"""Benchmark of separating duplicate time stamps, on pathological bursts.
+
+Compares the loop formerly used in voltage_log_processing.py, which moved the
+earlier duplicates by 1 ms until none were left (one pass over the whole
+column per step), with timeseries.separate_duplicates, which finds all the
+offsets in one pass. Builds one-second time series in which bursts of k
+identical time stamps are spread over the series, checks that both give the
+same times and reports their run times. Run from the app folder:
+
+    python -m benchmarks.bench_duplicates [n_rows]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from timeseries import separate_duplicates
+
+
+BURST_LENGTHS = [1, 2, 10, 100, 500]
+BURST_FRACTION = 0.1    # fraction of the rows in bursts
+
+
+def make_times(n_rows, burst_length, seed=0):
+    """Return a Series of n_rows one-second time stamps, in which bursts of
+    burst_length identical time stamps make up BURST_FRACTION of the rows."""
+    rng = np.random.default_rng(seed)
+    n_bursts = int(n_rows * BURST_FRACTION / burst_length) if burst_length > 1 else 0
+    repeats = np.ones(n_rows - n_bursts*(burst_length-1), dtype=np.int64)
+    repeats[rng.choice(len(repeats), size=n_bursts, replace=False)] = burst_length
+    seconds = np.repeat(np.arange(len(repeats)), repeats)
+    return pd.Series(pd.Timestamp('2022-07-01') + pd.to_timedelta(seconds, unit='s'),
+                     name='DateTime')
+
+
+def separate_duplicates_loop(times):
+    """The former implementation: one pass over the column per 1 ms step."""
+    idx = times.duplicated(keep='last')
+    while any(idx):
+        datetimes = times.values.copy()
+        datetimes[idx.values] = datetimes[idx.values] + np.timedelta64(1, 'ms')
+        times = pd.Series(datetimes, index=times.index, name=times.name)
+        idx = times.duplicated(keep='last')
+    return times
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+
+    print('{0:>8} {1:>10} {2:>12} {3:>12} {4:>9}'.format(
+        'burst', 'rows', 'loop [s]', 'single [s]', 'speedup'))
+    for burst_length in BURST_LENGTHS:
+        times = make_times(n_rows, burst_length)
+
+        t0 = time.perf_counter()
+        expected = separate_duplicates_loop(times)
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        result = separate_duplicates(times)
+        t_single = time.perf_counter() - t0
+
+        assert (result.values == expected.values).all(), 'Results differ!'
+        assert not result.duplicated().any()
+        print('{0:>8d} {1:>10d} {2:>12.3f} {3:>12.3f} {4:>9.1f}'.format(
+            burst_length, len(times), t_loop, t_single, t_loop/t_single))
@@ -0,0 +1,169 @@
+"""Throughput benchmark of project ingestion.
+
+Writes a folder of synthetic projects and reports projects/s and rows/s for
+opening projects (ABEMLS_project), ABEMLS_project.get_tasklist,
+ABEMLS_project.get_task and the end-to-end db_preparation_thin.py ingestion.
+Each run is appended to benchmarks/results/bench_ingestion.jsonl together with
+the git commit and the parameters, and compared with the previous run with the
+same parameters, so that regressions show up between versions. Run from the
+app folder:
+
+    python -m benchmarks.bench_ingestion [n_projects] [n_tasks] [n_measures] [n_workers]
+"""
+
+import sys
+import json
+import time
+import platform
+import tempfile
+import pathlib
+import subprocess
+import datetime as dt
+
+import pandas as pd
+
+import pyabemls
+from benchmarks.synthetic import make_projects
+
+
+RESULTS_FILE = pathlib.Path(__file__).parent / 'results' / 'bench_ingestion.jsonl'
+
+
+def git_commit():
+    """Return the commit of the working tree, or None if git is not available."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                             text=True, cwd=pathlib.Path(__file__).parent, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def count_rows(files):
+    """Return the total number of DPV rows in the project files."""
+    total = 0
+    for f in files:
+        with pyabemls.ABEMLS_project(str(f), open_mode='immutable') as alsp:
+            total += alsp.execute_sql('SELECT COUNT(*) FROM DPV')[0][0][0]
+    return total
+
+
+def bench_open(files):
+    for f in files:
+        with pyabemls.ABEMLS_project(str(f)) as alsp:
+            alsp.cursor().close()
+
+
+def bench_tasklist(files):
+    for f in files:
+        with pyabemls.ABEMLS_project(str(f)) as alsp:
+            alsp.get_tasklist()
+
+
+def bench_get_task(files):
+    rows = 0
+    for f in files:
+        with pyabemls.ABEMLS_project(str(f)) as alsp:
+            for task_id in alsp.tasks['ID']:
+                data, etest = alsp.get_task(task_id=task_id)
+                rows += len(data)
+    return rows
+
+
+def bench_ingestion(path, out_path, n_workers):
+    """Run the db_preparation_thin.py ingestion on the synthetic projects in
+    path, writing its outputs to out_path."""
+    import db_preparation_thin as prep
+
+    path = pathlib.Path(path)
+    out_path = pathlib.Path(out_path)
+    out_path.mkdir(parents=True, exist_ok=True)
+    prep.project_path = path / 'projects'
+    prep.protocols_path = path / 'protocols'
+    prep.task_info_store = out_path / 'task_info'
+    prep.temperature_store = out_path / 'temperatures'
+    prep.ext_power_store = out_path / 'ext_power'
+    prep.info_db_file = out_path / 'task_info.ftr'
+    prep.protocol_cache_file = out_path / 'protocol_cache.json'
+    prep.manifest_file = out_path / 'ingest_manifest.json'
+    prep.listing_cache_file = out_path / 'project_listing.json'
+    prep.metrics_file = out_path / 'ingest_metrics.jsonl'
+    prep.checkpoint_file = out_path / 'ingest_checkpoint.json'
+    prep.quarantine_file = out_path / 'ingest_quarantine.json'
+    return prep.ingest_projects(force_reprocessing=True, n_workers=n_workers, verbose=False)
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def previous_result(params):
+    """Return the last stored result with the same parameters, or None."""
+    if not RESULTS_FILE.exists():
+        return None
+    previous = None
+    with open(RESULTS_FILE, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('params') == params:
+                previous = record
+    return previous
+
+
+def store_result(record):
+    RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    n_projects = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_tasks = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    n_measures = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    n_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    params = dict(n_projects=n_projects, n_tasks=n_tasks, n_measures=n_measures,
+                  n_workers=n_workers)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        files = make_projects(tmp, n_projects=n_projects, n_tasks=n_tasks, n_measures=n_measures)
+        n_rows = count_rows(files)
+        print('Synthetic projects: {0} projects, {1} tasks each, {2} DPV rows'.format(
+            n_projects, n_tasks, n_rows))
+
+        times = dict()
+        times['open'], _ = timed(bench_open, files)
+        times['get_tasklist'], _ = timed(bench_tasklist, files)
+        times['get_task'], task_rows = timed(bench_get_task, files)
+        times['ingestion'], read = timed(bench_ingestion, tmp, tmp / 'output', n_workers)
+        assert len(read) == n_projects, 'Not all projects were ingested!'
+
+    metrics = dict()
+    for name, t in times.items():
+        rows = task_rows if name == 'get_task' else n_rows
+        metrics[name] = dict(seconds=round(t, 4), projects_per_s=round(n_projects/t, 2),
+                             rows_per_s=round(rows/t, 1))
+
+    record = dict(time=dt.datetime.now().isoformat(timespec='seconds'), commit=git_commit(),
+                  python=platform.python_version(), pandas=pd.__version__,
+                  params=params, rows=n_rows, metrics=metrics)
+    previous = previous_result(params)
+    store_result(record)
+
+    print('{0:<14} {1:>10} {2:>12} {3:>14} {4:>10}'.format(
+        'step', 'time [s]', 'projects/s', 'rows/s', 'change'))
+    for name, m in metrics.items():
+        change = ''
+        if previous is not None and name in previous['metrics']:
+            change = '{0:+.0%}'.format(m['seconds']/previous['metrics'][name]['seconds'] - 1)
+        print('{0:<14} {1:>10.4f} {2:>12.2f} {3:>14.1f} {4:>10}'.format(
+            name, m['seconds'], m['projects_per_s'], m['rows_per_s'], change))
+    if previous is not None:
+        print('Change in time relative to the run of {0} (commit {1}).'.format(
+            previous['time'], previous['commit']))
+    print('Results stored in {0}'.format(RESULTS_FILE))
@@ -0,0 +1,82 @@
+"""Benchmark of the task info query used by ABEMLS_project.get_tasklist.
+
+Compares the former single-join query, which counted data through
+COUNT(DISTINCT ...) over the cross product of all joined tables, with the
+current query built from pre-aggregated count subqueries. Run from the app
+folder:
+
+    python -m benchmarks.bench_task_info [n_tasks] [n_measures]
+"""
+
+import sys
+import time
+import tempfile
+import pathlib
+
+import pyabemls
+from benchmarks.synthetic import make_project
+
+
+LEGACY_TASK_INFO_SQL = """
+    SELECT
+        Tasks.ID,
+        Tasks.Name,
+        Tasks.PosX, Tasks.PosY, Tasks.PosZ,
+        Tasks.SpacingX, Tasks.SpacingY, Tasks.SpacingZ,
+        Tasks.ArrayCode,Tasks.Time,
+        ts1.Value as ProtocolFile,
+        ts2.Value as SpreadFile,
+        ts4.Value as BaseReference,
+        Log2.PosLatitude, Log2.PosLongitude, Log2.PosQuality,
+        COUNT(DISTINCT ndt.ID) as nData,
+        COUNT(DISTINCT ndt.DPID) as nDipoles,
+        COUNT(DISTINCT e.ID) as nECRdata
+    FROM Tasks
+    LEFT JOIN ElectrodeTestData as e ON Tasks.ID=e.TaskID
+    LEFT JOIN (SELECT * FROM DPV WHERE Channel>0 AND Channel<13)            as ndt ON ndt.TaskID=Tasks.ID
+    LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting='ProtocolFile')     as ts1 ON ts1.key1=Tasks.ID
+    LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting='SpreadFile')       as ts2 ON ts2.key1=Tasks.ID
+    LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting='BaseReference')    as ts4 ON ts4.key1=Tasks.ID
+    LEFT JOIN (SELECT DISTINCT PosLatitude, PosLongitude, PosQuality, TaskID FROM Log) as Log2 ON Log2.TaskID=Tasks.ID
+    GROUP BY Tasks.ID
+"""
+
+
+def timed(func, repeat=3):
+    """Return the best wall time of repeat calls to func, and its last result."""
+    best = None
+    for n in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    n_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    n_measures = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = make_project(pathlib.Path(tmp) / 'project.db', n_tasks=n_tasks,
+                                n_measures=n_measures)
+        with pyabemls.ABEMLS_project(str(filename), open_mode='immutable') as alsp:
+            n_dpv = alsp.execute_sql('SELECT COUNT(*) FROM DPV')[0][0][0]
+            print('Synthetic project: {0} tasks, {1} DPV rows'.format(n_tasks, n_dpv))
+
+            t_legacy, legacy = timed(lambda: alsp.execute_sql(LEGACY_TASK_INFO_SQL))
+            t_all, current = timed(lambda: alsp.get_tasklist())
+            t_dipoles, _ = timed(lambda: alsp.get_tasklist(counts=['nDipoles', 'nECRdata']))
+            t_ecr, _ = timed(lambda: alsp.get_tasklist(counts=['nECRdata']))
+            t_none, _ = timed(lambda: alsp.get_tasklist(counts=[]))
+
+            legacy_counts = [r[-3:] for r in legacy[0]]
+            current_counts = current[['nData', 'nDipoles', 'nECRdata']].values.tolist()
+            assert legacy_counts == [tuple(c) for c in current_counts], 'Counts differ!'
+
+    print('{0:<40} {1:>10}'.format('query', 'time [s]'))
+    print('{0:<40} {1:>10.4f}'.format('legacy join, all counts', t_legacy))
+    print('{0:<40} {1:>10.4f}'.format('pre-aggregated, all counts', t_all))
+    print('{0:<40} {1:>10.4f}'.format('pre-aggregated, nDipoles + nECRdata', t_dipoles))
+    print('{0:<40} {1:>10.4f}'.format('pre-aggregated, nECRdata', t_ecr))
+    print('{0:<40} {1:>10.4f}'.format('pre-aggregated, no counts', t_none))
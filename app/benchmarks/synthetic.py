@@ -0,0 +1,213 @@
+"""Generator of synthetic Terrameter LS project databases for benchmarking.
+
+The databases contain the tables and columns read by pyabemls, filled with
+random but consistently linked data. They are not meant to be inverted.
+"""
+
+import sqlite3
+import pathlib
+import datetime as dt
+import numpy as np
+
+
+SCHEMA = """
+    CREATE TABLE Tasks (ID INTEGER PRIMARY KEY, Name TEXT,
+        PosX REAL, PosY REAL, PosZ REAL, SpacingX REAL, SpacingY REAL, SpacingZ REAL,
+        ArrayCode INTEGER, Time TEXT);
+    CREATE TABLE Datatype (ID INTEGER PRIMARY KEY, Name TEXT, Symbol TEXT, Unit TEXT);
+    CREATE TABLE Sessions (ID INTEGER PRIMARY KEY, TaskID INTEGER, Time TEXT);
+    CREATE TABLE AcqSettings (key1 INTEGER, key2 INTEGER, Setting TEXT, Value TEXT);
+    CREATE TABLE TaskSettings (key1 INTEGER, Setting TEXT, Value TEXT);
+    CREATE TABLE Stations (ID INTEGER PRIMARY KEY, TaskID INTEGER);
+    CREATE TABLE Measures (ID INTEGER PRIMARY KEY, TaskID INTEGER, SessionID INTEGER,
+        StationID INTEGER, Time TEXT, PosLatitude REAL, PosLongitude REAL, PosQuality INTEGER,
+        IntPowerVolt REAL, ExtPowerVolt REAL, Temp REAL);
+    CREATE TABLE DP_ABMN (ID INTEGER PRIMARY KEY, TaskID INTEGER,
+        APosX REAL, APosY REAL, APosZ REAL, BPosX REAL, BPosY REAL, BPosZ REAL,
+        MPosX REAL, MPosY REAL, MPosZ REAL, NPosX REAL, NPosY REAL, NPosZ REAL);
+    CREATE TABLE DPV (ID INTEGER PRIMARY KEY, TaskID INTEGER, MeasureID INTEGER, DPID INTEGER,
+        Channel INTEGER, DatatypeID INTEGER, SeqNum INTEGER, DataValue REAL, DataSDev REAL,
+        MCycles INTEGER);
+    CREATE TABLE ElectrodeTestData (ID INTEGER PRIMARY KEY, TaskID INTEGER, StationID INTEGER,
+        SwitchNumber INTEGER, SwitchAddress INTEGER, PosX REAL, PosY REAL, PosZ REAL,
+        ResistanceValue REAL, CurrentValue REAL, TestStatus INTEGER, UserSetting INTEGER,
+        TxStatus INTEGER, Time TEXT);
+    CREATE TABLE Log (ID INTEGER PRIMARY KEY, TaskID INTEGER, Time TEXT, What TEXT,
+        PosLatitude REAL, PosLongitude REAL, PosQuality INTEGER, Temp REAL, ExtPowerVolt REAL);
+"""
+
+# Datatypes written for each data channel (1-12) and for the current channel (0)
+CHANNEL_DATATYPES = [2, 4, 5, 7]
+CURRENT_DATATYPES = [6, 13]
+
+ACQ_SETTINGS = dict([
+    ('Acq_DelaySec', '0.3'),
+    ('Acq_TimeSec', '0.5'),
+    ('CurrentLimitHighAmpere', '0.5'),
+    ('CurrentLimitLowAmpere', '0.001'),
+    ('ElectrodeResistanceBadLimitHighOhm', '10000'),
+    ('ElectrodeResistanceBadLimitLowOhm', '1'),
+    ('ElectrodeTest', '1'),
+    ('ElectrodeTestCurrentAmpere', '0.01'),
+    ('Fullwaveform', '0'),
+    ('IP_OffTimeSec', '0'),
+    ('MeasureMode', '2'),
+])
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+PROTOCOL_FILE = 'GradientXL_64_DISKO.xml'
+PROJECT_NAME_FORMAT = '%y%m%d_%H%M'
+
+
+def make_project(filename, n_tasks=2, n_measures=100, n_channels=12, n_electrodes=64,
+                 start=dt.datetime(2022, 7, 1, 3), seed=0):
+    """Write a synthetic project database.
+
+    The first task is an electrode test ('ECR_1') with one ElectrodeTestData
+    row per electrode, the following tasks are gradient acquisitions with
+    n_measures measurements of n_channels channels each.
+
+    :param filename: str or Path
+        The database file to write. An existing file is overwritten.
+    :return: Path
+        The filename of the database.
+    """
+    filename = pathlib.Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    if filename.exists():
+        filename.unlink()
+
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(str(filename))
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO Datatype VALUES (?,?,?,?)",
+                     [(1, 'SP', 'SP', 'V'), (2, 'ρa', 'ρ', 'Ωm'), (4, 'SNR', 'SNR', 'dB'),
+                      (5, 'R', 'R', 'Ω'), (6, 'I', 'I', 'A'), (7, 'ΔU', 'ΔU', 'V'),
+                      (13, 'Temp', 'T', 'C')])
+
+    n_values = n_channels*len(CHANNEL_DATATYPES) + len(CURRENT_DATATYPES)
+    measure_id = 0
+    dp_id = 0
+    dpv_id = 0
+    log_id = 0
+    time = start
+
+    for task_id in range(1, n_tasks+1):
+        name = 'ECR_1' if task_id == 1 else '2x32gradientXL_1'
+        task_time = time.strftime(TIME_FORMAT)
+        conn.execute("INSERT INTO Tasks VALUES (?,?,0,0,0,1,0,0,11,?)", (task_id, name, task_time))
+        conn.execute("INSERT INTO Sessions VALUES (?,?,?)", (task_id, task_id, task_time))
+        conn.execute("INSERT INTO Stations VALUES (?,?)", (task_id, task_id))
+        conn.executemany("INSERT INTO AcqSettings VALUES (?,?,?,?)",
+                         [(task_id, task_id, k, v) for k, v in ACQ_SETTINGS.items()])
+        conn.executemany("INSERT INTO TaskSettings VALUES (?,?,?)",
+                         [(task_id, 'ProtocolFile', '/home/root/protocols/' + PROTOCOL_FILE),
+                          (task_id, 'SpreadFile', '/home/root/spreads/2x32_DISKO.xml')])
+
+        if task_id == 1:
+            electrodes = np.arange(n_electrodes)
+            conn.executemany(
+                "INSERT INTO ElectrodeTestData VALUES (NULL,?,?,1,?,?,0,0,?,0.01,0,0,0,?)",
+                zip([task_id]*n_electrodes, [task_id]*n_electrodes, (electrodes+1).tolist(),
+                    electrodes.astype(float).tolist(), (rng.random(n_electrodes)*1000).tolist(),
+                    [task_time]*n_electrodes))
+            n_task_measures = 0
+        else:
+            n_task_measures = n_measures
+
+        # Measures, one second apart
+        mids = np.arange(measure_id+1, measure_id+n_task_measures+1)
+        times = [(time + dt.timedelta(seconds=int(s))).strftime(TIME_FORMAT)
+                 for s in range(n_task_measures)]
+        conn.executemany(
+            "INSERT INTO Measures VALUES (?,?,?,?,?,69.25,-53.52,3,12.1,?,?)",
+            zip(mids.tolist(), [task_id]*n_task_measures, [task_id]*n_task_measures,
+                [task_id]*n_task_measures, times, (12 + rng.random(n_task_measures)).tolist(),
+                (rng.random(n_task_measures)*5).tolist()))
+
+        # One quadrupole per measure and data channel
+        n_dp = n_task_measures*n_channels
+        dpids = np.arange(dp_id+1, dp_id+n_dp+1)
+        a = rng.integers(0, n_electrodes-3, size=n_dp).astype(float)
+        zeros = np.zeros(n_dp)
+        conn.executemany(
+            "INSERT INTO DP_ABMN VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            zip(dpids.tolist(), [task_id]*n_dp,
+                a.tolist(), zeros.tolist(), zeros.tolist(),
+                (a+3).tolist(), zeros.tolist(), zeros.tolist(),
+                (a+1).tolist(), zeros.tolist(), zeros.tolist(),
+                (a+2).tolist(), zeros.tolist(), zeros.tolist()))
+
+        # Data point values. The current channel refers to the first quadrupole of the measure.
+        channel = np.concatenate([np.zeros(len(CURRENT_DATATYPES), dtype=int),
+                                  np.repeat(np.arange(1, n_channels+1), len(CHANNEL_DATATYPES))])
+        datatype = np.concatenate([CURRENT_DATATYPES, np.tile(CHANNEL_DATATYPES, n_channels)])
+        dp_offset = np.maximum(channel-1, 0)
+        n_dpv = n_task_measures*n_values
+        dpv_mid = np.repeat(mids, n_values)
+        dpv_dpid = np.repeat(dpids[::n_channels], n_values) + np.tile(dp_offset, n_task_measures)
+        conn.executemany(
+            "INSERT INTO DPV VALUES (?,?,?,?,?,?,0,?,?,3)",
+            zip(np.arange(dpv_id+1, dpv_id+n_dpv+1).tolist(), [task_id]*n_dpv,
+                dpv_mid.tolist(), dpv_dpid.tolist(), np.tile(channel, n_task_measures).tolist(),
+                np.tile(datatype, n_task_measures).tolist(), (rng.random(n_dpv)*100).tolist(),
+                (rng.random(n_dpv)*0.1).tolist()))
+
+        # Log events of the task
+        end = time + dt.timedelta(seconds=max(n_task_measures, 1))
+        events = [(time, 'Measuring Started'), (end, 'Measuring done'), (end, 'Quit')]
+        conn.executemany(
+            "INSERT INTO Log VALUES (?,?,?,?,69.25,-53.52,3,?,?)",
+            [(log_id+i+1, task_id, t.strftime(TIME_FORMAT), what, 2.5, 12.4)
+             for i, (t, what) in enumerate(events)])
+
+        measure_id += n_task_measures
+        dp_id += n_dp
+        dpv_id += n_dpv
+        log_id += len(events)
+        time = end + dt.timedelta(minutes=1)
+
+    conn.commit()
+    conn.close()
+    return filename
+
+
+def make_protocol(filename, n_measures, n_channels=12):
+    """Write a synthetic protocol file with one Rx element per channel of each
+    measurement, so that the nominal number of measurements of a task matches
+    its nDipoles count."""
+    filename = pathlib.Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    rx = ''.join('<Rx><Ch>{0}</Ch></Rx>'.format(c) for c in range(1, n_channels+1))
+    measure = '<Measure><Tx><A>1</A><B>4</B></Tx><Receivers>{0}</Receivers></Measure>'.format(rx)
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<Protocol><Sequence>\n')
+        for n in range(n_measures):
+            f.write(measure + '\n')
+        f.write('</Sequence></Protocol>\n')
+    return filename
+
+
+def make_projects(path, n_projects=10, n_tasks=2, n_measures=100, n_channels=12,
+                  n_electrodes=64, start=dt.datetime(2022, 7, 1, 3), seed=0):
+    """Write a folder of synthetic projects as mirrored from the instrument,
+    with one project per day in folders named by date and time, and the
+    protocol file used by the tasks.
+
+    :param path: str or Path
+        Folder to write to. The projects are written to path/projects and the
+        protocol to path/protocols.
+    :return: list of Path
+        The project database files.
+    """
+    path = pathlib.Path(path)
+    make_protocol(path / 'protocols' / PROTOCOL_FILE, n_measures, n_channels=n_channels)
+    files = []
+    for n in range(n_projects):
+        proj_start = start + dt.timedelta(days=n)
+        name = proj_start.strftime(PROJECT_NAME_FORMAT)
+        files.append(make_project(path / 'projects' / name / 'project.db', n_tasks=n_tasks,
+                                  n_measures=n_measures, n_channels=n_channels,
+                                  n_electrodes=n_electrodes, start=proj_start, seed=seed+n))
+    return files
+
@@ -16,6 +16,7 @@ class ConfigSettings(BaseSettings):
     GRADIENT_INVERSION_PATH: Path = Field(..., env="GRADIENT_INVERSION_PATH")
     GRADIENT_INVERSION_URL: PurePosixPath = Field(..., env="GRADIENT_INVERSION_URL")
     TASK_INFO_FILE: Path = Field(..., env="TASK_INFO_FILE")
+    TASK_INFO_START: Optional[str] = Field(None, env="TASK_INFO_START")
     BAT_STATS_FILE: Path = Field(..., env="BAT_STATS_FILE")
     LS_LOG_FILE: Path = Field(..., env="LS_LOG_FILE")
     SUPPLY_DAT_FTR_FILE: Path = Field(..., env="SUPPLY_DAT_FTR_FILE")
@@ -1,10 +1,11 @@
 import pyabemls
+from extractors import TaskInfoStage, TemperatureStage, PowerStage, iter_extraction, collect_results
+from ingestion_metrics import IngestionMetrics, print_summary
+import os
+import json
 import pathlib
 import pandas as pd
-from xml.dom.minidom import parseString
 import ipdb as pdb
-import re
-import dateutil as du
 import datetime as dt
 
 # Please install pyarrow
@@ -15,27 +16,9 @@ import datetime as dt
 
 # Function to convert from dat to ohm
 def dat2ohm(dat,topo, filename):
-    nsensors = topo[0].size
-    temp = dat[dat['DataValue']>=0] # Save only positive resistivities
-    file1 = open(filename,"w")
-    file1.write(str(nsensors))
-    file1.write("# Number of sensors\n")
-    file1.write("#x z\n")
-    file1.write(topo.to_string(header=None, index = False, index_names = False))
-    file1.write("\n")
-    file1.write(str(temp['DataValue'].size))
-    file1.write("# Number of data\n")
-    file1.write("#a b m n R\n")
-    file1.write(dat[dat['DataValue']>=0][::-1].to_string(header=None, index=False, index_names=False))
-    file1.close()
-
-# Function to get the total expected number of measures based on xml protocol file
-def get_expected_measure_nb(protocol):
-    file = open(protocol,"r")
-    data = file.read()
-    file.close()
-    dom = parseString(data)
-    return len(dom.getElementsByTagName('Rx'))
+    temp = dat[dat['DataValue']>=0][::-1] # Save only positive resistivities
+    text = pyabemls.export.ohm_string(topo.values, temp.values)
+    pyabemls.export.write_text(filename, text)
 
 # Function to write some project informations to .inf file
 def write_projectInfos(filename,protocol,completed):
@@ -63,216 +46,207 @@ protocols_path = pathlib.Path(r'D:\data\artek\stations\QEQ-ERT-02-RPi2\from_terr
 project_path = pathlib.Path(r'D:\data\artek\stations\QEQ-ERT-02-RPi2\from_terrameter\projects')
 
 
-info_db_file = pathlib.Path('./QEQ-ERT-02_task_info.ftr')
+task_info_store = pathlib.Path('./QEQ-ERT-02_task_info')   # monthly parquet partitions
+temperature_store = pathlib.Path('./QEQ-ERT-02_temperatures')
+ext_power_store = pathlib.Path('./QEQ-ERT-02_ext_power')
+info_db_file = pathlib.Path('./QEQ-ERT-02_task_info.ftr')  # feather table of earlier versions, imported once
+protocol_cache_file = pathlib.Path('./QEQ-ERT-02_protocol_cache.json')
+manifest_file = pathlib.Path('./QEQ-ERT-02_ingest_manifest.json')
+listing_cache_file = pathlib.Path('./QEQ-ERT-02_project_listing.json')
+metrics_file = pathlib.Path('./QEQ-ERT-02_ingest_metrics.jsonl')   # timings of each run and file read
+checkpoint_file = pathlib.Path('./QEQ-ERT-02_ingest_checkpoint.json')   # progress of an unfinished run
+quarantine_file = pathlib.Path('./QEQ-ERT-02_ingest_quarantine.json')   # project files that failed
+checkpoint_every = 50        # Write the outputs every so many projects
+start_date = dt.datetime(2021,6,26)   # We launched the system on 2021-06-27, skip everything before
 force_reprocessing = False   # Set this to True to reprocess all files!
-
-# Get expected measures of protocol files used
-# and create a lookup dictionary
-nm_dipdip = get_expected_measure_nb(str(protocols_path/'DipoleDipole64_DISKO.xml'))
-nm_grad = get_expected_measure_nb(str(protocols_path/'GradientXL_64_DISKO.xml'))
-
-nominal_measures = {'2x32gradientXL_1': nm_grad,
-                    '2x32dipdip_1': nm_dipdip}
+n_workers = None             # Number of processes reading projects, None to use all cores
 
 # Imoprt topography - at this stage it is a simplified topography and only for pygimli
 # NOT NEEDED NOW, ONLY FOR EXPORT OF TOPOGRAPHY IN DAT FILES IN MARCOS VERSION
 #topo = pd.read_csv("topography_DISKO.txt",sep="\t",header=None)
 
-# Get db files in test_data folder
-db_files = list(project_path.rglob('*.db'))
-#print(db_files)
-
-# import database of task info, if it exists
-if info_db_file.exists() and not force_reprocessing:
-    task_df = pd.read_feather(info_db_file)
-else:
-    task_df = None
 
-#pdb.set_trace()
-
-
-# Loop to process all db files and extract information
-task_info_export = []
-for file in db_files:
-    
-    # Extract information from project folder name
-    rel_file = file.relative_to(project_path)
-    project_name = str(rel_file.parent)
-    pattern = r'[^_0-9]'
-    if re.search(pattern, project_name):
-        # invalid characters present (anything other than _ and 0-9)
-        continue
-    proj_date = du.parser.parse(project_name[0:6], yearfirst=True, dayfirst=False)
-    
-    if proj_date < dt.datetime(2021,6,26):
-        # We launched the system on 2021-06-27, skip everything before
-        continue
-
-    # Did we already process this file?
-    if task_df is not None:
-        if project_name in task_df['proj_name'].values:
-            print('File {0} was previously processed, skipping.'.format(rel_file))
+def find_projects(discovery, manifest=None, stage_names=(), verbose=True, quarantine=None):
+    """Return (file, project_name, proj_date) of the project files to process,
+    sorted by project name.
+
+    Project folders with invalid names or dated before the start date are
+    skipped by the discovery. If a manifest is passed, only files that are new
+    or changed since they were recorded in it, or that were not yet read by
+    all the stages in stage_names, are returned. If a quarantine manifest is
+    passed, files that failed before are skipped until they change. Skipped
+    files are reported if verbose is True.
+    """
+    projects = []
+    for file, project_name, proj_date in discovery.projects():
+
+        # Did we already process this file, and is it unchanged since?
+        if manifest is not None:
+            if (not manifest.needs_update(file)
+                    and set(stage_names) <= set(manifest.get(file).get('stages', []))):
+                if verbose:
+                    print('File {0} was previously processed, skipping.'.format(file.relative_to(project_path)))
+                continue
+
+        # Did this file fail before, and is it unchanged since?
+        if quarantine is not None and file in quarantine and not quarantine.needs_update(file):
+            if verbose:
+                print('File {0} is quarantined ({1}), skipping.'.format(
+                    file.relative_to(project_path), quarantine.get(file).get('error')))
             continue
-    
-    print('Reading file: {0}'.format(rel_file))
-    
-    # Read project file
-    try:
-        alsp = pyabemls.ABEMLS_project(str(file)) # Get db file
-    except:
-        print('Could not open project!')
-        continue
         
-    # Get all task information, including data counts
-    task_list = alsp.get_tasklist(no_count=False) # get task list
-    
-    #pdb.set_trace()
+        projects.append((file, project_name, proj_date))
     
-    if len(task_list) == 0:
-        # project is empty
-        continue
+    return projects
 
-    log_info = alsp.execute_sql('SELECT * FROM Log')
-    log_df = pd.DataFrame(log_info[0], columns=log_info[1])    
 
-    for rid, row in task_list.iterrows():
-        
-        #tmp = alsp.execute_sql('SELECT * FROM AcqSettings WHERE key1 == {0} AND key2 == {0}'.format(row['ID']))
-        #acq_settings = pd.DataFrame(tmp[0], columns=tmp[1])
-        acq_settings = alsp.settings[row['ID']]
-        
-        if 'ecr' in row['Name'].lower():
-            config = 'ecr'
-        elif 'gradient' in row['Name'].lower():
-            config = 'gradient'
-        elif 'gradient' in row['Name'].lower():
-            config = 'gradient'
-        
-        # store all standard parameters
-        task_info = dict(proj_name=project_name,
-                         proj_date=proj_date,
-                         task_name=row['Name'],
-                         task_id=row['ID'],
-                         protocol=pathlib.Path(row['ProtocolFile']).name,
-                         configuration=config,
-                         time_created=row['Time'],
-                         nECRdata=row['nECRdata'],
-                         nDipoles=row['nDipoles'],
-                         nominal=0,
-                         completed_pct=0,
-                         Started=None,
-                         Completed=None,
-                         Quit=None,
-                         )
-        
-        # This is the full list of available settings from the Terrameter LS:
-        # ['AGC_TimeSec', 'Acq_DelaySec', 'Acq_TimeSec', 'AutoStack',
-        #     'BaseFreqHz', 'BoreholeStepDown', 'BoreholeStepUp',
-        #     'CurrentLimitHighAmpere', 'CurrentLimitLowAmpere', 'DoInitialAGC',
-        #     'ElectrodeResistanceBadLimitHighOhm',
-        #     'ElectrodeResistanceBadLimitLowOhm', 'ElectrodeTest',
-        #     'ElectrodeTestCurrentAmpere', 'ErrorLimit', 'Fullwaveform',
-        #     'IPSP_TimeSec', 'IP_MinOffTimeSec', 'IP_OffTimeSec',
-        #     'IP_WindowSecList', 'LogFluidResistivity', 'LogLateral18foot',
-        #     'LogLongNormal', 'LogSelfPotential', 'LogShortNormal',
-        #     'LogTemperature', 'MarginLimitHigh', 'MeasureMode', 'Measure_SNR',
-        #     'PowerLimitHighWatt', 'PowerLimitLowWatt',
-        #     'PowerLossLimitHighWatt', 'SNR_TimeSec', 'SP_TimeSec',
-        #     'SampleRateHz', 'StackLimitsHigh', 'StackLimitsLow', 'StackNorm',
-        #     'VoltageLimitHighVolt', 'VoltageLimitLowVolt']
-        
-        # Fields that we choose to report:
-        fields = ['Acq_DelaySec', 
-                  'Acq_TimeSec', 
-                  'CurrentLimitHighAmpere',
-                  'CurrentLimitLowAmpere', 
-                  'ElectrodeResistanceBadLimitHighOhm',
-                  'ElectrodeResistanceBadLimitLowOhm', 
-                  'ElectrodeTest',
-                  'ElectrodeTestCurrentAmpere', 
-                  'Fullwaveform',
-                  'IP_OffTimeSec',  # Treated separately, to set to 0 if in resistivity mode
-                  'MeasureMode'     # This is treated separately, to make it human readable
-                  ]
-                  
-        float_fields =  ['Acq_DelaySec', 
-                         'Acq_TimeSec', 
-                         'CurrentLimitHighAmpere',
-                         'CurrentLimitLowAmpere', 
-                         'ElectrodeResistanceBadLimitHighOhm',
-                         'ElectrodeResistanceBadLimitLowOhm', 
-                         'ElectrodeTestCurrentAmpere', 
-                         'IP_OffTimeSec',  # Treated separately, to set to 0 if in resistivity mode
-                         ]
-        # Add acquisition settings
-        for f in fields:
-            #task_info[f] = acq_settings[acq_settings['Setting'] == f]['Value'].values[0]
-            if f in float_fields:
-                task_info[f] = float(acq_settings[f])
-            else:
-                task_info[f] = acq_settings[f]
-            
-        # Convert MeasureMode to human readable
-        if task_info['MeasureMode'] == '2':
-            task_info['MeasureMode'] = 'Resistivity'
-        else:
-            raise ValueError('Check MeasureMode conversions from numbers to human readable... is this IP or SP measurements?')
-        
-        # If Measuremode is IP, add the off time, otherwise set it to 0 sec
-        if task_info['MeasureMode'] != 'IP':
-            task_info['IP_OffTimeSec'] = 0
-
-        # Calculate ON_time and OFF_time of waveform
-        if task_info['MeasureMode'] != 'SP':
-            # Here for Resistivity and IP waveforms
-            task_info['ON_time_sec'] = task_info['Acq_DelaySec'] + task_info['Acq_TimeSec']
-            task_info['OFF_time_sec'] = task_info['IP_OffTimeSec']
-        else:
-            # Here for SP measurements
-            task_info['ON_time_sec'] = 0
-            task_info['OFF_time_sec'] = acq_settings['SP_TimeSec']
-
-        # Add information about nominal number of measurements in the protocol
-        if task_info['task_name'] in nominal_measures.keys():
-            task_info['nominal'] = nominal_measures[task_info['task_name']]
-            
-        # Calculate the percentage of measurements completed
-        if task_info['nominal'] >0:
-            task_info['completed_pct'] = task_info['nDipoles']/task_info['nominal']*100
-        
-        # add timestamps for log events when "Measurements Started", "Measurements Completed", and "Quit".
-        for lid, logitem in log_df[log_df['TaskID']==row['ID']].iterrows():
-            if 'Measuring Started' in logitem['What']:
-                task_info['Started'] = du.parser.parse(logitem['Time'], yearfirst=True, dayfirst=False)
-            
-            if 'Measuring done' in logitem['What']:
-                task_info['Completed'] = du.parser.parse(logitem['Time'], yearfirst=True, dayfirst=False)
-            
-            if 'Quit' in logitem['What']:
-                task_info['Quit'] = du.parser.parse(logitem['Time'], yearfirst=True, dayfirst=False)
-
-        task_info['first_log_event'] = log_df[log_df['TaskID']==row['ID']].iloc[0]['Time']
-        task_info['last_log_event'] = log_df[log_df['TaskID']==row['ID']].iloc[-1]['Time']
-        # Add the task info to the list of tasks...
-        task_info_export.append(task_info)
-
-    continue
-
-#pdb.set_trace()
-
-if task_df is None:
-    task_df = pd.DataFrame(task_info_export)
-else:
-    if len(task_info_export) > 0:
-        tmp = pd.DataFrame(task_info_export)
-        task_df = task_df.append(tmp, ignore_index=True)
-
-task_df.to_feather(info_db_file)
-
-with open(pathlib.Path('D:/vapp/log.txt'), 'a') as f:
-    f.write('{0}\n'.format(dt.datetime.now()))
-    
+def load_checkpoint():
+    """Return the checkpoint of an unfinished run, or None."""
+    if not checkpoint_file.exists():
+        return None
+    try:
+        with open(checkpoint_file, 'r') as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+
+def save_checkpoint(checkpoint):
+    """Write the checkpoint atomically, so that an interrupted write leaves
+    the previous checkpoint in place."""
+    tmp = checkpoint_file.with_name(checkpoint_file.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(tmp, checkpoint_file)
+
+
+def ingest_projects(force_reprocessing=False, n_workers=None, verbose=True,
+                    checkpoint_every=checkpoint_every):
+    """Extract task info, temperatures and power readings from the project
+    files that are new or changed since the last run.
+
+    The outputs, the manifest and a checkpoint are written every
+    checkpoint_every projects. A run that is interrupted resumes from the last
+    checkpoint when started again, also when force_reprocessing is set: the
+    outputs are then only cleared if the previous forced run was completed
+    (delete checkpoint_file to start a forced run over).
+
+    Project files that cannot be opened or read are recorded in the
+    quarantine file with the error, and skipped until they change.
+
+    The timings of the run and of each file read are appended to metrics_file,
+    and a summary of the run is printed if verbose is True.
+
+    :return: list
+        (file, project_name, proj_date) of the projects read.
+    """
+    # Extractor stages, each writing one output. Every project file is opened
+    # once and all stages are run on it.
+    stages = [TaskInfoStage(task_info_store, protocols_path, protocol_cache_file=protocol_cache_file),
+              TemperatureStage(temperature_store),
+              PowerStage(ext_power_store),
+              ]
+
+    # Timings and row counts of the run and of each file read
+    metrics = IngestionMetrics(metrics_file)
+
+    # Manifest of the files already processed, with their size, mtime and
+    # checksum, so that projects still acquiring at the last run are read again
+    manifest = pyabemls.IngestionManifest(manifest_file)
+
+    # Files that failed, with their size, mtime and the error
+    quarantine = pyabemls.IngestionManifest(quarantine_file)
+
+    checkpoint = load_checkpoint()
+    if checkpoint is not None:
+        print('Resuming ingestion run started at {0} ({1} projects done).'.format(
+            checkpoint['started'], checkpoint['projects_done']))
+        # A resumed forced run must not clear the outputs written so far
+        force_reprocessing = force_reprocessing and not checkpoint['force_reprocessing']
+    else:
+        checkpoint = dict(started=metrics.run_id, force_reprocessing=force_reprocessing,
+                          projects_done=0)
+
+    # The outputs are stored in monthly partitions on the project date.
+    # Rows of projects that are read again replace the old rows.
+    if force_reprocessing:
+        for stage in stages:
+            stage.clear()
+        manifest.clear()
+        quarantine.clear()
+        # Save the cleared manifests before anything else, so that a resumed
+        # run (which does not clear again) reads all projects again
+        manifest.save()
+        quarantine.save()
+    else:
+        if stages[0].is_empty() and info_db_file.exists():
+            # import the task info table written by earlier versions, which
+            # stored the first and last log events as strings
+            old_df = pd.read_feather(info_db_file)
+            for c in ['first_log_event', 'last_log_event']:
+                old_df[c] = pd.to_datetime(old_df[c])
+            stages[0].store.append(old_df)
 
+    #pdb.set_trace()
+
+    # Find the new or changed db files, and extract information from all of them.
+    # Only project folders changed since the last run are listed again.
+    discovery = pyabemls.ProjectDiscovery(project_path, start_date=start_date,
+                                          cache_file=listing_cache_file)
+    stage_names = [stage.name for stage in stages]
+    with metrics.timer('discovery'):
+        projects = find_projects(discovery, manifest, stage_names, verbose=verbose,
+                                 quarantine=quarantine)
+    metrics.n_projects = len(projects)
+    save_checkpoint(checkpoint)
+
+    read = []
+    for chunk, results, file_metrics in iter_extraction(projects, stages, n_workers=n_workers,
+                                                        chunk_size=checkpoint_every,
+                                                        metrics=metrics):
+        #pdb.set_trace()
+
+        # Only the new rows are written, into the partitions of their project
+        # dates. The outputs are written before the manifest, so projects
+        # written but not yet recorded are read again after an interruption,
+        # and their rows replace the ones written.
+        chunk_read = collect_results(chunk, results, stages, metrics=metrics)
+        with metrics.timer('manifest'):
+            for (file, project_name, proj_date), r, m in zip(chunk, results, file_metrics):
+                if r is not None:
+                    manifest.record(file, proj_name=project_name, stages=stage_names)
+                    quarantine.remove(file)
+                elif file.exists():
+                    quarantine.record(file, proj_name=project_name, error=m.error,
+                                      time=metrics.run_id)
+            manifest.save()
+            quarantine.save()
+            discovery.save()
+            checkpoint['projects_done'] += len(chunk)
+            save_checkpoint(checkpoint)
+        read.extend(chunk_read)
+
+    # The run is complete
+    discovery.save()
+    checkpoint_file.unlink()
+
+    if verbose and len(quarantine) > 0:
+        print('{0} project files are quarantined, see {1}'.format(len(quarantine), quarantine_file))
+
+    summary = metrics.write()
+    if verbose:
+        print_summary(summary)
+
+    return read
+
+
+if __name__ == '__main__':
+
+    ingest_projects(force_reprocessing=force_reprocessing, n_workers=n_workers)
+
+    with open(pathlib.Path('D:/vapp/log.txt'), 'a') as f:
+        f.write('{0}\n'.format(dt.datetime.now()))
+    
 
 #    
 #    if task_list['ID'].size == 1: # sometimes the instrument only runs electrode test
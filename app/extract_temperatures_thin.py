@@ -1,12 +1,12 @@
 import pyabemls
+from partitioned_store import PartitionedStore
+from extractors import TemperatureStage, PowerStage, iter_extraction, project_keys
+from timeseries import as_int64_times, merge_order, take
 import pathlib
+import numpy as np
 import pandas as pd
-from xml.dom.minidom import parseString
 import ipdb as pdb
-import re
-import dateutil as du
 import datetime as dt
-import numpy as np
 
 # Please install pyarrow
 # conda install -c conda-forge pyarrow
@@ -16,27 +16,9 @@ import numpy as np
 
 # Function to convert from dat to ohm
 def dat2ohm(dat,topo, filename):
-    nsensors = topo[0].size
-    temp = dat[dat['DataValue']>=0] # Save only positive resistivities
-    file1 = open(filename,"w")
-    file1.write(str(nsensors))
-    file1.write("# Number of sensors\n")
-    file1.write("#x z\n")
-    file1.write(topo.to_string(header=None, index = False, index_names = False))
-    file1.write("\n")
-    file1.write(str(temp['DataValue'].size))
-    file1.write("# Number of data\n")
-    file1.write("#a b m n R\n")
-    file1.write(dat[dat['DataValue']>=0][::-1].to_string(header=None, index=False, index_names=False))
-    file1.close()
-
-# Function to get the total expected number of measures based on xml protocol file
-def get_expected_measure_nb(protocol):
-    file = open(protocol,"r")
-    data = file.read()
-    file.close()
-    dom = parseString(data)
-    return len(dom.getElementsByTagName('Rx'))
+    temp = dat[dat['DataValue']>=0][::-1] # Save only positive resistivities
+    text = pyabemls.export.ohm_string(topo.values, temp.values)
+    pyabemls.export.write_text(filename, text)
 
 # Function to write some project informations to .inf file
 def write_projectInfos(filename,protocol,completed):
@@ -60,122 +42,115 @@ project_path = pathlib.Path(r'D:\data\artek\stations\QEQ-ERT-02-RPi2\from_terram
 ls_log_file = pathlib.Path(r'D:\data\artek\stations\QEQ-ERT-02-RPi2\from_terrameter\home_root\logfile')
 
 
-info_db_file = pathlib.Path('./QEQ-ERT-02_task_info.ftr')
-temp_db_file = pathlib.Path('./QEQ-ERT-02_temperature_info.ftr')
+temp_info_store = pathlib.Path('./QEQ-ERT-02_temperature_info')   # monthly parquet partitions, read in time order
+temperature_store = pathlib.Path('./QEQ-ERT-02_temperatures')
+ext_power_store = pathlib.Path('./QEQ-ERT-02_ext_power')
+temp_manifest_file = pathlib.Path('./QEQ-ERT-02_temperature_manifest.json')
+listing_cache_file = pathlib.Path('./QEQ-ERT-02_project_listing.json')
+start_date = dt.datetime(2021,6,26)   # We launched the system on 2021-06-27, skip everything before
 force_reprocessing = False   # Set this to True to reprocess all files!
-
-
-# Get expected measures of protocol files used
-# and create a lookup dictionary
-nm_dipdip = get_expected_measure_nb(str(protocols_path/'DipoleDipole64_DISKO.xml'))
-nm_grad = get_expected_measure_nb(str(protocols_path/'GradientXL_64_DISKO.xml'))
-
-nominal_measures = {'2x32gradientXL_1': nm_grad,
-                    '2x32dipdip_1': nm_dipdip}
-
-# Get db files in test_data folder
-db_files = list(project_path.rglob('*.db'))
-#print(db_files)
-
-# import database of task info, if it exists
-if info_db_file.exists() and not force_reprocessing:
-    task_df = pd.read_feather(info_db_file)
-else:
-    task_df = None
-
-# import database of temperature info, if it exists
-if temp_db_file.exists() and not force_reprocessing:
-    temp_df = pd.read_feather(temp_db_file)
-else:
-    temp_df = None
-    
-
-# Loop to process all db files and extract information
-
-info = {}
-info['Time'] = []
-info['Temp'] = []
-info['ExtPowerVolt'] = []
-
-for file in db_files:
-    
-    # Extract information from project folder name
-    rel_file = file.relative_to(project_path)
-    project_name = str(rel_file.parent)
-    pattern = r'[^_0-9]'
-    if re.search(pattern, project_name):
-        # invalid characters present (anything other than _ and 0-9)
-        continue
-    proj_date = du.parser.parse(project_name[0:6], yearfirst=True, dayfirst=False)
-    
-    if proj_date < dt.datetime(2021,6,26):
-        # We launched the system on 2021-06-27, skip everything before
-        continue
-
-    ## Did we already process this file?
-    #if task_df is not None:
-    #    if project_name in task_df['proj_name'].values:
-    #        print('File {0} was previously processed, skipping.'.format(rel_file))
-    #        continue
-    
-    print('Reading file: {0}'.format(rel_file))
-    
-    # Read project file
-    try:
-        alsp = pyabemls.ABEMLS_project(str(file)) # Get db file
-    except:
-        print('Could not open project!')
-        continue
-        
-    # Get all task information, including data counts
-    task_list = alsp.get_tasklist(no_count=False) # get task list
-        
-    if len(task_list) == 0:
-        # project is empty
-        continue
-    
-    log_info = alsp.execute_sql('SELECT * FROM Log')
-    log_df = pd.DataFrame(log_info[0], columns=log_info[1])    
-
-    info['Time'].extend(log_df['Time'].values.tolist())
-    info['ExtPowerVolt'].extend(log_df['ExtPowerVolt'].values.tolist())
-    info['Temp'].extend(log_df['Temp'].values.tolist())
-    
-    for rid, row in task_list.iterrows():
-        
-        acq_settings = alsp.settings[row['ID']]
-        
-        if 'ecr' in row['Name'].lower():
-            config = 'ecr'
-            continue
-        elif 'gradient' in row['Name'].lower():
-            config = 'gradient'
-        elif 'gradient' in row['Name'].lower():
-            config = 'gradient'
-        
-        data, ecr_data = alsp.get_task(task_id=row['ID'])
-        
-        if len(data)==0:
+n_workers = None             # Number of processes reading projects, None to use all cores
+batch_size = 50              # Number of projects written (and recorded in the manifest) at a time
+
+
+# Temperature and external power readings, extracted by the same stages as
+# used in db_preparation_thin.py
+stages = [TemperatureStage(temperature_store), PowerStage(ext_power_store)]
+
+NAT = np.datetime64('NaT', 'ns').view(np.int64)
+
+
+def temperature_info_store():
+    """The temperature info table: Time, Temp and ExtPowerVolt readings of all
+    projects, partitioned on the project date and read in time order. Rows of
+    projects that are read again replace their old rows."""
+    return PartitionedStore(temp_info_store, time_column='proj_date', replace_on='proj_name',
+                            order_by='Time')
+
+
+def project_temperatures(results):
+    """Return the temperature and power readings of one project (results of
+    extract_project) as typed arrays sorted on time: Time as int64
+    nanoseconds, and Temp and ExtPowerVolt as float32, NaN where a row holds
+    the other reading. Readings without a valid time are dropped."""
+    temperatures = results[stages[0].name]
+    power = results[stages[1].name]
+    n_temp = len(temperatures)
+
+    times = np.concatenate([as_int64_times(temperatures['Time']), as_int64_times(power['Time'])])
+    temp = np.full(len(times), np.nan, dtype=np.float32)
+    temp[:n_temp] = temperatures['Temp'].values
+    volt = np.full(len(times), np.nan, dtype=np.float32)
+    volt[n_temp:] = power['ExtPowerVolt'].values
+
+    # The readings of a project are nearly in time order, so this is cheap
+    valid = np.flatnonzero(times != NAT)
+    order = valid[np.argsort(times[valid], kind='stable')]
+    return dict(Time=times[order], Temp=temp[order], ExtPowerVolt=volt[order])
+
+
+def merge_temperatures(projects, arrays):
+    """Merge the typed arrays of several projects (see project_temperatures)
+    into one table sorted on Time, without a global sort.
+
+    :param projects: list
+        (file, project_name, proj_date) of each project.
+    """
+    times, order = merge_order([a['Time'] for a in arrays])
+    lengths = [len(a['Time']) for a in arrays]
+    names = np.repeat(np.array([p[1] for p in projects], dtype=object), lengths)
+    dates = np.repeat(np.array([p[2] for p in projects], dtype='datetime64[ns]'), lengths)
+    return pd.DataFrame({'proj_name': take(names, order),
+                         'proj_date': take(dates, order),
+                         'Time': times.view('datetime64[ns]'),
+                         'Temp': take(np.concatenate([a['Temp'] for a in arrays]), order),
+                         'ExtPowerVolt': take(np.concatenate([a['ExtPowerVolt'] for a in arrays]), order),
+                         }, copy=False)
+
+
+if __name__ == '__main__':
+
+    store = temperature_info_store()
+
+    # Manifest of the projects already extracted, with their size, mtime and
+    # checksum, so that only new or changed databases are read
+    manifest = pyabemls.IngestionManifest(temp_manifest_file)
+    if force_reprocessing:
+        store.clear()
+        manifest.clear()
+        # Save the cleared manifest at once, so that the projects are read
+        # again if the run is interrupted
+        manifest.save()
+
+    # Get db files of the projects from the start date, only listing the
+    # project folders changed since the last run
+    discovery = pyabemls.ProjectDiscovery(project_path, start_date=start_date,
+                                          cache_file=listing_cache_file)
+    projects = []
+    for file, project_name, proj_date in discovery.projects():
+        if not manifest.needs_update(file):
+            print('File {0} was previously processed, skipping.'.format(file.relative_to(project_path)))
             continue
-        
-        temperatures = data[(data['DatatypeID']==13)]
-        
-        if len(temperatures)==0:
-            continue
-                
-        info['Time'].extend(temperatures['Time'].values.tolist())
-        info['Temp'].extend(temperatures['DataValue'].values.tolist())
-        info['ExtPowerVolt'].extend((np.zeros(len(temperatures))*np.nan).tolist())
-    
-    
-temp_df = pd.DataFrame(info)
-temp_df['Time'] = pd.to_datetime(temp_df['Time'])
-temp_df['Temp'] = temp_df['Temp'].apply(pd.to_numeric, errors='coerce')
-temp_df['ExtPowerVolt'] = temp_df['ExtPowerVolt'].apply(pd.to_numeric, errors='coerce')
-
-temp_df = temp_df.sort_values(by='Time')
-temp_df = temp_df.reset_index()
-temp_df = temp_df.drop(columns='index')
-
-temp_df.to_feather(temp_db_file)
-
+        projects.append((file, project_name, proj_date))
+
+    # Open each new or changed project once, and extract both temperatures
+    # and power readings. The projects are written in batches, each recorded
+    # in the manifest once written, so that an interrupted run only reads the
+    # projects not written yet.
+    for batch, results, file_metrics in iter_extraction(projects, stages, n_workers=n_workers,
+                                                        chunk_size=batch_size):
+        read = [(p, r) for p, r in zip(batch, results) if r is not None]
+
+        # Only the readings of the projects read are written, into the
+        # partitions of their project dates, replacing all their old rows.
+        # Projects that could not be opened are tried again next time.
+        if read:
+            arrays = [project_temperatures(r) for p, r in read]
+            read_projects = [p for p, r in read]
+            store.append(merge_temperatures(read_projects, arrays),
+                         replace_keys=project_keys(read_projects))
+        for (file, project_name, proj_date), r in read:
+            manifest.record(file, proj_name=project_name)
+        manifest.save()
+        discovery.save()
+    discovery.save()
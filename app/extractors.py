@@ -0,0 +1,487 @@
+import pathlib
+import numpy as np
+import pandas as pd
+from functools import cached_property
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import pyabemls
+from partitioned_store import PartitionedStore
+from ingestion_metrics import FileMetrics
+
+# Please install pyarrow
+# conda install -c conda-forge pyarrow
+
+
+################################################################
+# Extraction of several outputs from the project files, visiting each
+# project database once.
+#
+# Each output is produced by an extractor stage. The extract method of a stage
+# runs in the worker processes and returns plain, picklable results (records
+# or dataframes) for one project. The collect method runs in the main process
+# with the results of all projects read, and writes the output.
+#
+#    stages = [TaskInfoStage(...), TemperatureStage(...), PowerStage(...)]
+#    results = run_extraction(projects, stages, n_workers=4, metrics=metrics)
+#    collect_results(projects, results, stages, metrics=metrics)
+#
+# The time spent in each query and parsing step of a project is recorded in
+# its FileMetrics, see ingestion_metrics.py.
+################################################################
+
+
+class ProjectSource():
+    """A project database opened for extraction.
+
+    The task list, the settings and the Log table are read on first use and
+    shared by all stages, so each is read once per project whatever the number
+    of stages. The time spent reading and parsing them is recorded in metrics.
+    """
+
+    def __init__(self, file, project_name, proj_date, counts=None, metrics=None):
+        """
+        :param counts: list of str
+            Data counts to include in the task list, see
+            ABEMLS_project.get_tasklist.
+        :param metrics: FileMetrics
+            Metrics of reading the file. If None, a new one is created.
+        """
+        self.file = pathlib.Path(file)
+        self.project_name = project_name
+        self.proj_date = proj_date
+        self.counts = [] if counts is None else list(counts)
+        self.metrics = FileMetrics(file, project_name) if metrics is None else metrics
+        with self.metrics.timer('open'):
+            self.alsp = pyabemls.ABEMLS_project(str(file))
+            self.alsp.connect()
+
+    def close(self):
+        self.alsp.close()
+
+    @cached_property
+    def task_list(self):
+        with self.metrics.timer('query', 'get_tasklist'):
+            task_list = self.alsp.get_tasklist(counts=self.counts)
+        self.metrics.add_rows('get_tasklist', len(task_list))
+        return task_list
+
+    @cached_property
+    def settings(self):
+        """Acquisition settings of the tasks, see ABEMLS_project.get_settings_dict."""
+        with self.metrics.timer('query', 'get_settings_dict'):
+            return self.alsp.settings
+
+    @cached_property
+    def log(self):
+        with self.metrics.timer('query', 'log'):
+            rows, cols = self.alsp.execute_sql('SELECT * FROM Log ORDER BY ID')
+        self.metrics.add_rows('log', len(rows))
+        with self.metrics.timer('parse', 'log_frame'):
+            return pd.DataFrame(rows, columns=cols)
+
+    @cached_property
+    def log_times(self):
+        """Times of the Log table entries as datetime64 values."""
+        log = self.log
+        with self.metrics.timer('parse', 'parse_times'):
+            return pyabemls.parse_times(log['Time']).values
+
+    @cached_property
+    def log_events(self):
+        log = self.log
+        with self.metrics.timer('parse', 'log_events'):
+            return pyabemls.log_events(log)
+
+
+def project_keys(projects):
+    """Return the replace keys (proj_name and proj_date) of projects, as
+    passed to PartitionedStore.append to replace all rows of the projects.
+
+    :param projects: list
+        (file, project_name, proj_date) of each project.
+    """
+    return pd.DataFrame({'proj_name': [p[1] for p in projects],
+                         'proj_date': pd.to_datetime([p[2] for p in projects])})
+
+
+class ExtractorStage():
+    """Base class of the extractor stages, storing their output in a
+    PartitionedStore partitioned on the project date. Rows of projects that
+    are read again replace their old rows."""
+
+    name = None
+    counts = []      # data counts needed in the task list
+    columns = []     # columns of the results
+
+    def __init__(self, store_path):
+        self.store_path = pathlib.Path(store_path)
+
+    @property
+    def store(self):
+        return PartitionedStore(self.store_path, time_column='proj_date', replace_on='proj_name')
+
+    def is_empty(self):
+        return self.store.is_empty()
+
+    def clear(self):
+        self.store.clear()
+
+    def extract(self, source):
+        """Return the results of one project (ProjectSource)."""
+        raise NotImplementedError
+
+    def combine(self, results):
+        """Combine the results of several projects into one dataframe."""
+        frames = [r for r in results if len(r) > 0]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def collect(self, results, projects=None):
+        """Write the results of the projects read to the output.
+
+        :param projects: list
+            (file, project_name, proj_date) of the projects read. If given,
+            the old rows of the projects that gave no results are deleted.
+        """
+        replace_keys = None if projects is None else project_keys(projects)
+        self.store.append(self.combine(results), replace_keys=replace_keys)
+
+    def _series(self, source, columns):
+        """Return a dataframe of the given columns with the project name and
+        date added first."""
+        df = pd.DataFrame(columns)
+        df.insert(0, 'proj_date', pd.Timestamp(source.proj_date))
+        df.insert(0, 'proj_name', source.project_name)
+        return df
+
+
+# Acquisition settings that we choose to report:
+# This is the full list of available settings from the Terrameter LS:
+# ['AGC_TimeSec', 'Acq_DelaySec', 'Acq_TimeSec', 'AutoStack',
+#     'BaseFreqHz', 'BoreholeStepDown', 'BoreholeStepUp',
+#     'CurrentLimitHighAmpere', 'CurrentLimitLowAmpere', 'DoInitialAGC',
+#     'ElectrodeResistanceBadLimitHighOhm',
+#     'ElectrodeResistanceBadLimitLowOhm', 'ElectrodeTest',
+#     'ElectrodeTestCurrentAmpere', 'ErrorLimit', 'Fullwaveform',
+#     'IPSP_TimeSec', 'IP_MinOffTimeSec', 'IP_OffTimeSec',
+#     'IP_WindowSecList', 'LogFluidResistivity', 'LogLateral18foot',
+#     'LogLongNormal', 'LogSelfPotential', 'LogShortNormal',
+#     'LogTemperature', 'MarginLimitHigh', 'MeasureMode', 'Measure_SNR',
+#     'PowerLimitHighWatt', 'PowerLimitLowWatt',
+#     'PowerLossLimitHighWatt', 'SNR_TimeSec', 'SP_TimeSec',
+#     'SampleRateHz', 'StackLimitsHigh', 'StackLimitsLow', 'StackNorm',
+#     'VoltageLimitHighVolt', 'VoltageLimitLowVolt']
+TASK_FIELDS = ['Acq_DelaySec',
+               'Acq_TimeSec',
+               'CurrentLimitHighAmpere',
+               'CurrentLimitLowAmpere',
+               'ElectrodeResistanceBadLimitHighOhm',
+               'ElectrodeResistanceBadLimitLowOhm',
+               'ElectrodeTest',
+               'ElectrodeTestCurrentAmpere',
+               'Fullwaveform',
+               'IP_OffTimeSec',  # Treated separately, to set to 0 if in resistivity mode
+               'MeasureMode'     # This is treated separately, to make it human readable
+               ]
+
+TASK_FLOAT_FIELDS = ['Acq_DelaySec',
+                     'Acq_TimeSec',
+                     'CurrentLimitHighAmpere',
+                     'CurrentLimitLowAmpere',
+                     'ElectrodeResistanceBadLimitHighOhm',
+                     'ElectrodeResistanceBadLimitLowOhm',
+                     'ElectrodeTestCurrentAmpere',
+                     'IP_OffTimeSec',  # Treated separately, to set to 0 if in resistivity mode
+                     ]
+
+
+class TaskInfoStage(ExtractorStage):
+    """One row per task with the acquisition settings, data counts, log event
+    times and the percentage of the protocol completed."""
+
+    name = 'task_info'
+    counts = ['nDipoles', 'nECRdata']
+
+    def __init__(self, store_path, protocols_path, protocol_cache_file=None):
+        """
+        :param protocols_path: str or Path
+            Folder holding the protocol files, to look up the nominal number
+            of measurements of each task.
+        :param protocol_cache_file: str or Path
+            Cache file of the protocol registry.
+        """
+        super().__init__(store_path)
+        self.protocols_path = protocols_path
+        self.protocol_cache_file = protocol_cache_file
+
+    def extract(self, source):
+        task_list = source.task_list
+        if len(task_list) == 0:
+            return []
+
+        # Timestamps of the first and last log entries, and of when measurements
+        # were started, completed and quit, for all tasks at once
+        log_events = source.log_events.reindex(task_list['ID']).to_dict('index')
+        settings = source.settings
+
+        records = []
+        for rid, row in task_list.iterrows():
+
+            acq_settings = settings[row['ID']]
+
+            if 'ecr' in row['Name'].lower():
+                config = 'ecr'
+            elif 'gradient' in row['Name'].lower():
+                config = 'gradient'
+            elif 'gradient' in row['Name'].lower():
+                config = 'gradient'
+
+            # store all standard parameters
+            task_info = dict(proj_name=source.project_name,
+                             proj_date=source.proj_date,
+                             task_name=row['Name'],
+                             task_id=row['ID'],
+                             protocol=pathlib.Path(row['ProtocolFile']).name,
+                             protocol_file=row['ProtocolFile'],
+                             configuration=config,
+                             time_created=row['Time'],
+                             nECRdata=row['nECRdata'],
+                             nDipoles=row['nDipoles'],
+                             nominal=0,
+                             completed_pct=0,
+                             Started=None,
+                             Completed=None,
+                             Quit=None,
+                             )
+
+            # Add acquisition settings
+            for f in TASK_FIELDS:
+                if f in TASK_FLOAT_FIELDS:
+                    task_info[f] = float(acq_settings[f])
+                else:
+                    task_info[f] = acq_settings[f]
+
+            # Convert MeasureMode to human readable
+            if task_info['MeasureMode'] == '2':
+                task_info['MeasureMode'] = 'Resistivity'
+            else:
+                raise ValueError('Check MeasureMode conversions from numbers to human readable... is this IP or SP measurements?')
+
+            # If Measuremode is IP, add the off time, otherwise set it to 0 sec
+            if task_info['MeasureMode'] != 'IP':
+                task_info['IP_OffTimeSec'] = 0
+
+            # Calculate ON_time and OFF_time of waveform
+            if task_info['MeasureMode'] != 'SP':
+                # Here for Resistivity and IP waveforms
+                task_info['ON_time_sec'] = task_info['Acq_DelaySec'] + task_info['Acq_TimeSec']
+                task_info['OFF_time_sec'] = task_info['IP_OffTimeSec']
+            else:
+                # Here for SP measurements
+                task_info['ON_time_sec'] = 0
+                task_info['OFF_time_sec'] = acq_settings['SP_TimeSec']
+
+            # add timestamps for log events when "Measurements Started", "Measurements Completed", and "Quit",
+            # and of the first and last log events of the task.
+            task_info.update(log_events[row['ID']])
+
+            # Add the task info to the list of tasks...
+            records.append(task_info)
+        return records
+
+    def combine(self, results):
+        # Registry of the protocol files, to look up the expected number of measures
+        # of each task from its ProtocolFile setting. Counts are cached between runs.
+        protocols = pyabemls.ProtocolRegistry(self.protocols_path, cache_file=self.protocol_cache_file)
+
+        task_info_export = [task_info for records in results for task_info in records]
+        for task_info in task_info_export:
+            # Add information about nominal number of measurements in the protocol
+            task_info['nominal'] = protocols.nominal_measures(task_info.pop('protocol_file'))
+
+            # Calculate the percentage of measurements completed
+            if task_info['nominal'] >0:
+                task_info['completed_pct'] = task_info['nDipoles']/task_info['nominal']*100
+
+        protocols.save()
+        return pd.DataFrame(task_info_export)
+
+
+class TemperatureStage(ExtractorStage):
+    """Temperature readings: the Temp column of the Log table, and the
+    temperature measurements (DatatypeID 13) of the measurement tasks.
+    Times are datetime64 and temperatures float32."""
+
+    name = 'temperatures'
+    columns = ['proj_name', 'proj_date', 'Time', 'Temp', 'source']
+
+    def extract(self, source):
+        task_list = source.task_list
+        if len(task_list) == 0:
+            return pd.DataFrame(columns=self.columns)
+
+        log = source.log
+        temp = pd.to_numeric(log['Temp'], errors='coerce').values.astype(np.float32)
+        valid = ~np.isnan(temp)
+        frames = [self._series(source, {'Time': source.log_times[valid],
+                                        'Temp': temp[valid],
+                                        'source': 'log'})]
+
+        # Electrode tests (ECR) contain no temperature data
+        task_ids = [tid for tid, name in zip(task_list['ID'], task_list['Name'])
+                    if 'ecr' not in name.lower()]
+
+        # Read temperature data (DatatypeID 13) of all tasks in one pass. Tasks
+        # are fetched as they are iterated, so the loop is timed as the query.
+        with source.metrics.timer('query', 'iter_tasks'):
+            for task_id, temperatures, ecr_data in source.alsp.iter_tasks(task_ids=task_ids,
+                                                                          columns=['Time', 'DataValue'],
+                                                                          datatype_id=13,
+                                                                          electrode_tests=False):
+                source.metrics.add_rows('iter_tasks', len(temperatures))
+                if len(temperatures)==0:
+                    continue
+                frames.append(self._series(source, {'Time': temperatures['Time'].values,
+                                                    'Temp': temperatures['DataValue'].values.astype(np.float32),
+                                                    'source': 'dpv'}))
+        return pd.concat(frames, ignore_index=True)
+
+
+class PowerStage(ExtractorStage):
+    """External power supply voltage readings (float32) from the Log table."""
+
+    name = 'ext_power'
+    columns = ['proj_name', 'proj_date', 'Time', 'ExtPowerVolt']
+
+    def extract(self, source):
+        if len(source.task_list) == 0:
+            return pd.DataFrame(columns=self.columns)
+
+        volt = pd.to_numeric(source.log['ExtPowerVolt'], errors='coerce').values.astype(np.float32)
+        valid = ~np.isnan(volt)
+        return self._series(source, {'Time': source.log_times[valid],
+                                     'ExtPowerVolt': volt[valid]})
+
+
+def extract_project(file, project_name, proj_date, stages):
+    """Open a project once and run all extractor stages on it.
+
+    :return: tuple
+        (results, metrics): the result of each stage by stage name, or None
+        if the project could not be opened or a stage failed on it, and the
+        FileMetrics of the file, holding the error of a failed project.
+    """
+    print('Reading file: {0}'.format(file))
+
+    counts = sorted(set(c for stage in stages for c in stage.counts))
+    metrics = FileMetrics(file, project_name)
+
+    # Read project file. Project metadata is read on first use, so the
+    # task list is read here to catch files that cannot be opened.
+    try:
+        source = ProjectSource(file, project_name, proj_date, counts=counts, metrics=metrics)
+        source.task_list
+    except Exception as e:
+        print('Could not open project! ({0})'.format(file))
+        metrics.failed(e)
+        metrics.finish()
+        return None, metrics
+
+    # A stage failing on a project (e.g. unexpected settings) drops the
+    # results of all stages for that project, but does not stop the run
+    try:
+        results = dict()
+        for stage in stages:
+            with metrics.timer('extract', stage.name):
+                try:
+                    results[stage.name] = stage.extract(source)
+                except Exception as e:
+                    print('Could not extract {0} from project! ({1}: {2})'.format(stage.name, file, e))
+                    metrics.failed('{0}: {1}'.format(stage.name, e))
+                    return None, metrics
+        return results, metrics
+    finally:
+        source.close()
+        metrics.finish()
+
+
+def iter_extraction(projects, stages, n_workers=None, chunk_size=None, metrics=None):
+    """Run the extractor stages on many projects, using one pool of worker
+    processes, and yield the results chunk by chunk, so that they can be
+    written as they come.
+
+    :param projects: list
+        (file, project_name, proj_date) of each project.
+    :param stages: list
+        The extractor stages.
+    :param n_workers: integer
+        Number of worker processes. If None, the number of processors is used.
+        With n_workers=1 the projects are read in this process.
+    :param chunk_size: integer
+        Number of projects per chunk. If None, all projects are one chunk.
+    :param metrics: IngestionMetrics
+        If given, the metrics of each file read and the time spent reading
+        them are added to it.
+
+    :return: generator
+        (projects, results, file_metrics) of each chunk, with the results and
+        FileMetrics returned by extract_project for each project.
+    """
+    chunk_size = chunk_size or max(len(projects), 1)
+    chunks = [projects[i:i + chunk_size] for i in range(0, len(projects), chunk_size)]
+
+    def read(chunk, pool):
+        with metrics.timer('extraction') if metrics is not None else nullcontext():
+            if pool is None:
+                returned = [extract_project(*p, stages) for p in chunk]
+            else:
+                returned = list(pool.map(extract_project, *zip(*chunk), [stages]*len(chunk)))
+        if metrics is not None:
+            for results, file_metrics in returned:
+                metrics.add(file_metrics)
+        return [r for r, m in returned], [m for r, m in returned]
+
+    if n_workers == 1 or len(projects) <= 1:
+        for chunk in chunks:
+            yield (chunk,) + read(chunk, None)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for chunk in chunks:
+                yield (chunk,) + read(chunk, pool)
+
+
+def run_extraction(projects, stages, n_workers=None, metrics=None):
+    """Run the extractor stages on many projects, using a pool of worker
+    processes. See iter_extraction for the parameters.
+
+    :return: list
+        The results of each project as returned by extract_project (None for
+        projects that could not be read), in the order of projects.
+    """
+    results = []
+    for chunk, chunk_results, file_metrics in iter_extraction(projects, stages, n_workers=n_workers,
+                                                              metrics=metrics):
+        results.extend(chunk_results)
+    return results
+
+
+def collect_results(projects, results, stages, metrics=None):
+    """Pass the results of the projects that could be read to the stages.
+
+    :param metrics: IngestionMetrics
+        If given, the time spent writing each output is added to it.
+
+    :return: list
+        (file, project_name, proj_date) of the projects that were read.
+    """
+    read = [(p, r) for p, r in zip(projects, results) if r is not None]
+    read_projects = [p for p, r in read]
+    for stage in stages:
+        if metrics is None:
+            stage.collect([r[stage.name] for p, r in read], read_projects)
+        else:
+            with metrics.timer('write:' + stage.name):
+                stage.collect([r[stage.name] for p, r in read], read_projects)
+    return read_projects
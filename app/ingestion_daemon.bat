@@ -0,0 +1,4 @@
+REM Keeps the dashboard data up to date, instead of running update_db.bat as a batch job
+call D:\vapp\env\Scripts\activate
+cd D:\vapp
+python ingestion_daemon.py
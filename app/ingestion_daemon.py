@@ -0,0 +1,248 @@
+import os
+import time
+import queue
+import pathlib
+import datetime as dt
+import traceback
+
+import pyabemls
+import db_preparation_thin
+import voltage_log_processing
+
+# File system notifications (inotify on Linux, ReadDirectoryChangesW on Windows)
+# are used if the watchdog package is installed, otherwise the watched files
+# are polled.
+# pip install watchdog
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+################################################################
+# Long running ingestion service. Watches the project folder, the supply
+# voltage log and the Terrameter logfile, and updates the outputs of the
+# changed sources only:
+#
+#   projects, Terrameter logfile  ->  db_preparation_thin.ingest_projects
+#   supply voltage log            ->  voltage_log_processing.process_supply_voltage
+#
+# Changes are debounced: a source is processed when it has been quiet for
+# DEBOUNCE_SECONDS, or at the latest MAX_DELAY_SECONDS after its first
+# unprocessed change, so that outputs are also updated while a project is
+# still being mirrored from the station.
+################################################################
+
+DEBOUNCE_SECONDS = 20       # quiet time before processing a changed source
+MAX_DELAY_SECONDS = 300     # longest delay of processing while changes keep coming
+POLL_SECONDS = 30           # interval between scans when polling
+n_workers = None            # Number of processes reading projects, None to use all cores
+
+project_path = db_preparation_thin.project_path
+ls_log_file = db_preparation_thin.ls_log_file
+supply_dat_file = voltage_log_processing.SUPPLY_DAT_FILE
+
+
+def file_signature(filename):
+    """Return (size, mtime) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def projects_signature(discovery):
+    """Return the names and (size, mtime) of all project files. Only the
+    project folders changed since the last call are listed again."""
+    return tuple((str(f), file_signature(f)) for f, name, date in discovery.projects())
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Puts the source name in the queue for file system events below a
+    folder, or on a single file if filename is given."""
+
+    def __init__(self, events, source, filename=None):
+        self.events = events
+        self.source = source
+        self.filename = None if filename is None else os.path.normcase(os.path.abspath(filename))
+
+    def on_any_event(self, event):
+        if event.is_directory and self.filename is not None:
+            return
+        if self.filename is not None:
+            paths = [event.src_path, getattr(event, 'dest_path', '')]
+            if self.filename not in [os.path.normcase(os.path.abspath(p)) for p in paths if p]:
+                return
+        self.events.put(self.source)
+
+
+class SourceWatcher():
+    """Watches the sources and reports changed sources in a queue.
+
+    Uses watchdog observers when available. Otherwise, or if an observer
+    cannot be started (e.g. on some network shares), the sources are polled
+    every POLL_SECONDS seconds.
+    """
+
+    def __init__(self, project_path, files, poll_seconds=POLL_SECONDS, use_notifications=True):
+        """
+        :param project_path: Path
+            Folder holding the project folders, watched recursively.
+        :param files: dict
+            Single files to watch, by source name.
+        """
+        self.project_path = pathlib.Path(project_path)
+        self.files = dict((k, pathlib.Path(v)) for k, v in files.items())
+        self.poll_seconds = poll_seconds
+        self.events = queue.Queue()
+        self.observer = None
+        self._discovery = None
+        self._signatures = dict()
+
+        if use_notifications and Observer is not None:
+            try:
+                self.observer = Observer()
+                self.observer.schedule(_EventHandler(self.events, 'projects'),
+                                       str(self.project_path), recursive=True)
+                for source, filename in self.files.items():
+                    self.observer.schedule(_EventHandler(self.events, source, filename),
+                                           str(filename.parent), recursive=False)
+                self.observer.start()
+            except Exception as e:
+                print('Could not start file system notifications ({0}), polling instead.'.format(e))
+                self.observer = None
+
+        if self.observer is None:
+            self._discovery = pyabemls.ProjectDiscovery(self.project_path,
+                                                        start_date=db_preparation_thin.start_date)
+            self._signatures = self._poll()
+
+    @property
+    def polling(self):
+        return self.observer is None
+
+    def _poll(self):
+        signatures = dict((source, file_signature(f)) for source, f in self.files.items())
+        try:
+            signatures['projects'] = projects_signature(self._discovery)
+        except OSError:
+            # project folder not reachable, e.g. network share down
+            signatures['projects'] = self._signatures.get('projects')
+        return signatures
+
+    def poll(self):
+        """Scan the sources and queue the ones changed since the last scan."""
+        signatures = self._poll()
+        for source, signature in signatures.items():
+            if signature != self._signatures.get(source):
+                self.events.put(source)
+        self._signatures = signatures
+
+    def get(self, timeout):
+        """Return the name of a changed source, or None if there was no change
+        within timeout seconds."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+
+class Debouncer():
+    """Collects change events per source and tells when a source is due for
+    processing."""
+
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._pending = dict()   # source: (time of first change, time of last change)
+
+    def add(self, source, now=None):
+        now = time.monotonic() if now is None else now
+        first, last = self._pending.get(source, (now, now))
+        self._pending[source] = (first, now)
+
+    def due(self, now=None):
+        """Return and forget the sources that are due for processing."""
+        now = time.monotonic() if now is None else now
+        sources = [s for s, (first, last) in self._pending.items()
+                   if now - last >= self.debounce or now - first >= self.max_delay]
+        for s in sources:
+            del self._pending[s]
+        return sources
+
+    def next_timeout(self, now=None):
+        """Seconds until the next source may be due, None if nothing is pending."""
+        if not self._pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0., min(min(last + self.debounce, first + self.max_delay) - now
+                           for first, last in self._pending.values()))
+
+
+def process(source):
+    """Update the outputs of a changed source."""
+    print('{0}: processing {1}'.format(dt.datetime.now().replace(microsecond=0), source))
+    if source in ['projects', 'ls_log']:
+        read = db_preparation_thin.ingest_projects(n_workers=n_workers, verbose=False)
+        print('{0} project files read'.format(len(read)))
+    elif source == 'supply':
+        voltage_log_processing.process_supply_voltage()
+
+
+def run(debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS, poll_seconds=POLL_SECONDS):
+    """Process all sources once, then watch them and process the changed ones
+    until interrupted."""
+    sources = ['projects', 'supply']
+    for source in sources:
+        try:
+            process(source)
+        except Exception:
+            traceback.print_exc()
+
+    watcher = SourceWatcher(project_path, {'supply': supply_dat_file, 'ls_log': ls_log_file},
+                            poll_seconds=poll_seconds)
+    debouncer = Debouncer(debounce=debounce, max_delay=max_delay)
+    print('Watching {0} ({1})'.format(project_path, 'polling' if watcher.polling else 'notifications'))
+
+    next_poll = time.monotonic()
+    try:
+        while True:
+            if watcher.polling and time.monotonic() >= next_poll:
+                watcher.poll()
+                next_poll = time.monotonic() + poll_seconds
+
+            timeout = debouncer.next_timeout()
+            if watcher.polling:
+                wait = max(0., next_poll - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            source = watcher.get(timeout=1. if timeout is None else max(timeout, 0.01))
+            if source is not None:
+                debouncer.add(source)
+
+            # The Terrameter logfile changes when tasks start and stop, the
+            # project files of the current task are processed with the projects
+            due = debouncer.due()
+            if 'ls_log' in due and 'projects' in due:
+                due.remove('ls_log')
+            for source in due:
+                try:
+                    process(source)
+                except Exception:
+                    # keep running, the source is processed again on its next change
+                    traceback.print_exc()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import pathlib
+import datetime as dt
+from contextlib import contextmanager
+
+
+################################################################
+# Timing and throughput metrics of the ingestion runs, written as json lines.
+#
+# Each project file read gets one 'file' record, with the time spent opening
+# it, in each query and in parsing, the rows read and the size of the database
+# file (with its write-ahead log, not the bytes actually read). Each run ends
+# with one 'run' record holding the totals, the time spent writing each output
+# and the slowest files. Records of the same run share the run id (the start
+# time of the run).
+#
+#    metrics = IngestionMetrics('ingest_metrics.jsonl')
+#    results = run_extraction(projects, stages, metrics=metrics)
+#    collect_results(projects, results, stages, metrics=metrics)
+#    metrics.write()
+################################################################
+
+N_SLOWEST = 10    # number of slowest files listed in the run summary
+
+
+def files_size(filename):
+    """Return the size in bytes of a database file and its write-ahead log."""
+    size = 0
+    for f in [str(filename), str(filename) + '-wal']:
+        try:
+            size += os.stat(f).st_size
+        except OSError:
+            pass
+    return size
+
+
+class FileMetrics():
+    """Timings and counts of reading one project file. Picklable, so that it
+    can be returned from the worker processes."""
+
+    def __init__(self, file, project_name=None):
+        self.file = str(file)
+        self.project_name = project_name
+        self.status = 'read'
+        self.error = None
+        self.file_bytes = files_size(file)    # database + WAL size, not bytes read
+        self.open_s = 0.
+        self.query_s = dict()    # seconds per pyabemls call
+        self.parse_s = dict()    # seconds per parsing step
+        self.extract_s = dict()  # seconds per extractor stage
+        self.rows = dict()       # rows returned per pyabemls call
+        self._start = time.perf_counter()
+        self.total_s = None
+
+    @contextmanager
+    def timer(self, kind, name=None):
+        """Add the time spent in the with block to the open time (kind='open'),
+        or to the query, parse or extract time (kind='query', 'parse' or
+        'extract') of name."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            if kind == 'open':
+                self.open_s += seconds
+            else:
+                times = getattr(self, kind + '_s')
+                times[name] = times.get(name, 0.) + seconds
+
+    def add_rows(self, name, n):
+        self.rows[name] = self.rows.get(name, 0) + int(n)
+
+    def failed(self, error):
+        self.status = 'failed'
+        self.error = str(error)
+
+    def finish(self):
+        self.total_s = time.perf_counter() - self._start
+
+    def as_dict(self):
+        return dict(file=self.file,
+                    proj_name=self.project_name,
+                    status=self.status,
+                    error=self.error,
+                    total_s=_round(self.total_s),
+                    open_s=_round(self.open_s),
+                    query_s=_round_values(self.query_s),
+                    parse_s=_round_values(self.parse_s),
+                    extract_s=_round_values(self.extract_s),
+                    rows=dict(self.rows),
+                    rows_total=sum(self.rows.values()),
+                    file_bytes=self.file_bytes,
+                    )
+
+
+def _round(seconds):
+    return None if seconds is None else round(seconds, 6)
+
+
+def _round_values(times):
+    return dict((k, _round(v)) for k, v in times.items())
+
+
+class IngestionMetrics():
+    """Collects the metrics of the files read in one ingestion run, and of the
+    steps of the run itself (discovery, extraction, writing the outputs), and
+    appends them to a json lines file."""
+
+    def __init__(self, metrics_file=None, n_slowest=N_SLOWEST):
+        """
+        :param metrics_file: str or Path
+            Json lines file the records are appended to. If None, the metrics
+            are only kept in memory.
+        :param n_slowest: integer
+            Number of slowest files listed in the run summary.
+        """
+        self.metrics_file = None if metrics_file is None else pathlib.Path(metrics_file)
+        self.n_slowest = n_slowest
+        self.run_id = dt.datetime.now().isoformat(timespec='milliseconds')
+        self.files = []
+        self.steps = dict()      # seconds per step of the run
+        self.n_projects = 0      # number of project files found to process
+        self._start = time.perf_counter()
+
+    def add(self, file_metrics):
+        """Add the metrics of a file read (FileMetrics)."""
+        self.files.append(file_metrics.as_dict())
+
+    @contextmanager
+    def timer(self, step):
+        """Add the time spent in the with block to a step of the run, e.g.
+        'discovery' or 'write:task_info'."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[step] = self.steps.get(step, 0.) + time.perf_counter() - t0
+
+    def summary(self):
+        """Return the run record: totals, throughput, time per step and the
+        slowest files."""
+        wall_s = time.perf_counter() - self._start
+        read = [f for f in self.files if f['status'] == 'read']
+        query_s = dict()
+        parse_s = dict()
+        for f in self.files:
+            for totals, times in [(query_s, f['query_s']), (parse_s, f['parse_s'])]:
+                for name, seconds in times.items():
+                    totals[name] = totals.get(name, 0.) + seconds
+        rows = sum(f['rows_total'] for f in self.files)
+        file_bytes = sum(f['file_bytes'] for f in read)
+        file_s = sum(f['total_s'] or 0. for f in self.files)
+        slowest = sorted(self.files, key=lambda f: f['total_s'] or 0., reverse=True)[:self.n_slowest]
+        return dict(record='run',
+                    run=self.run_id,
+                    wall_s=_round(wall_s),
+                    n_projects=self.n_projects,
+                    files_read=len(read),
+                    files_failed=len(self.files) - len(read),
+                    rows=rows,
+                    file_bytes=file_bytes,
+                    files_per_s=round(len(read)/wall_s, 3) if wall_s > 0 else None,
+                    rows_per_s=round(rows/wall_s, 1) if wall_s > 0 else None,
+                    file_s=_round(file_s),
+                    open_s=_round(sum(f['open_s'] for f in self.files)),
+                    query_s=_round_values(query_s),
+                    parse_s=_round_values(parse_s),
+                    steps_s=_round_values(self.steps),
+                    slowest=[dict(file=f['file'], total_s=f['total_s'], rows=f['rows_total'],
+                                  status=f['status']) for f in slowest],
+                    )
+
+    def write(self):
+        """Append the file records and the run record to the metrics file.
+
+        :return: dict
+            The run record.
+        """
+        summary = self.summary()
+        if self.metrics_file is not None:
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.metrics_file, 'a') as f:
+                for record in self.files:
+                    f.write(json.dumps(dict(record='file', run=self.run_id, **record)) + '\n')
+                f.write(json.dumps(summary) + '\n')
+        return summary
+
+
+def print_summary(summary):
+    """Print a run record as returned by IngestionMetrics.summary."""
+    print('Ingestion run {0}: {1} files read, {2} failed, {3} rows from {4:.1f} MB of files in {5:.1f} s'.format(
+        summary['run'], summary['files_read'], summary['files_failed'], summary['rows'],
+        summary['file_bytes']/1e6, summary['wall_s']))
+    for step, seconds in summary['steps_s'].items():
+        print('  {0:<24} {1:>10.3f} s'.format(step, seconds))
+    for name, seconds in summary['query_s'].items():
+        print('  query {0:<18} {1:>10.3f} s'.format(name, seconds))
+    for name, seconds in summary['parse_s'].items():
+        print('  parse {0:<18} {1:>10.3f} s'.format(name, seconds))
+    if summary['slowest']:
+        print('Slowest files:')
+        for f in summary['slowest']:
+            print('  {0:>10.3f} s {1:>10} rows  {2}'.format(f['total_s'] or 0., f['rows'], f['file']))
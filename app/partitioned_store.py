@@ -0,0 +1,293 @@
+import os
+import time
+import shutil
+import pathlib
+import numpy as np
+import pandas as pd
+
+from timeseries import merge_order
+
+# Please install pyarrow
+# conda install -c conda-forge pyarrow
+
+
+def time_range_mask(times, start=None, end=None):
+    """Return a boolean array selecting the times from start to end. An end
+    given as a date (no time of day) includes the whole day."""
+    keep = pd.Series(True, index=times.index)
+    if start is not None:
+        keep &= times >= pd.Timestamp(start)
+    if end is not None:
+        end = pd.Timestamp(end)
+        if end == end.normalize():
+            end = end + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        keep &= times <= end
+    return keep.values
+
+
+class PartitionedStore():
+    """Append-only table stored as time-partitioned parquet files.
+
+    Rows are partitioned on a datetime column, by default one folder per month
+    (e.g. store/2022-07/). Each append writes one new part file into each
+    partition it touches, and existing files are never rewritten, so the cost
+    of an append depends on the new rows only.
+
+    Rows can be replaced by appending them again: when replace_on is set, the
+    rows of a key (e.g. a project name) in the newest part file holding that
+    key replace all older rows of the same key. A key must always map to the
+    same partition (e.g. the project date of a project). Keys passed as
+    replace_keys to append but without rows are written to a deletion file
+    (part-<time>-deleted.parquet), holding only the keys, which replaces the
+    older rows of these keys by no rows.
+
+    Rows are returned sorted on time_column, or on order_by if given, e.g. to
+    partition readings by project date but return them in time order. Each
+    part file is written sorted, so reading merges the sorted parts instead of
+    sorting all rows.
+
+        store = PartitionedStore('task_info', time_column='proj_date',
+                                 replace_on='proj_name')
+        store.append(new_tasks_df)
+        df = store.read(start='2022-07-01', end='2022-07-31')
+    """
+
+    def __init__(self, path, time_column, replace_on=None, freq='M', order_by=None):
+        """
+        :param path: str or Path
+            Folder holding the partitions.
+        :param time_column: str
+            Datetime column used to partition the rows.
+        :param replace_on: str or list of str
+            Key column(s) for replacing rows, see above. If None, all appended
+            rows are kept.
+        :param freq: str
+            Partition length as a pandas period frequency, 'M' for monthly,
+            'Y' for yearly or 'D' for daily partitions.
+        :param order_by: str
+            Column the rows are sorted on when read. If None, time_column.
+        """
+        self.path = pathlib.Path(path)
+        self.time_column = time_column
+        if isinstance(replace_on, str):
+            replace_on = [replace_on]
+        self.replace_on = replace_on
+        self.freq = freq
+        self.order_by = time_column if order_by is None else order_by
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, str(self.path))
+
+    def _period(self, value):
+        return pd.Period(value, freq=self.freq)
+
+    def partitions(self):
+        """Return the names of the partitions in the store, in time order."""
+        if not self.path.is_dir():
+            return []
+        return sorted(p.name for p in self.path.iterdir() if p.is_dir() and any(p.glob('*.parquet')))
+
+    def part_files(self, start=None, end=None):
+        """Return the part files of the partitions overlapping start to end
+        (inclusive), in the order they were written."""
+        first = None if start is None else self._period(start)
+        last = None if end is None else self._period(end)
+        files = []
+        for name in self.partitions():
+            period = self._period(name)
+            if (first is not None and period < first) or (last is not None and period > last):
+                continue
+            files.extend((self.path / name).glob('*.parquet'))
+        return sorted(files, key=lambda f: f.name)
+
+    def is_empty(self):
+        return len(self.partitions()) == 0
+
+    @staticmethod
+    def _is_deletion(filename):
+        return filename.name.endswith('-deleted.parquet')
+
+    def append(self, df, replace_keys=None):
+        """Append the rows of df to the store.
+
+        :param replace_keys: dataframe
+            The replace_on and time_column values of keys whose rows are
+            replaced, e.g. of all projects read again. The rows of the keys
+            without rows in df are deleted, e.g. of a project read again that
+            gave no rows. If None, only the keys of the rows of df are
+            replaced.
+
+        :return: list of Path
+            The part and deletion files written, one of each per partition
+            touched.
+        """
+        # Part files are named by write time, so that sorting on the name
+        # gives the write order used to replace rows. A deletion file sorts
+        # before the part file written at the same time.
+        stamp = '{0:020d}'.format(time.time_ns())
+        written = []
+        if replace_keys is not None and len(replace_keys) > 0:
+            if self.replace_on is None:
+                raise ValueError('Cannot replace keys of a store without replace_on.')
+            deleted = replace_keys[self.replace_on + [self.time_column]].drop_duplicates()
+            if len(df) > 0:
+                deleted = deleted.merge(df[self.replace_on].drop_duplicates(), how='left',
+                                        on=self.replace_on, indicator=True)
+                deleted = deleted[deleted['_merge'].values == 'left_only'].drop(columns='_merge')
+            written.extend(self._write(deleted, 'part-{0}-deleted.parquet'.format(stamp)))
+        written.extend(self._write(self._sorted(df) if len(df) > 0 else df,
+                                   'part-{0}.parquet'.format(stamp)))
+        return written
+
+    def _write(self, df, file_name):
+        """Write the rows of df to a file named file_name in each partition."""
+        if len(df) == 0:
+            return []
+        times = pd.to_datetime(df[self.time_column])
+        if times.isna().any():
+            raise ValueError('Cannot partition rows with missing {0}.'.format(self.time_column))
+        if getattr(times.dt, 'tz', None) is not None:
+            times = times.dt.tz_localize(None)
+        periods = times.dt.to_period(self.freq).astype(str)
+
+        written = []
+        for name, rows in df.groupby(periods.values, sort=True):
+            folder = self.path / name
+            folder.mkdir(parents=True, exist_ok=True)
+            filename = folder / file_name
+            tmp = filename.with_name(filename.name + '.tmp')
+            rows.reset_index(drop=True).to_parquet(tmp, index=False)
+            os.replace(tmp, filename)
+            written.append(filename)
+        return written
+
+    def _sorted(self, df):
+        """Return df sorted on order_by, or df itself if it already is (part
+        files written by earlier versions may not be)."""
+        if df[self.order_by].is_monotonic_increasing:
+            return df
+        return df.sort_values(self.order_by, kind='stable')
+
+    def _read_files(self, files, columns=None):
+        """Read part files, each sorted on order_by, and deletion files, of
+        which only the keys are read."""
+        frames = []
+        for f in files:
+            if self._is_deletion(f):
+                frames.append(pd.read_parquet(f, columns=self.replace_on + [self.time_column]))
+            else:
+                frames.append(self._sorted(pd.read_parquet(f, columns=columns)))
+        return frames
+
+    def _combine(self, frames, deleted=None):
+        """Concatenate the frames of the part files, in write order, keeping
+        only the newest rows of each replace_on key. The column _part holds
+        the index of the frame of each row.
+
+        :param deleted: list of bool
+            True for the frames of deletion files, which replace the rows of
+            their keys but add none.
+        """
+        if len(frames) == 0:
+            return pd.DataFrame()
+        for n, frame in enumerate(frames):
+            frame['_part'] = n
+        if self.replace_on is not None:
+            keys = pd.concat([f[self.replace_on + ['_part']] for f in frames], ignore_index=True)
+            newest = keys.groupby(self.replace_on, sort=False, dropna=False)['_part'].transform('max')
+            keep = keys['_part'].values == newest.values
+            bounds = np.cumsum([len(f) for f in frames])[:-1]
+            frames = [f[k] for f, k in zip(frames, np.split(keep, bounds))]
+        if deleted is not None:
+            frames = [f for f, d in zip(frames, deleted) if not d]
+            if len(frames) == 0:
+                return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def _merge(self, df):
+        """Merge the rows of the part files (as returned by _combine, each
+        part sorted on order_by) into one table sorted on order_by, in write
+        order for equal values."""
+        parts = df['_part'].values
+        bounds = np.flatnonzero(parts[1:] != parts[:-1]) + 1
+        values, order = merge_order(np.split(df[self.order_by].values, bounds))
+        if order is not None:
+            df = df.iloc[order]
+        return df.drop(columns='_part').reset_index(drop=True)
+
+    def read(self, start=None, end=None, columns=None):
+        """Read the rows of the store, optionally only those from start to end.
+
+        Only the partitions overlapping the date range are read.
+
+        :param start: str or datetime
+            First time to include, None for no lower limit.
+        :param end: str or datetime
+            Last time to include, None for no upper limit.
+        :param columns: list of str
+            Columns to read. If None, all columns are read.
+
+        :return: dataframe
+            The rows sorted on order_by, in write order for equal values.
+        """
+        if columns is not None:
+            columns = list(columns)
+            needed = [self.time_column, self.order_by] + (self.replace_on or [])
+            read_columns = columns + [c for c in dict.fromkeys(needed) if c not in columns]
+        else:
+            read_columns = None
+
+        files = self.part_files(start, end)
+        df = self._combine(self._read_files(files, read_columns),
+                           [self._is_deletion(f) for f in files])
+        if len(df) == 0:
+            return df
+
+        df = df[time_range_mask(df[self.time_column], start, end)]
+
+        df = self._merge(df)
+        if columns is not None:
+            df = df[columns]
+        return df
+
+    def compact(self, min_files=2):
+        """Rewrite each partition holding at least min_files part files as one
+        file, named as the newest of them, dropping replaced and deleted rows.
+        Not needed for reading, but keeps the number of files down."""
+        for name in self.partitions():
+            files = sorted((self.path / name).glob('*.parquet'), key=lambda f: f.name)
+            if len(files) < max(min_files, 2):
+                continue
+            df = self._combine(self._read_files(files), [self._is_deletion(f) for f in files])
+            filename = files[-1].with_name(files[-1].name.replace('-deleted', ''))
+            if len(df) > 0:
+                tmp = filename.with_name(filename.name + '.tmp')
+                self._merge(df).to_parquet(tmp, index=False)
+                os.replace(tmp, filename)
+            for f in files:
+                if f != filename or len(df) == 0:
+                    f.unlink()
+
+    def clear(self):
+        """Delete all partitions of the store."""
+        for name in self.partitions():
+            shutil.rmtree(self.path / name)
+
+
+def read_table(path, time_column, start=None, end=None, columns=None, replace_on=None,
+               order_by=None):
+    """Read a table from a PartitionedStore folder, or from a feather file as
+    written by earlier versions of the processing scripts.
+
+    :param path: str or Path
+        Store folder, or .ftr file.
+
+    See PartitionedStore.read for the other parameters.
+    """
+    path = pathlib.Path(path)
+    if path.suffix == '.ftr':
+        df = pd.read_feather(path)
+        df = df[time_range_mask(df[time_column], start, end)].reset_index(drop=True)
+        return df if columns is None else df[list(columns)]
+    store = PartitionedStore(path, time_column=time_column, replace_on=replace_on, order_by=order_by)
+    return store.read(start=start, end=end, columns=columns)
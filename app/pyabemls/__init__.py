@@ -2,12 +2,22 @@ from tables import *
 import numpy as np
 import pathlib
 import os.path
+import time
 import warnings
+from functools import cached_property
 import sqlite3
-from pandas import DataFrame
+from pandas import DataFrame, Series, factorize, to_datetime
 import pdb
 from lxml import etree
 
+from .spread import SpreadIndex, MISSING_ELECTRODE
+from . import export
+from .export import DAT_COLUMNS
+from .catalog import ProjectCatalog
+from .protocols import ProtocolRegistry
+from .manifest import IngestionManifest
+from .discovery import ProjectDiscovery
+
 
 # conda install pytables lxml
 
@@ -29,6 +39,103 @@ DATATYPES = dict([
 ])
 
 
+# Connection settings used when opening project files
+SQLITE_MMAP_SIZE = 256 * 1024**2        # bytes of the db file to memory map
+SQLITE_CACHE_SIZE = -64 * 1024          # negative values are in KiB, i.e. 64 MiB page cache
+SQLITE_BUSY_TIMEOUT = 30.               # seconds to wait for locks held by the instrument
+SQLITE_JOURNAL_SUFFIXES = ['-journal', '-wal', '-shm']
+ACTIVE_PROJECT_SECONDS = 600            # files modified more recently are treated as being written
+
+# Channels holding potential measurements (channel 0 holds the current)
+DATA_CHANNELS = list(range(1, 13))
+
+# Format of the time stamps stored in the project tables
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Log events reported by log_events, as column name: text of the Log message
+LOG_EVENTS = {'Started': 'Measuring Started',
+              'Completed': 'Measuring done',
+              'Quit': 'Quit'}
+
+
+def is_active_project(filename):
+    """Evaluate whether a project file may still be written to by the instrument.
+
+    A project is considered active if SQLite journal files are present next to
+    the database, or if the database was modified within the last
+    ACTIVE_PROJECT_SECONDS seconds.
+
+    :return: boolean
+        True if the project should be opened in the safe (locking) mode.
+    """
+    for suffix in SQLITE_JOURNAL_SUFFIXES:
+        if os.path.exists(str(filename) + suffix):
+            return True
+    age = time.time() - os.path.getmtime(filename)
+    return age < ACTIVE_PROJECT_SECONDS
+
+
+def project_uri(filename, immutable=True):
+    """Return the SQLite URI of a project file, read-only and immutable if requested."""
+    uri = pathlib.Path(filename).resolve().as_uri()
+    if immutable:
+        uri += '?mode=ro&immutable=1'
+    return uri
+
+
+def parse_times(times, time_format=TIME_FORMAT):
+    """Convert time stamp strings to datetime64 values.
+
+    The strings are parsed with the fixed time_format, and only those that do
+    not match (e.g. with fractional seconds) are passed to the slower general
+    parser.
+
+    :param times: Series of str
+    :return: Series of datetime64
+    """
+    result = to_datetime(times, format=time_format, errors='coerce')
+    bad = result.isna() & times.notna()
+    if bad.any():
+        result[bad] = to_datetime(times[bad], errors='coerce')
+    return result
+
+
+def log_events(log, events=LOG_EVENTS, time_format=TIME_FORMAT):
+    """Extract the time of the first and last log entry, and of specific
+    events, for each task in the Log table.
+
+    :param log: DataFrame
+        Log table rows, in the order they were logged, with at least the
+        columns TaskID, Time and What.
+    :param events: dict
+        Columns to add, with the text searched for in the What column. Where a
+        task logs an event more than once, the last occurrence is used.
+
+    :return: DataFrame
+        Indexed by TaskID, with datetime64 columns first_log_event,
+        last_log_event and one column per event (NaT if not logged).
+    """
+    columns = ['first_log_event', 'last_log_event'] + list(events)
+    if len(log) == 0:
+        return DataFrame({c: to_datetime([]) for c in columns},
+                         index=np.array([], dtype=np.int64)).rename_axis('TaskID')
+
+    times = parse_times(log['Time'], time_format).values
+    frame = DataFrame({'TaskID': log['TaskID'].values, 'Time': times})
+
+    def per_task(rows, keep):
+        return rows.drop_duplicates('TaskID', keep=keep).set_index('TaskID')['Time']
+
+    first = per_task(frame, 'first').sort_index()
+    result = DataFrame({'first_log_event': first,
+                        'last_log_event': per_task(frame, 'last')}, index=first.index)
+    what = log['What'].fillna('').astype(str)
+    for column, text in events.items():
+        found = frame[what.str.contains(text, regex=False).values]
+        result[column] = per_task(found, 'last')
+    return result[columns]
+
+
 def remove_comments(line, sep):
     for s in sep:
         line = line.split(s)[0]
@@ -91,6 +198,36 @@ class ABEMLS_project():
             DPV.DPID=DP_ABMN.ID
     """
 
+    # Columns available to get_task_columns: name -> (sql expression, numpy dtype).
+    # The table of the expression decides which joins are needed.
+    TASK_COLUMNS = dict([
+        ('Time',       ('Measures.Time',     'datetime64[ns]')),
+        ('TaskID',     ('DPV.TaskID',        'int64')),
+        ('MeasureID',  ('DPV.MeasureID',     'int64')),
+        ('Channel',    ('DPV.Channel',       'int64')),
+        ('SeqNum',     ('DPV.SeqNum',        'int64')),
+        ('DatatypeID', ('DPV.DatatypeID',    'int64')),
+        ('APosX',      ('DP_ABMN.APosX',     'float64')),
+        ('APosY',      ('DP_ABMN.APosY',     'float64')),
+        ('APosZ',      ('DP_ABMN.APosZ',     'float64')),
+        ('BPosX',      ('DP_ABMN.BPosX',     'float64')),
+        ('BPosY',      ('DP_ABMN.BPosY',     'float64')),
+        ('BPosZ',      ('DP_ABMN.BPosZ',     'float64')),
+        ('MPosX',      ('DP_ABMN.MPosX',     'float64')),
+        ('MPosY',      ('DP_ABMN.MPosY',     'float64')),
+        ('MPosZ',      ('DP_ABMN.MPosZ',     'float64')),
+        ('NPosX',      ('DP_ABMN.NPosX',     'float64')),
+        ('NPosY',      ('DP_ABMN.NPosY',     'float64')),
+        ('NPosZ',      ('DP_ABMN.NPosZ',     'float64')),
+        ('DataValue',  ('DPV.DataValue',     'float64')),
+        ('DataSDev',   ('DPV.DataSDev',      'float64')),
+        ('MCycles',    ('DPV.MCycles',       'float64')),
+        ('SessionID',  ('Measures.SessionID', 'int64')),
+    ])
+
+    # Number of rows fetched from sqlite per batch in get_task_columns
+    FETCH_BATCH_SIZE = 50000
+
     GET_ELECTRODETESTS = """
         SELECT
                ID
@@ -150,6 +287,9 @@ class ABEMLS_project():
         WHERE Tasks.ID=NdatTable.TaskID
     """
 
+    # Task information. The {count_columns} and {count_joins} placeholders are
+    # filled from TASK_COUNT_SUBQUERIES by get_tasklist, so that each count is
+    # aggregated once per task before joining, and only when requested.
     GET_TASK_INFO_SQL = """
         SELECT
             Tasks.ID,
@@ -157,43 +297,38 @@ class ABEMLS_project():
             Tasks.PosX, Tasks.PosY, Tasks.PosZ,
             Tasks.SpacingX, Tasks.SpacingY, Tasks.SpacingZ,
             Tasks.ArrayCode,Tasks.Time,
-            ts1.Value as ProtocolFile,
-            ts2.Value as SpreadFile,
-            ts4.Value as BaseReference,
-            Log2.PosLatitude, Log2.PosLongitude, Log2.PosQuality,
-            COUNT(DISTINCT ndt.ID) as nData,
-            COUNT(DISTINCT ndt.DPID) as nDipoles,
-            COUNT(DISTINCT e.ID) as nECRdata
+            ts.ProtocolFile,
+            ts.SpreadFile,
+            ts.BaseReference,
+            Log2.PosLatitude, Log2.PosLongitude, Log2.PosQuality{count_columns}
         FROM Tasks
-        LEFT JOIN ElectrodeTestData as e ON Tasks.ID=e.TaskID
-        LEFT JOIN (SELECT * FROM DPV WHERE Channel>0 AND Channel<13)            as ndt ON ndt.TaskID=Tasks.ID
-        LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting="ProtocolFile")     as ts1 ON ts1.key1=Tasks.ID
-        LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting="SpreadFile")       as ts2 ON ts2.key1=Tasks.ID
-        LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting="BaseReference")    as ts4 ON ts4.key1=Tasks.ID
-        LEFT JOIN (SELECT DISTINCT PosLatitude, PosLongitude, PosQuality, TaskID FROM Log) as Log2 ON Log2.TaskID=Tasks.ID
-        GROUP BY Tasks.ID
+        LEFT JOIN (
+            SELECT
+                key1,
+                MAX(CASE WHEN Setting='ProtocolFile' THEN Value END) AS ProtocolFile,
+                MAX(CASE WHEN Setting='SpreadFile' THEN Value END) AS SpreadFile,
+                MAX(CASE WHEN Setting='BaseReference' THEN Value END) AS BaseReference
+            FROM TaskSettings
+            WHERE Setting IN ('ProtocolFile', 'SpreadFile', 'BaseReference')
+            GROUP BY key1
+        ) AS ts ON ts.key1=Tasks.ID
+        LEFT JOIN (
+            SELECT TaskID, PosLatitude, PosLongitude, PosQuality
+            FROM Log
+            GROUP BY TaskID
+        ) AS Log2 ON Log2.TaskID=Tasks.ID{count_joins}
+        ORDER BY Tasks.ID
     """
 
-    GET_TASK_INFO_NO_COUNT_SQL = """
-        SELECT
-            Tasks.ID,
-            Tasks.Name,
-            Tasks.PosX, Tasks.PosY, Tasks.PosZ,
-            Tasks.SpacingX, Tasks.SpacingY, Tasks.SpacingZ,
-            Tasks.ArrayCode,Tasks.Time,
-            ts1.Value as ProtocolFile,
-            ts2.Value as SpreadFile,
-            ts4.Value as BaseReference,
-            Log2.PosLatitude, Log2.PosLongitude, Log2.PosQuality,
-            COUNT(DISTINCT e.ID) as nECRdata
-        FROM Tasks
-        LEFT JOIN ElectrodeTestData as e ON Tasks.ID=e.TaskID
-        LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting="ProtocolFile")     as ts1 ON ts1.key1=Tasks.ID
-        LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting="SpreadFile")       as ts2 ON ts2.key1=Tasks.ID
-        LEFT JOIN (SELECT * FROM TaskSettings WHERE Setting="BaseReference")    as ts4 ON ts4.key1=Tasks.ID
-        LEFT JOIN (SELECT DISTINCT PosLatitude, PosLongitude, PosQuality, TaskID FROM Log) as Log2 ON Log2.TaskID=Tasks.ID
-        GROUP BY Tasks.ID
-    """
+    # Pre-aggregated count subqueries: alias -> (sql, {count column: aggregate})
+    TASK_COUNT_SUBQUERIES = dict([
+        ('ndt', ("SELECT TaskID, {aggregates} FROM DPV WHERE Channel>0 AND Channel<13 GROUP BY TaskID",
+                 dict([('nData', 'COUNT(ID)'), ('nDipoles', 'COUNT(DISTINCT DPID)')]))),
+        ('ecr', ("SELECT TaskID, {aggregates} FROM ElectrodeTestData GROUP BY TaskID",
+                 dict([('nECRdata', 'COUNT(ID)')]))),
+    ])
+
+    TASK_COUNTS = ['nData', 'nDipoles', 'nECRdata']
 
     GET_TASK_COORDS_SQL = """
         SELECT
@@ -238,26 +373,19 @@ class ABEMLS_project():
     """
 
 
-    def __init__(self, filename, project_name=None, xml_path=None):
+    def __init__(self, filename, project_name=None, xml_path=None, open_mode='auto'):
         # Define instance variables
         self.name = project_name
         self.filename = filename
         self.xml_path = xml_path
-        self.tasks = None
+        self.open_mode = open_mode
         self.task_cols = None
         self.spread_files = dict()
-        self.datatypes = dict()
-        self.settings = dict()
-
-        conn = sqlite3.connect(filename)
-        cur = conn.cursor()
-        self.get_tasklist(cur=cur, no_count=True)
-        self.get_datatypes_from_db(cur=cur)
-        self.sessions = self.get_sessions(cur=cur)
-        self.settings = self.get_settings_dict()
-        cur.close()
-        conn.close()
-        self.filename = filename
+        self.spread_indices = dict()
+        self._conn = None
+
+        # The project metadata (tasks, datatypes, sessions and settings) is
+        # read from the database on first access, see the properties below.
 
         # read textfile with project name if present
         # it must have the same basename as the db-file,
@@ -269,12 +397,99 @@ class ABEMLS_project():
             if pname:
                 self.name = pname
 
+    @cached_property
+    def tasks(self):
+        """Dataframe of the tasks in the project, as returned by get_tasklist(no_count=True).
+        Updated by every call to get_tasklist."""
+        return self.get_tasklist(no_count=True)
+
+    @cached_property
+    def datatypes(self):
+        """Dictionary of the datatypes in the project, with DatatypeID as key."""
+        return self.get_datatypes_from_db()
+
+    @cached_property
+    def sessions(self):
+        """Dataframe of the sessions in the project."""
+        return self.get_sessions()
+
+    @cached_property
+    def settings(self):
+        """Dictionary of acquisition settings, see get_settings_dict."""
+        return self.get_settings_dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def is_active(self):
+        """Evaluate whether the project file may still be written to by the instrument.
+        See is_active_project.
+        """
+        return is_active_project(self.filename)
+
+    def connect(self):
+        """Return the connection owned by the project, opening it if necessary.
+
+        The connection is opened according to self.open_mode:
+
+        'auto':       'immutable' for finished projects, 'safe' for projects that
+                      are still being written (see is_active).
+        'immutable':  read-only URI connection with immutable=1. SQLite skips all
+                      locking and change detection, so this must only be used on
+                      files that are no longer written to.
+        'safe':       regular locking connection, restricted to read queries.
+
+        :return: sqlite3.Connection
+        """
+        if self._conn is not None:
+            return self._conn
+
+        if not os.path.exists(self.filename):
+            # sqlite3.connect would silently create an empty database
+            raise FileNotFoundError('Project file does not exist: {0}'.format(self.filename))
+
+        mode = self.open_mode
+        if mode == 'auto':
+            mode = 'safe' if self.is_active() else 'immutable'
+
+        if mode == 'immutable':
+            conn = sqlite3.connect(project_uri(self.filename), uri=True)
+        elif mode == 'safe':
+            conn = sqlite3.connect(self.filename, timeout=SQLITE_BUSY_TIMEOUT)
+            conn.execute('PRAGMA query_only=ON')
+        else:
+            raise ValueError('Unknown open_mode: {0}'.format(self.open_mode))
+
+        conn.execute('PRAGMA mmap_size={0:d}'.format(SQLITE_MMAP_SIZE))
+        conn.execute('PRAGMA cache_size={0:d}'.format(SQLITE_CACHE_SIZE))
+
+        self._conn = conn
+        return conn
+
+    def cursor(self):
+        """Return a new cursor on the connection owned by the project."""
+        return self.connect().cursor()
+
+    def close(self):
+        """Close the connection owned by the project. It will be reopened on next use."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
     def execute_sql(self, sql, cur=None, args=None):
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
         if not args:
             cur.execute(sql)
@@ -286,7 +501,6 @@ class ABEMLS_project():
 
         if temp_cur:
             cur.close()
-            conn.close()
 
         return rows, cols
 
@@ -297,8 +511,7 @@ class ABEMLS_project():
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
         cur.execute("SELECT * FROM Datatype")
 
@@ -307,60 +520,63 @@ class ABEMLS_project():
 
         if temp_cur:
             cur.close()
-            conn.close()
 
-        self.datatypes = dict()
+        datatypes = dict()
 
         for row in rows:
-            self.datatypes[row[0]] = {
+            datatypes[row[0]] = {
                     column_titles[1][0]: row[1],
                     column_titles[2][0]: row[2],
                     column_titles[3][0]: row[3]
             }
 
+        self.datatypes = datatypes
+        return datatypes
+
     def get_data(self):
         """Get data from SQLITE file, return rows and column titles.
         """
 
-        conn = sqlite3.connect(self.filename)
-        cur = conn.cursor()
+        cur = self.cursor()
 
         cur.execute(self.GETDATA_SQL)
 
         rows = cur.fetchall()
         column_titles = cur.description
         cur.close()
-        conn.close()
 
         return rows, column_titles
 
-    def get_tasklist(self, cur=None, no_count=False):
+    def get_tasklist(self, cur=None, no_count=False, counts=None):
         """Read tasks table from db file
 
+        :param cur: sql cursor
+            Cursor into the sql database. If omitted, a temporary cursor will be created.
+        :param no_count: Boolean
+            If True, only the nECRdata count is calculated. Kept for backwards
+            compatibility, equivalent to counts=['nECRdata'].
+        :param counts: iterable
+            The data counts to calculate, any of 'nData', 'nDipoles' and 'nECRdata'.
+            Counting measurements requires a scan of the DPV table, so only request
+            the counts needed. If None, all counts are calculated (unless no_count
+            is True).
+
+        Returns: dataframe
+            One row per task with task information and the requested counts.
         """
+        if counts is None:
+            counts = ['nECRdata'] if no_count else self.TASK_COUNTS
+        unknown = [c for c in counts if c not in self.TASK_COUNTS]
+        if unknown:
+            raise ValueError('Unknown task count(s): {0}'.format(', '.join(unknown)))
+
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
-        cur.execute("SELECT COUNT(*) FROM Tasks")
-
-        try:
-            ntasks = cur.fetchall()[0][0]
-        except:
-            ntasks = 0
-
-        #cur.execute(self.GET_TASK_INFO_SQL)
-        if no_count:
-            cur.execute(self.GET_TASK_INFO_NO_COUNT_SQL)
-        else:
-            cur.execute(self.GET_TASK_INFO_SQL)
+        cur.execute(self.task_info_sql(counts))
         tasks = cur.fetchall()
-        #tasks = []
-        #for n in xrange(1,ntasks+1):
-        #    cur.execute(self.GET_TASK_INFO_SQL_2, (n,))
-        #    tasks.append(cur.fetchall()[0])
 
         task_cols = [c[0] for c in cur.description]
 
@@ -370,18 +586,29 @@ class ABEMLS_project():
 
         if temp_cur:
             cur.close()
-            conn.close()
 
         return result
 
+    def task_info_sql(self, counts):
+        """Return the task info sql query calculating the requested counts."""
+        count_columns = ''
+        count_joins = ''
+        for alias, (sql, aggregates) in self.TASK_COUNT_SUBQUERIES.items():
+            requested = [c for c in self.TASK_COUNTS if c in counts and c in aggregates]
+            if not requested:
+                continue
+            agg_sql = ', '.join('{0} AS {1}'.format(aggregates[c], c) for c in requested)
+            for c in requested:
+                count_columns += ',\n            COALESCE({0}.{1}, 0) AS {1}'.format(alias, c)
+            count_joins += '\n        LEFT JOIN ({0}) AS {1} ON {1}.TaskID=Tasks.ID'.format(
+                sql.format(aggregates=agg_sql), alias)
+        return self.GET_TASK_INFO_SQL.format(count_columns=count_columns, count_joins=count_joins)
+
 
     def list_tasks(self):
         """Print a nice list of the tasks
 
         """
-        if self.tasks is None:
-            self.get_tasklist()
-
         print("Tasks in project:")
         for id, t in self.tasks.iterrows():
             # print ("Task ID: {0}   "
@@ -411,8 +638,7 @@ class ABEMLS_project():
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
         #pdb.set_trace()
         cur.execute(self.GET_TASK_SQL, (int(task_id),))
@@ -424,20 +650,240 @@ class ABEMLS_project():
         else:
             result = DataFrame()
 
-        if self.tasks.nECRdata[self.tasks.ID == task_id].values[0] > 0:
+        if 'nECRdata' not in self.tasks or self.tasks.nECRdata[self.tasks.ID == task_id].values[0] > 0:
             etest = self.get_electrodetest(task_id=task_id, cur=cur)
         else:
             etest = DataFrame()
 
         if temp_cur:
             cur.close()
-            conn.close()
 
         if condensed:
             result = condense_measurements(result, self.datatypes)
 
         return result, etest
 
+    def get_task_columns(self, task_id=1, datatype_id=None, channel=None, columns=None,
+                         as_dict=False, cur=None):
+        """Read selected columns of the task data into typed arrays.
+
+        Unlike get_task, the datatype and channel selections are applied in the
+        sql query, and only the tables needed for the requested columns are joined.
+        Rows are fetched in batches of FETCH_BATCH_SIZE and converted column by
+        column to numpy arrays.
+
+        :param task_id: integer
+            The TaskID of the task to retrieve.
+        :param datatype_id: integer or iterable
+            DatatypeID(s) to retrieve (e.g. 13 for temperature, or (2, 5) for
+            resistivity and resistance). If None, all datatypes are returned.
+        :param channel: integer or iterable
+            Channel(s) to retrieve. If None, all channels are returned.
+        :param columns: iterable
+            Names of the columns to return, see TASK_COLUMNS. If None, the columns
+            of get_task are returned.
+        :param as_dict: Boolean
+            If True, return a dictionary of numpy arrays instead of a DataFrame.
+        :param cur: sql cursor
+            Cursor into the sql database. If omitted, a temporary cursor will be created.
+
+        Returns: DataFrame or dict
+            Task measurements with one typed column per requested column.
+        """
+        columns = self._check_task_columns(columns)
+        sql, args = self._task_columns_sql(columns, [task_id], datatype_id, channel)
+
+        temp_cur = False
+        if cur is None:
+            temp_cur = True
+            cur = self.cursor()
+
+        cur.execute(sql, args)
+        batches = [[] for c in columns]
+        for arrays in self._fetch_column_batches(cur, columns):
+            for batch, c in zip(batches, columns):
+                batch.append(arrays[c])
+
+        if temp_cur:
+            cur.close()
+
+        result = self._concatenate_columns(columns, batches)
+
+        if as_dict:
+            return result
+        return DataFrame(result, columns=columns)
+
+    def get_tasks(self, task_ids=None, columns=None, datatype_id=None, channel=None,
+                  condensed=False, electrode_tests=True):
+        """Read measurements and electrode test data of several tasks in one scan.
+
+        See iter_tasks for a description of the parameters.
+
+        Returns: dict
+            Dictionary with TaskID as key and a tuple of two dataframes (task
+            measurements and electrode test data) as value, like get_task.
+        """
+        result = dict()
+        for task_id, data, etest in self.iter_tasks(task_ids=task_ids, columns=columns,
+                                                    datatype_id=datatype_id, channel=channel,
+                                                    condensed=condensed,
+                                                    electrode_tests=electrode_tests):
+            result[task_id] = (data, etest)
+        return result
+
+    def iter_tasks(self, task_ids=None, columns=None, datatype_id=None, channel=None,
+                   condensed=False, electrode_tests=True):
+        """Generator yielding measurements and electrode test data task by task.
+
+        All requested tasks are read with a single query ordered by TaskID, and
+        each task is yielded as soon as its last row has been fetched. Only one
+        task is held in memory at a time. Electrode test data of all requested
+        tasks is read in one query up front.
+
+        :param task_ids: iterable
+            The TaskIDs to retrieve. If None, all tasks in the project are returned.
+            Repeated TaskIDs are retrieved and yielded once.
+        :param columns: iterable
+            Names of the columns to return, see TASK_COLUMNS. If None, all columns
+            are returned.
+        :param datatype_id: integer or iterable
+            DatatypeID(s) to retrieve. If None, all datatypes are returned.
+        :param channel: integer or iterable
+            Channel(s) to retrieve. If None, all channels are returned.
+        :param condensed: Boolean
+            If True, the measurements are condensed with condense_measurements.
+            Requires the default columns.
+        :param electrode_tests: Boolean
+            If False, electrode test data is not read and an empty dataframe is
+            returned in its place.
+
+        Yields: tuple
+            (TaskID, task measurements, electrode test data) for each requested
+            task in order of TaskID. Tasks without measurements give an empty
+            measurements dataframe with the requested columns.
+        """
+        if task_ids is None:
+            task_ids = self.tasks.ID.values
+        task_ids = sorted(set(int(t) for t in task_ids))
+
+        columns = self._check_task_columns(columns)
+        query_columns = columns if 'TaskID' in columns else ['TaskID'] + columns
+        sql, args = self._task_columns_sql(query_columns, task_ids, datatype_id, channel)
+        sql += " ORDER BY DPV.TaskID, DPV.ID"
+
+        cur = self.cursor()
+
+        if electrode_tests and task_ids:
+            cur.execute(self.GET_ELECTRODETESTS +
+                        " WHERE TaskID IN ({0})".format(",".join("?"*len(task_ids))),
+                        task_ids)
+            etests = DataFrame(cur.fetchall(), columns=[c[0] for c in cur.description])
+            etests = dict((int(t), e.reset_index(drop=True))
+                          for t, e in etests.groupby('TaskID', sort=False))
+        else:
+            etests = dict()
+
+        def make_task(task_id, batches):
+            data = DataFrame(self._concatenate_columns(query_columns, batches), columns=columns)
+            if condensed and len(data) > 0:
+                data = condense_measurements(data, self.datatypes)
+            return task_id, data, etests.get(task_id, DataFrame())
+
+        pending = iter(task_ids)
+        current = None
+        batches = None
+        try:
+            cur.execute(sql, args)
+            for arrays in self._fetch_column_batches(cur, query_columns):
+                tid = arrays['TaskID']
+                splits = np.flatnonzero(np.diff(tid)) + 1
+                for start, end in zip(np.r_[0, splits], np.r_[splits, len(tid)]):
+                    task_id = int(tid[start])
+                    if task_id != current:
+                        if current is not None:
+                            yield make_task(current, batches)
+                        # tasks without measurements before this one
+                        for t in pending:
+                            if t == task_id:
+                                break
+                            yield make_task(t, [[] for c in query_columns])
+                        current = task_id
+                        batches = [[] for c in query_columns]
+                    for batch, c in zip(batches, query_columns):
+                        batch.append(arrays[c][start:end])
+
+            if current is not None:
+                yield make_task(current, batches)
+            for t in pending:
+                yield make_task(t, [[] for c in query_columns])
+        finally:
+            cur.close()
+
+    def _check_task_columns(self, columns):
+        """Return the requested task columns as a list, default all of TASK_COLUMNS."""
+        if columns is None:
+            return list(self.TASK_COLUMNS.keys())
+
+        columns = list(columns)
+        unknown = [c for c in columns if c not in self.TASK_COLUMNS]
+        if unknown:
+            raise ValueError('Unknown task column(s): {0}'.format(', '.join(unknown)))
+        return columns
+
+    def _task_columns_sql(self, columns, task_ids, datatype_id=None, channel=None):
+        """Return sql query and arguments selecting columns from the DPV table,
+        joined with Measures and DP_ABMN only when needed."""
+        expressions = [self.TASK_COLUMNS[c][0] for c in columns]
+        tables = set(e.split('.')[0] for e in expressions)
+
+        sql = "SELECT " + ", ".join(expressions) + " FROM DPV"
+        if 'Measures' in tables:
+            sql += " JOIN Measures ON DPV.MeasureID=Measures.ID"
+        if 'DP_ABMN' in tables:
+            sql += " JOIN DP_ABMN ON DPV.DPID=DP_ABMN.ID"
+
+        where = []
+        args = []
+        for col, values in (('DPV.TaskID', task_ids), ('DPV.DatatypeID', datatype_id),
+                            ('DPV.Channel', channel)):
+            if values is None:
+                continue
+            values = [int(v) for v in np.atleast_1d(values)]
+            if len(values) == 1:
+                where.append("{0}=?".format(col))
+            else:
+                where.append("{0} IN ({1})".format(col, ",".join("?"*len(values))))
+            args.extend(values)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return sql, args
+
+    def _fetch_column_batches(self, cur, columns):
+        """Generator fetching FETCH_BATCH_SIZE rows at a time from an executed
+        cursor, yielding a dictionary of typed numpy arrays per batch."""
+        dtypes = [self.TASK_COLUMNS[c][1] for c in columns]
+        while True:
+            rows = cur.fetchmany(self.FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            arrays = dict()
+            for c, dtype, values in zip(columns, dtypes, zip(*rows)):
+                if dtype.startswith('datetime64'):
+                    arrays[c] = parse_times(Series(values, dtype=object)).values.astype(dtype)
+                else:
+                    arrays[c] = np.array(values, dtype=dtype)
+            yield arrays
+
+    def _concatenate_columns(self, columns, batches):
+        """Concatenate lists of array batches into one typed array per column."""
+        result = dict()
+        for c, batch in zip(columns, batches):
+            if batch:
+                result[c] = np.concatenate(batch)
+            else:
+                result[c] = np.array([], dtype=self.TASK_COLUMNS[c][1])
+        return result
+
     def get_quadrupoles(self, task_id=None, cur=None):
         """Reads the quadrupole information for the task specified (the DP_ABMN table)."""
         sql = """
@@ -462,8 +908,7 @@ class ABEMLS_project():
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
         #pdb.set_trace()
         if task_id is not None:
@@ -478,21 +923,28 @@ class ABEMLS_project():
 
         if temp_cur:
             cur.close()
-            conn.close()
 
         return result
 
+    def get_log_events(self, cur=None):
+        """Return the times of the first and last log entry, and of the
+        LOG_EVENTS, for each task. See log_events."""
+        rows, cols = self.execute_sql('SELECT TaskID, Time, What FROM Log ORDER BY ID', cur=cur)
+        return log_events(DataFrame(rows, columns=cols))
+
     def get_settings_dict(self, session_id=None, task_id=None, cur=None):
-        """Loads all acquisition settings from project file, and sets the instance settings attribute
-        with a dictionary containing dicts of name, value pairs as values and SessionID as key.
+        """Loads acquisition settings from project file, and returns a dictionary
+        containing dicts of name, value pairs as values and SessionID as key.
+        The session_id and task_id arguments are passed on to get_acqsettings.
         """
 
-        result = dict()
-        settings = self.get_acqsettings(session_id=None, task_id=None)
+        settings = self.get_acqsettings(session_id=session_id, task_id=task_id, cur=cur)
+        if settings is None:
+            return dict()
 
-        for session in settings['key2'].unique():
-            ses_set = settings[settings['key2'] == session]
-            result[session] = dict(ses_set[['Setting','Value']].values)
+        result = dict()
+        for session, ses_set in settings.groupby('key2', sort=False):
+            result[session] = dict(zip(ses_set['Setting'], ses_set['Value']))
         return result
 
     def get_acqsettings(self, session_id=None, task_id=None, cur=None):
@@ -602,8 +1054,7 @@ class ABEMLS_project():
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
         #pdb.set_trace()
         cur.execute(self.GET_TASK_COORDS, (int(task_id),))
@@ -617,7 +1068,6 @@ class ABEMLS_project():
 
         if temp_cur:
             cur.close()
-            conn.close()
 
         return result
             
@@ -641,8 +1091,7 @@ class ABEMLS_project():
         temp_cur = False
         if cur is None:
             temp_cur = True
-            conn = sqlite3.connect(self.filename)
-            cur = conn.cursor()
+            cur = self.cursor()
 
         if task_id is not None:
             cur.execute(self.HAS_MEASUREMENTS_SQL +
@@ -656,7 +1105,6 @@ class ABEMLS_project():
 
         if temp_cur:
             cur.close()
-            conn.close()
 
         if task:
             return True
@@ -683,57 +1131,121 @@ class ABEMLS_project():
         return tree
 
 
+    def get_spread_index(self, fname="", path="", task_id=None):
+        """Return the electrode index of a spread file, see SpreadIndex.
+
+        The index is built once per spread file and cached in self.spread_indices.
+
+        :param fname: str
+            Filename of the spread file. Only the basename is used.
+        :param path: str
+            Folder holding the spread file. If omitted, self.xml_path is used.
+        :param task_id: integer
+            If fname is omitted, the spread file of this task is used.
+
+        :return: SpreadIndex or None if the spread file is not found.
+        """
+        if not fname and task_id is not None:
+            fname = self.tasks.SpreadFile[self.tasks.ID==task_id].values[0]
+        basename = os.path.basename(fname)
+        if basename in self.spread_indices:
+            return self.spread_indices[basename]
+
+        tree = self.get_spreadfile(basename, path)
+        if tree is None:
+            return None
+        index = SpreadIndex.from_tree(tree)
+        self.spread_indices[basename] = index
+        return index
+
     def get_electrode_id(self, posx=None, posy=None, posz=None,
                          switch_number=1, switch_address=None,
                          spreadfile="", path="", task_id=None):
+        """Return the id of the electrode at the given position or switch address.
+
+        Electrodes are matched on x (and y, if given) positions rounded to whole
+        numbers. The z position is not used. Use get_spread_index or
+        get_quadrupole_electrodes to look up many electrodes at once.
+
+        :return: integer or None if no electrode is found.
+        """
+        index = self.get_spread_index(spreadfile, path, task_id=task_id)
+        if index is None:
+            return None
 
-        if not spreadfile and task_id is not None:
-            spreadfile = os.path.basename(self.tasks.SpreadFile[self.tasks.ID==task_id].values[0])
-        tree = self.get_spreadfile(spreadfile, path)
-        #pdb.set_trace()
         if posx is not None:
-            xpstring = ".//Electrode[X//text()=' {0:.0f} '".format(posx)
+            eid = index.ids_from_positions(posx, posy)[0]
+            what = 'X={0:.0f}'.format(posx)
             if posy is not None:
-                xpstring += " and Y//text()=' {0:.0f} '".format(posy)
-            #if posz is not None:
-            #    xpstring += " and Z//text()=' {0:.0f} '".format(posz)
+                what += ', Y={0:.0f}'.format(posy)
         elif switch_address is not None:
             if switch_number != 1:
                 raise NotImplementedError('Support for more than one switch is not implemented.')
-            xpstring = ".//Electrode[SwitchAddress//text()=' {0:.0f} '".format(switch_address)
+            eid = index.ids_from_switch_addresses(switch_address)[0]
+            what = 'SwitchAddress={0:.0f}'.format(switch_address)
+        else:
+            raise ValueError('Pass either posx or switch_address to get_electrode_id.')
+
+        if eid == MISSING_ELECTRODE:
+            print("Could not find electrode: " + what)
+            return None
+        return int(eid)
 
-        xpstring += "]//Id//text()"
+    def get_quadrupole_electrodes(self, task_id, spreadfile="", path="", use_y=True):
+        """Return the electrode ids of the A, B, M and N electrodes of all
+        quadrupoles in a task.
 
-        try:
-            return int(tree.xpath(xpstring)[0])
-        except:
-            print("Could not find electrode: " + xpstring)
+        :param task_id: integer
+            The TaskID of the task.
+        :param spreadfile: str
+            Filename of the spread file. If omitted, the spread file of the task is used.
+        :param path: str
+            Folder holding the spread file. If omitted, self.xml_path is used.
+        :param use_y: Boolean
+            If False, electrodes are matched on x positions only.
+
+        :return: DataFrame
+            The quadrupole ID and columns A, B, M and N with electrode ids
+            (MISSING_ELECTRODE where no electrode matches). None if the spread
+            file is not found.
+        """
+        index = self.get_spread_index(spreadfile, path, task_id=task_id)
+        if index is None:
             return None
+        quadrupoles = self.get_quadrupoles(task_id=task_id)
+        if len(quadrupoles) == 0:
+            return DataFrame(columns=['ID', 'A', 'B', 'M', 'N'])
+        return index.quadrupole_ids(quadrupoles, use_y=use_y)
 
-    def export_dat(self, task_id=1, filename=None, out_path=None, exclude_negative=True, datatype='resistivity'):
-        
-        tasklist = self.get_tasklist()
-        task_info = tasklist.set_index('ID').loc[task_id]
-    
-        data, ecr_data = self.get_task(task_id=task_id)
-        
+    def get_dat_data(self, task_id=1, datatype='resistivity', exclude_negative=True):
+        """Return the quadrupole positions and data values of a task, as exported
+        to .dat and .ohm files.
+
+        :param task_id: integer
+            The TaskID of the task.
+        :param datatype: str
+            'resistivity' for apparent resistivities (DatatypeID 2), otherwise
+            resistances of the data channels (DatatypeID 5).
+        :param exclude_negative: Boolean
+            If True, negative data values are removed.
+
+        Returns: dataframe
+            Dataframe with the columns in export.DAT_COLUMNS. Positions are not
+            scaled by the electrode spacing.
+        """
         if datatype == 'resistivity':
-            resistivity = data[data['DatatypeID']==2]    # get measured resistivities
-            #dat = resistivity[['MeasureID','Channel','APosX','APosZ','BPosX','BPosZ','MPosX','MPosZ','NPosX','NPosZ','DataValue','Time']].copy()
-            dat = resistivity[['APosX','APosZ','BPosX','BPosZ','MPosX','MPosZ','NPosX','NPosZ','DataValue']].copy()
+            # get measured resistivities
+            dat = self.get_task_columns(task_id=task_id, datatype_id=2, columns=DAT_COLUMNS)
         else:
-            resistance = data[(data['DatatypeID']==5) & (data['Channel']>0)]     # get measured resistances
-            #dat = resistance[['MeasureID','Channel','APosX','APosZ','BPosX','BPosZ','MPosX','MPosZ','NPosX','NPosZ','DataValue','Time']].copy()
-            dat = resistance[['APosX','APosZ','BPosX','BPosZ','MPosX','MPosZ','NPosX','NPosZ','DataValue']].copy()
-            
+            # get measured resistances
+            dat = self.get_task_columns(task_id=task_id, datatype_id=5, channel=DATA_CHANNELS,
+                                        columns=DAT_COLUMNS)
+
         if exclude_negative:
             dat = dat[dat['DataValue']>=0]
+        return dat
 
-        dat.insert(loc=0, column='n_elec', value=4)
-
-        xspc = task_info['SpacingX']
-        dat.loc[:,['APosX','BPosX','MPosX','NPosX']] = dat[['APosX','BPosX','MPosX','NPosX']]*xspc
-
+    def _export_filename(self, filename, out_path, suffix):
         if filename is None:
             filename = pathlib.Path(self.filename).parent.stem
         
@@ -741,104 +1253,138 @@ class ABEMLS_project():
             out_path = pathlib.Path(self.filename).parent
         else:
             out_path = pathlib.Path(out_path)
-        
-        outlist = []
-        outlist.append(self.filename)
-        outlist.append('{0:.2f}'.format(xspc))
-        outlist.append('11')
-        outlist.append('{0:.0f}'.format(task_info['ArrayCode']))
-        outlist.append('Type of measurement (0=app.resistivity, 1=resistance)')
-        if datatype == 'resistivity':
-            outlist.append('0')
-        else:
-            outlist.append('1')
-            
-        outlist.append('{0:.0f}'.format(len(dat)))
-        outlist.append('2')   # type of x-location, 1=True horizontal, 2=distance along ground surface
-        outlist.append('0')   # IP data included, 0=No, 1=Yes
-        outlist.append(dat[dat['DataValue']>=0][::-1].to_string(header=None, index=False, index_names=False))
-        outlist.append('0\n0\n0\n0\n0\n0\n0\n0\n0\n0\n0\n0')
-        
-        with open((out_path/filename).with_suffix('.dat'), 'w') as f:
-            f.write('\n'.join(outlist))
-
-
-
+        return (out_path/filename).with_suffix(suffix)
 
-def condense_measurements(data, datatype_dict):
-    """Condense measurements such that all measurement values for a specific
-    channel and MeasureID is in the same row
-
-    data:           a DataFrame as returned by ABEMLS_project.get_task()
-    datatype_dict:  a dictionary of datatypes as stored in ABEMLS_project.datatypes
-    """
-
-    # raise NotImplementedError('condense_measurements method not yet finished!')
-
-    rep_dict = {'\u03c1': r'rho_',
-                '\u0394': r'd',
-                '\u03a9': r'Ohm'}
+    def export_dat(self, task_id=1, filename=None, out_path=None, exclude_negative=True,
+                   datatype='resistivity', data=None):
+        """Export task data to a Res2DInv general array .dat file.
 
+        :param task_id: integer
+            The TaskID of the task to export.
+        :param filename: str
+            Basename of the file. If None, the name of the project folder is used.
+        :param out_path: str or Path
+            Folder to write to. If None, the folder of the project file is used.
+        :param exclude_negative: Boolean
+            If True, negative data values are not exported.
+        :param datatype: str
+            'resistivity' or 'resistance'.
+        :param data: dataframe
+            Data as returned by get_dat_data, to avoid reading it again when
+            exporting to several formats.
+        """
+        task_info = self.tasks.set_index('ID').loc[task_id]
+        if data is None:
+            data = self.get_dat_data(task_id=task_id, datatype=datatype,
+                                     exclude_negative=exclude_negative)
 
-    MeasureIDs = data.MeasureID.unique()
-    channels = data.Channel.unique()
-
-    result = None
-
-    for mid in MeasureIDs:
-
-        # Here we should get out the Current:
-
-        # Ivalue = ....
-        # Isdev = ....
+        xspc = task_info['SpacingX']
+        dat = data[DAT_COLUMNS].values[::-1].astype(float)
+        dat[:, [0, 2, 4, 6]] *= xspc
 
-        # So that we can add it below...
+        text = export.dat_string(self.filename, xspc, task_info['ArrayCode'], dat,
+                                 datatype=datatype)
+        export.write_text(self._export_filename(filename, out_path, '.dat'), text)
 
-        for c in channels:
-            if (c<1) or (c>12):
-                # only handle data channels
-                continue
+    def export_ohm(self, task_id=1, filename=None, out_path=None, exclude_negative=True,
+                   datatype='resistivity', topo=None, data=None):
+        """Export task data to a pyGIMLi unified data format (.ohm) file.
 
-            dat = data[(data.MeasureID==mid) & (data.Channel==c)]
+        :param topo: 2D array_like
+            Sensor x and z coordinates, sorted by x. Electrodes are assigned to
+            the sensor closest to their x position. If None, the sensors are
+            the electrode positions used in the task, at z=0 (flat topography).
 
-            if len(dat) == 0:
-                continue
+        See export_dat for the other parameters.
+        """
+        task_info = self.tasks.set_index('ID').loc[task_id]
+        if data is None:
+            data = self.get_dat_data(task_id=task_id, datatype=datatype,
+                                     exclude_negative=exclude_negative)
 
-            # Prepare new DataFrame
-            tmp = dat.ix[dat.index[0]].copy()
-            tmp = tmp.drop(['DataValue', 'DataSDev', 'SeqNum',
-                            'DatatypeID'])
-            df = DataFrame(data=np.atleast_2d(tmp.values),
-                           columns=tmp.index)
-
-            for dtid in sorted(dat.DatatypeID.unique()):
-                d = dat[dat.DatatypeID==dtid]
-                if len(d.SeqNum)==0:
-                    # No data with this datatype
-                    continue
-                elif len(d.SeqNum)>1:
-                    # Loop over all sequence numbers and add a subscript when
-                    # adding the name
-                    for sn in d.SeqNum.unique():
-                        pass
-                else:
-                    # We have only one item with this datatype, add it...
-                    n = datatype_dict[dtid]['Name']
+        xspc = task_info['SpacingX']
+        pos_x = data[['APosX','BPosX','MPosX','NPosX']].values[::-1].astype(float)*xspc
 
-                    # Replace known non-ascii unicode chars from names
-                    for k,v in list(rep_dict.items()):
-                        n = n.replace(k,v)
+        if topo is None:
+            sensor_x = np.unique(pos_x)
+            sensors = np.column_stack([sensor_x, np.zeros(len(sensor_x))])
+        else:
+            sensors = np.asarray(topo, dtype=float)[:, :2]
+            sensor_x = sensors[:, 0]
 
-                    df[n] = np.array(d.DataValue, dtype=float)[0]
-                    df[n+'_SDev'] = np.array(d.DataSDev, dtype=float)[0]
+        abmn = export.sensor_indices(sensor_x, pos_x)
+        ohm = np.column_stack([abmn, data['DataValue'].values[::-1]])
+        text = export.ohm_string(sensors, ohm, token=export.OHM_TOKENS.get(datatype, 'r'))
+        export.write_text(self._export_filename(filename, out_path, '.ohm'), text)
 
-            if result is None:
-                result = df.copy()
-            else:
-                result = result.append(df, ignore_index=True)
 
+def condense_measurements(data, datatype_dict):
+    """Condense measurements such that all measurement values for a specific
+    channel and MeasureID is in the same row
 
-    return result
+    Each datatype present in the data channels gives a value column named by
+    the datatype name and a corresponding '_SDev' column. Datatypes recorded
+    with several sequence numbers for the same channel and MeasureID get one
+    pair of columns per SeqNum, with the SeqNum added as subscript
+    (e.g. 'IP_1', 'IP_1_SDev', 'IP_2', ...).
 
+    data:           a DataFrame as returned by ABEMLS_project.get_task()
+    datatype_dict:  a dictionary of datatypes as stored in ABEMLS_project.datatypes
+    """
 
+    rep_dict = {'\u03c1': r'rho_',
+                '\u0394': r'd',
+                '\u03a9': r'Ohm'}
 
+    if len(data) == 0:
+        return DataFrame()
+
+    # only handle data channels
+    data = data[data.Channel.isin(DATA_CHANNELS)]
+    if len(data) == 0:
+        return DataFrame()
+
+    keys = ['MeasureID', 'Channel']
+    value_cols = ['DataValue', 'DataSDev']
+    base_cols = [c for c in data.columns
+                 if c not in ['DataValue', 'DataSDev', 'SeqNum', 'DatatypeID']]
+
+    # One row per MeasureID and channel, taking the common columns from the
+    # first row of each group. Rows are ordered by MeasureID, then channel,
+    # in order of first appearance.
+    mid_rank = factorize(data.MeasureID)[0]
+    ch_rank = factorize(data.Channel)[0]
+    order = np.lexsort((ch_rank, mid_rank))
+    result = data.iloc[order].drop_duplicates(keys)[base_cols]
+    result = result.set_index(keys)
+
+    # Datatypes with more than one SeqNum in any group get subscripted names
+    nseq = data.groupby(keys + ['DatatypeID'], sort=False)['SeqNum'].nunique()
+    multi_seq = set(nseq[nseq > 1].index.get_level_values('DatatypeID'))
+
+    names = dict()
+    for dtid in data.DatatypeID.unique():
+        n = datatype_dict[dtid]['Name']
+        # Replace known non-ascii unicode chars from names
+        for k,v in list(rep_dict.items()):
+            n = n.replace(k,v)
+        names[dtid] = n
+
+    labels = data.DatatypeID.map(names)
+    is_multi = data.DatatypeID.isin(multi_seq)
+    labels[is_multi] = labels[is_multi] + '_' + data.SeqNum[is_multi].astype(str)
+
+    values = data[keys + value_cols].assign(label=labels.values, DatatypeID=data.DatatypeID.values,
+                                            SeqNum=data.SeqNum.values)
+    wide = values.groupby(keys + ['label'], sort=False)[value_cols].first().unstack('label')
+
+    # Add value and SDev columns sorted by DatatypeID and SeqNum
+    label_order = (values[['DatatypeID', 'SeqNum', 'label']]
+                   .drop_duplicates('label')
+                   .sort_values(['DatatypeID', 'SeqNum'])['label'])
+    wide = wide.reindex(result.index)
+    for n in label_order:
+        result[n] = wide[('DataValue', n)].astype(float).values
+        result[n+'_SDev'] = wide[('DataSDev', n)].astype(float).values
+
+    return result.reset_index()[base_cols + [c for c in result.columns if c not in base_cols]]
@@ -0,0 +1,185 @@
+import sqlite3
+import pathlib
+import warnings
+from pandas import DataFrame
+
+
+# Default number of databases attached at the same time. SQLite allows at
+# most 10 attached databases unless compiled with a higher limit.
+DEFAULT_ATTACH_LIMIT = 10
+
+
+class ProjectCatalog():
+    """Query many Terrameter LS project files as one catalog.
+
+    Project files are attached in batches to a single in-memory SQLite
+    connection, and a query is run against all projects in a batch as one
+    UNION ALL statement. Results are returned as one dataframe, with a column
+    naming the project each row comes from.
+
+    Queries are written as for a single project, with the table names prefixed
+    by '{db}.', e.g.
+
+        catalog = ProjectCatalog(project_path.rglob('*.db'))
+        power = catalog.query("SELECT Time, ExtPowerVolt FROM {db}.Log")
+        temps = catalog.select('DPV', ['TaskID', 'DataValue'], where='DatatypeID=13')
+
+    Finished projects are attached read-only and immutable; projects that are
+    still being written are attached with normal locking (see
+    is_active_project). The catalog connection only allows read queries.
+    """
+
+    def __init__(self, db_files, names=None, batch_size=None, open_mode='auto'):
+        """
+        :param db_files: iterable
+            The project database files.
+        :param names: iterable
+            Project names, one per file. If None, the name of the folder
+            holding each file is used.
+        :param batch_size: integer
+            Number of databases attached at a time. Limited to the number of
+            attached databases allowed by the SQLite library.
+        :param open_mode: str
+            'auto', 'immutable' or 'safe', see ABEMLS_project.connect.
+        """
+        self.db_files = [str(f) for f in db_files]
+        if names is None:
+            names = [pathlib.Path(f).parent.name for f in self.db_files]
+        self.names = [str(n) for n in names]
+        if len(self.names) != len(self.db_files):
+            raise ValueError('Pass one name per project file.')
+        self.open_mode = open_mode
+
+        self._conn = sqlite3.connect(':memory:', uri=True)
+        self._conn.execute('PRAGMA query_only=ON')
+
+        limit = DEFAULT_ATTACH_LIMIT
+        if hasattr(self._conn, 'getlimit'):
+            limit = self._conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        self.batch_size = limit if batch_size is None else max(1, min(batch_size, limit))
+
+    def __len__(self):
+        return len(self.db_files)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the catalog connection."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _uri(self, filename):
+        from . import is_active_project, project_uri
+
+        mode = self.open_mode
+        if mode == 'auto':
+            mode = 'safe' if is_active_project(filename) else 'immutable'
+        if mode not in ['immutable', 'safe']:
+            raise ValueError('Unknown open_mode: {0}'.format(self.open_mode))
+        return project_uri(filename, immutable=(mode == 'immutable'))
+
+    def _batches(self):
+        for start in range(0, len(self.db_files), self.batch_size):
+            yield list(zip(self.names[start:start+self.batch_size],
+                           self.db_files[start:start+self.batch_size]))
+
+    def _run_batch(self, batch, sql, args, project_column):
+        """Attach the databases of a batch and run sql against all of them
+        with one UNION ALL statement. Returns rows and column names."""
+        cur = self._conn.cursor()
+        aliases = []
+        try:
+            for n, (name, filename) in enumerate(batch):
+                alias = 'p{0}'.format(n)
+                cur.execute('ATTACH DATABASE ? AS {0}'.format(alias), (self._uri(filename),))
+                aliases.append(alias)
+
+            selects = []
+            all_args = []
+            for alias, (name, filename) in zip(aliases, batch):
+                selects.append('SELECT ? AS "{0}", * FROM ({1})'.format(
+                    project_column, sql.format(db=alias)))
+                all_args.append(name)
+                all_args.extend(args)
+
+            cur.execute(' UNION ALL '.join(selects), all_args)
+            rows = cur.fetchall()
+            cols = [c[0] for c in cur.description]
+        finally:
+            for alias in aliases:
+                cur.execute('DETACH DATABASE {0}'.format(alias))
+            cur.close()
+        return rows, cols
+
+    def query(self, sql, args=None, project_column='project', on_error='warn'):
+        """Run a query against all projects in the catalog.
+
+        :param sql: str
+            A SELECT statement written for a single project, with table names
+            prefixed by '{db}.' (e.g. "SELECT Time, Temp FROM {db}.Log").
+        :param args: iterable
+            Arguments for the '?' placeholders of sql.
+        :param project_column: str
+            Name of the column added to the result with the project name.
+        :param on_error: str
+            'warn' to skip projects that cannot be queried (e.g. missing or
+            corrupt files) with a warning, or 'raise' to raise the error.
+
+        :return: dataframe
+            The rows of all projects, in the order of the project files.
+        """
+        args = list(args) if args is not None else []
+        rows = []
+        cols = None
+        for batch in self._batches():
+            try:
+                batch_rows, cols = self._run_batch(batch, sql, args, project_column)
+                rows.extend(batch_rows)
+                continue
+            except (sqlite3.Error, OSError) as e:
+                if on_error == 'raise':
+                    raise
+                if len(batch) == 1:
+                    warnings.warn('Could not query project {0} ({1}): {2}'.format(
+                        batch[0][0], batch[0][1], e))
+                    continue
+
+            # Rerun the batch project by project to skip the failing ones
+            for item in batch:
+                try:
+                    item_rows, cols = self._run_batch([item], sql, args, project_column)
+                except (sqlite3.Error, OSError) as e:
+                    warnings.warn('Could not query project {0} ({1}): {2}'.format(
+                        item[0], item[1], e))
+                    continue
+                rows.extend(item_rows)
+
+        if cols is None:
+            return DataFrame()
+        return DataFrame(rows, columns=cols)
+
+    def select(self, table, columns=None, where=None, args=None, project_column='project'):
+        """Select columns of one table from all projects in the catalog.
+
+        :param table: str
+            The table name, e.g. 'Log'.
+        :param columns: iterable
+            The columns to select. If None, all columns are selected.
+        :param where: str
+            Optional sql condition, e.g. "ExtPowerVolt IS NOT NULL".
+        :param args: iterable
+            Arguments for the '?' placeholders of where.
+
+        :return: dataframe
+            See query.
+        """
+        cols = '*' if columns is None else ', '.join(columns)
+        sql = 'SELECT {0} FROM {{db}}.{1}'.format(cols, table)
+        if where:
+            sql += ' WHERE ' + where
+        return self.query(sql, args=args, project_column=project_column)
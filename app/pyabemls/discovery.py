@@ -0,0 +1,132 @@
+import os
+import re
+import json
+import pathlib
+import datetime as dt
+import warnings
+
+
+# Project folders are named by the date and time of the acquisition, e.g.
+# 220701_0300. Folders with other characters are not projects.
+PROJECT_NAME_PATTERN = r'^[_0-9]+$'
+PROJECT_DATE_FORMAT = '%y%m%d'
+
+
+def project_date(name, date_format=PROJECT_DATE_FORMAT):
+    """Return the date encoded in the first six characters of a project folder
+    name, or None if they are not a valid date."""
+    try:
+        return dt.datetime.strptime(name[0:6], date_format)
+    except ValueError:
+        return None
+
+
+class ProjectDiscovery():
+    """Find the project files in the projects folder mirrored from the instrument.
+
+    The folder is expected to hold one folder per project, named by date
+    (see PROJECT_NAME_PATTERN), holding the project database. Folders are
+    listed with os.scandir, and folders that are not projects, or are dated
+    before start_date, are skipped without being listed.
+
+    The listing can be cached in a json file. On the next run, a folder is only
+    listed again if its modification time has changed, i.e. if files or folders
+    were added to, removed from or renamed in it.
+
+        discovery = ProjectDiscovery(project_path, start_date=dt.datetime(2021,6,26),
+                                     cache_file='projects.json')
+        for file, project_name, proj_date in discovery.projects():
+            ...
+        discovery.save()
+    """
+
+    def __init__(self, project_path, start_date=None, cache_file=None, suffix='.db',
+                 name_pattern=PROJECT_NAME_PATTERN):
+        """
+        :param project_path: str or Path
+            The folder holding the project folders.
+        :param start_date: datetime
+            Projects dated before start_date are skipped.
+        :param cache_file: str or Path
+            Json file to persist the listing between runs. If None, the
+            listing is only cached in memory.
+        :param suffix: str
+            Suffix of the project database files.
+        """
+        self.project_path = pathlib.Path(project_path)
+        self.start_date = start_date
+        self.cache_file = None if cache_file is None else pathlib.Path(cache_file)
+        self.suffix = suffix
+        self.name_pattern = re.compile(name_pattern)
+        self._cache = dict()
+        self._dirty = False
+
+        if self.cache_file is not None and self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r') as f:
+                    self._cache = json.load(f)
+            except (ValueError, OSError):
+                warnings.warn('Could not read project listing cache {0}, '
+                              'all folders will be listed.'.format(self.cache_file))
+                self._cache = dict()
+
+    def _listing(self, path, kind):
+        """Return the names of the folders (kind='dirs') or files (kind='files')
+        in path, listing it only if its mtime differs from the cached one."""
+        path = str(path)
+        mtime = os.stat(path).st_mtime
+        entry = self._cache.get(path)
+        if entry is not None and entry['mtime'] == mtime:
+            return entry['names']
+
+        names = []
+        with os.scandir(path) as it:
+            for e in it:
+                if kind == 'dirs' and e.is_dir():
+                    names.append(e.name)
+                elif kind == 'files' and e.is_file() and e.name.endswith(self.suffix):
+                    names.append(e.name)
+        names.sort()
+        self._cache[path] = dict(mtime=mtime, names=names)
+        self._dirty = True
+        return names
+
+    def project_folders(self):
+        """Return (name, date) of the project folders dated from start_date,
+        sorted by name."""
+        folders = []
+        for name in self._listing(self.project_path, 'dirs'):
+            if not self.name_pattern.match(name):
+                # invalid characters present (anything other than _ and 0-9)
+                continue
+            date = project_date(name)
+            if date is None:
+                continue
+            if self.start_date is not None and date < self.start_date:
+                continue
+            folders.append((name, date))
+        return folders
+
+    def projects(self):
+        """Return (file, project_name, proj_date) of all project files,
+        sorted by project name."""
+        result = []
+        for name, date in self.project_folders():
+            folder = self.project_path / name
+            try:
+                files = self._listing(folder, 'files')
+            except OSError:
+                # removed since the projects folder was listed
+                continue
+            result.extend((folder / f, name, date) for f in files)
+        return result
+
+    def save(self):
+        """Write the listing to the cache file, if it was changed."""
+        if self.cache_file is None or not self._dirty:
+            return
+        tmp = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._cache, f, indent=1)
+        os.replace(tmp, self.cache_file)
+        self._dirty = False
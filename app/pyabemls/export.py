@@ -0,0 +1,249 @@
+import os
+import re
+import pathlib
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Columns of the quadrupole data written to Res2DInv .dat files
+DAT_COLUMNS = ['APosX','APosZ','BPosX','BPosZ','MPosX','MPosZ','NPosX','NPosZ','DataValue']
+
+# Number formats of the data rows
+POSITION_FORMAT = '%.2f'
+VALUE_FORMAT = '%.8g'
+
+# pyGIMLi data tokens of the exported datatypes
+OHM_TOKENS = {'resistivity': 'rhoa', 'resistance': 'r'}
+
+
+def format_table(values, formats, sep=' '):
+    """Format a 2D array as text lines, with one printf-style format per column.
+
+    The whole table is formatted by one string formatting operation, instead of
+    formatting row by row.
+
+    :param values: 2D array_like
+        The table to format.
+    :param formats: list of str
+        Format of each column, e.g. ['%d', '%.2f'].
+
+    :return: str
+        The formatted lines, separated by newlines (no trailing newline).
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return ''
+    line = sep.join(formats)
+    return '\n'.join([line]*len(values)) % tuple(values.ravel().tolist())
+
+
+def dat_string(title, spacing, array_code, data, datatype='resistivity'):
+    """Return the contents of a Res2DInv general array .dat file.
+
+    :param title: str
+        Title (first line) of the file.
+    :param spacing: float
+        Unit electrode spacing.
+    :param array_code: int
+        Array type code of the measurements.
+    :param data: 2D array_like
+        One row per quadrupole with columns as in DAT_COLUMNS, positions
+        already scaled by the spacing.
+    :param datatype: str
+        'resistivity' for apparent resistivities, otherwise resistances.
+    """
+    data = np.asarray(data, dtype=float).reshape(-1, len(DAT_COLUMNS))
+    table = np.column_stack([np.full(len(data), 4), data])   # 4 electrodes per datum
+
+    outlist = []
+    outlist.append(str(title))
+    outlist.append('{0:.2f}'.format(spacing))
+    outlist.append('11')
+    outlist.append('{0:.0f}'.format(array_code))
+    outlist.append('Type of measurement (0=app.resistivity, 1=resistance)')
+    if datatype == 'resistivity':
+        outlist.append('0')
+    else:
+        outlist.append('1')
+    outlist.append('{0:.0f}'.format(len(data)))
+    outlist.append('2')   # type of x-location, 1=True horizontal, 2=distance along ground surface
+    outlist.append('0')   # IP data included, 0=No, 1=Yes
+    outlist.append(format_table(table, ['%d'] + [POSITION_FORMAT]*8 + [VALUE_FORMAT]))
+    outlist.append('0\n0\n0\n0\n0\n0\n0\n0\n0\n0\n0\n0')
+    return '\n'.join(outlist)
+
+
+def ohm_string(sensors, data, token='R'):
+    """Return the contents of a pyGIMLi unified data format (.ohm) file.
+
+    :param sensors: 2D array_like
+        One row per sensor with x and z coordinates.
+    :param data: 2D array_like
+        One row per datum with columns a, b, m, n and the data value.
+    :param token: str
+        Name of the data value column in the file header.
+    """
+    sensors = np.asarray(sensors, dtype=float).reshape(-1, 2)
+    data = np.asarray(data, dtype=float).reshape(-1, 5)
+
+    outlist = []
+    outlist.append('{0}# Number of sensors'.format(len(sensors)))
+    outlist.append('#x z')
+    outlist.append(format_table(sensors, ['%g', '%g']))
+    outlist.append('{0}# Number of data'.format(len(data)))
+    outlist.append('#a b m n {0}'.format(token))
+    outlist.append(format_table(data, ['%g']*4 + [VALUE_FORMAT]))
+    return '\n'.join(outlist)
+
+
+def write_text(filename, text):
+    """Write text to filename through a temporary file, so that readers never
+    see a partially written file."""
+    filename = pathlib.Path(filename)
+    tmp = filename.with_name(filename.name + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, filename)
+
+
+def sensor_indices(sensor_x, x):
+    """Return the 1-based index of the sensor closest to each x position.
+
+    :param sensor_x: 1D array_like
+        Sensor x coordinates, sorted in increasing order.
+    :param x: array_like
+        Positions to assign to sensors.
+    """
+    sensor_x = np.asarray(sensor_x, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if len(sensor_x) == 1:
+        return np.ones(x.shape, dtype=int)
+    idx = np.clip(np.searchsorted(sensor_x, x), 1, len(sensor_x)-1)
+    left = sensor_x[idx-1]
+    right = sensor_x[idx]
+    idx = np.where(np.abs(x-left) <= np.abs(right-x), idx-1, idx)
+    return idx + 1
+
+
+def is_up_to_date(output, sources):
+    """Return True if output exists and is newer than all source files."""
+    output = pathlib.Path(output)
+    if not output.exists():
+        return False
+    mtime = output.stat().st_mtime
+    return all(mtime >= pathlib.Path(s).stat().st_mtime for s in sources)
+
+
+def export_project(db_file, out_path=None, formats=('dat', 'ohm'), datatype='resistivity',
+                   task_names=None, exclude_negative=True, name_template='{project}_{task_name}_{task_id}',
+                   force=False):
+    """Export all tasks with measurements in one project file to .dat and/or .ohm files.
+
+    :param db_file: str or Path
+        The project database.
+    :param out_path: str or Path
+        Folder to write the files to. If None, the files are written next to db_file.
+    :param formats: iterable
+        File formats to write, 'dat' (Res2DInv) and/or 'ohm' (pyGIMLi).
+    :param datatype: str
+        'resistivity' or 'resistance'.
+    :param task_names: iterable or str
+        Names of the tasks to export, or a regular expression matched against
+        the task names. If None, all tasks with measurements are exported.
+    :param name_template: str
+        Basename of the exported files, formatted with project (name of the
+        project folder), task_id and task_name.
+    :param force: Boolean
+        If False, files that are newer than the project database are not rewritten.
+
+    :return: list of dicts
+        One record per file with keys db_file, task_id, output and status
+        ('written', 'up to date', 'no data').
+    """
+    # Imported here to avoid a circular import, pyabemls imports this module
+    from . import ABEMLS_project
+
+    db_file = pathlib.Path(db_file)
+    out_path = db_file.parent if out_path is None else pathlib.Path(out_path)
+    project = db_file.parent.stem
+
+    records = []
+    with ABEMLS_project(str(db_file)) as alsp:
+        tasks = alsp.get_tasklist(counts=['nData'])
+        tasks = tasks[tasks['nData'] > 0]
+        if isinstance(task_names, str):
+            tasks = tasks[[re.search(task_names, n) is not None for n in tasks['Name']]]
+        elif task_names is not None:
+            tasks = tasks[tasks['Name'].isin(list(task_names))]
+
+        for task_id, task_name in zip(tasks['ID'], tasks['Name']):
+            basename = name_template.format(project=project, task_id=task_id, task_name=task_name)
+            outputs = dict((fmt, (out_path / basename).with_suffix('.' + fmt)) for fmt in formats)
+            todo = [fmt for fmt, output in outputs.items()
+                    if force or not is_up_to_date(output, [db_file])]
+
+            for fmt in formats:
+                if fmt not in todo:
+                    records.append(dict(db_file=str(db_file), task_id=int(task_id),
+                                        output=str(outputs[fmt]), status='up to date'))
+            if not todo:
+                continue
+
+            dat = alsp.get_dat_data(task_id=task_id, datatype=datatype,
+                                    exclude_negative=exclude_negative)
+            for fmt in todo:
+                if len(dat) == 0:
+                    status = 'no data'
+                elif fmt == 'dat':
+                    alsp.export_dat(task_id=task_id, filename=basename, out_path=out_path,
+                                    exclude_negative=exclude_negative, datatype=datatype,
+                                    data=dat)
+                    status = 'written'
+                elif fmt == 'ohm':
+                    alsp.export_ohm(task_id=task_id, filename=basename, out_path=out_path,
+                                    exclude_negative=exclude_negative, datatype=datatype,
+                                    data=dat)
+                    status = 'written'
+                else:
+                    raise ValueError('Unknown export format: {0}'.format(fmt))
+                records.append(dict(db_file=str(db_file), task_id=int(task_id),
+                                    output=str(outputs[fmt]), status=status))
+    return records
+
+
+def _export_project_safe(db_file, kwargs):
+    try:
+        return export_project(db_file, **kwargs)
+    except Exception as e:
+        warnings.warn('Export of {0} failed: {1}'.format(db_file, e))
+        return [dict(db_file=str(db_file), task_id=None, output=None,
+                     status='failed: {0}'.format(e))]
+
+
+def batch_export(db_files, n_workers=None, **kwargs):
+    """Export many project files with export_project, using a pool of worker processes.
+
+    Projects that fail to export are reported with status 'failed: <reason>'
+    instead of stopping the batch. On Windows, call this from within an
+    "if __name__ == '__main__':" block.
+
+    :param db_files: iterable
+        The project databases to export.
+    :param n_workers: integer
+        Number of worker processes. If None, the number of processors is used.
+        With n_workers=1 the projects are exported in the calling process.
+    :param kwargs:
+        Passed on to export_project.
+
+    :return: list of dicts
+        The records returned by export_project for all projects, in the order
+        of db_files.
+    """
+    db_files = [str(f) for f in db_files]
+    if n_workers == 1 or len(db_files) <= 1:
+        results = [_export_project_safe(f, kwargs) for f in db_files]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_export_project_safe, db_files, [kwargs]*len(db_files)))
+    return [r for records in results for r in records]
@@ -0,0 +1,159 @@
+import os
+import json
+import pathlib
+import hashlib
+import warnings
+
+
+# Size of the blocks read when computing file checksums
+CHECKSUM_BLOCK_SIZE = 1024*1024
+
+
+def file_checksum(filename, block_size=CHECKSUM_BLOCK_SIZE):
+    """Return the sha1 hex digest of the contents of a file, read in blocks."""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IngestionManifest():
+    """Persistent record of the project files that have been ingested.
+
+    Each file is recorded with its size, modification time and a checksum of
+    its contents, keyed by the resolved file path, so that checking a file is
+    a dictionary lookup and a stat call. The checksum is only computed when the
+    size or modification time differ from the recorded values, so a file that
+    was touched without being changed is not read again.
+
+        manifest = IngestionManifest('ingest_manifest.json')
+        todo = [f for f in db_files if manifest.needs_update(f)]
+        ...
+        for f in todo:
+            manifest.record(f, proj_name=...)
+        manifest.save()
+    """
+
+    def __init__(self, manifest_file=None):
+        """
+        :param manifest_file: str or Path
+            Json file to persist the manifest between runs. If None, the
+            manifest is only kept in memory.
+        """
+        self.manifest_file = None if manifest_file is None else pathlib.Path(manifest_file)
+        self._entries = dict()
+        self._checked = dict()   # stat and checksum of files checked in this run
+        self._dirty = False
+
+        if self.manifest_file is not None and self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    self._entries = json.load(f)
+            except (ValueError, OSError):
+                warnings.warn('Could not read ingestion manifest {0}, '
+                              'all files will be ingested again.'.format(self.manifest_file))
+                self._entries = dict()
+
+    @staticmethod
+    def _key(filename):
+        return str(pathlib.Path(filename).resolve())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, filename):
+        return self._key(filename) in self._entries
+
+    def get(self, filename):
+        """Return the recorded entry of a file (dict with size, mtime, checksum
+        and any extra information), or None if it is not recorded."""
+        return self._entries.get(self._key(filename))
+
+    def status(self, filename):
+        """Compare a file with its recorded entry.
+
+        :return: str
+            'new' if the file is not recorded, 'changed' if its contents differ
+            from the recorded entry, 'unchanged' otherwise.
+        """
+        key = self._key(filename)
+        stat = os.stat(key)
+        entry = self._entries.get(key)
+        checked = dict(size=stat.st_size, mtime=stat.st_mtime, checksum=None)
+        self._checked[key] = checked
+
+        if entry is None:
+            return 'new'
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            checked['checksum'] = entry['checksum']
+            return 'unchanged'
+        if entry['size'] == stat.st_size:
+            # Same size, different mtime, compare the contents
+            checked['checksum'] = file_checksum(key)
+            if checked['checksum'] == entry['checksum']:
+                entry['mtime'] = stat.st_mtime
+                self._dirty = True
+                return 'unchanged'
+        return 'changed'
+
+    def needs_update(self, filename):
+        """Return True if the file is new or has changed since it was recorded."""
+        return self.status(filename) != 'unchanged'
+
+    def record(self, filename, **info):
+        """Record a file as ingested.
+
+        The size and modification time are those seen by the last call to
+        status/needs_update for the file, so that changes made while the file
+        was being read are detected on the next run. The checksum is only
+        stored if the file still has that size and modification time before
+        and after it is computed, otherwise it would be the checksum of the
+        rewritten file: the entry is then stored without a checksum, so that
+        the file is read again on the next run.
+
+        :param info:
+            Extra json serializable information stored with the entry, e.g.
+            the project name.
+        """
+        key = self._key(filename)
+        checked = self._checked.pop(key, None)
+        if checked is None:
+            stat = os.stat(key)
+            checked = dict(size=stat.st_size, mtime=stat.st_mtime, checksum=None)
+        if checked['checksum'] is None and self._unchanged_since(key, checked):
+            checksum = file_checksum(key)
+            if self._unchanged_since(key, checked):
+                checked['checksum'] = checksum
+        entry = dict(checked)
+        entry.update(info)
+        self._entries[key] = entry
+        self._dirty = True
+
+    @staticmethod
+    def _unchanged_since(filename, checked):
+        """Return True if the file still has the size and modification time
+        of checked."""
+        stat = os.stat(filename)
+        return stat.st_size == checked['size'] and stat.st_mtime == checked['mtime']
+
+    def remove(self, filename):
+        """Remove a file from the manifest."""
+        if self._entries.pop(self._key(filename), None) is not None:
+            self._dirty = True
+
+    def clear(self):
+        """Remove all files from the manifest."""
+        if self._entries:
+            self._entries = dict()
+            self._dirty = True
+
+    def save(self):
+        """Write the manifest to the manifest file, if it was changed."""
+        if self.manifest_file is None or not self._dirty:
+            return
+        tmp = self.manifest_file.with_name(self.manifest_file.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp, self.manifest_file)
+        self._dirty = False
@@ -0,0 +1,112 @@
+import os
+import json
+import pathlib
+import warnings
+from lxml import etree
+
+
+def count_measures(filename, tag='Rx'):
+    """Count the measurements (Rx elements) in a Terrameter LS protocol file.
+
+    The file is parsed as a stream, and elements are discarded as soon as
+    they are counted, so memory use does not depend on the protocol size.
+    """
+    n = 0
+    for event, element in etree.iterparse(str(filename), events=('end',), tag=tag):
+        n += 1
+        element.clear()
+        # Drop references to already counted siblings
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return n
+
+
+def protocol_basename(protocol_file):
+    """Return the basename of a protocol file path as stored in the project
+    TaskSettings, which may use either / or \\ as separator."""
+    if not protocol_file:
+        return ''
+    return os.path.basename(str(protocol_file).replace('\\', '/'))
+
+
+class ProtocolRegistry():
+    """Registry of protocol files with cached measurement counts.
+
+    Counts are cached by file path, size and modification time, and optionally
+    persisted to a json file, so that a protocol is only parsed again when it
+    changes.
+
+        registry = ProtocolRegistry(protocols_path, cache_file='protocols.json')
+        nominal = registry.nominal_measures(task_row['ProtocolFile'])
+    """
+
+    def __init__(self, protocols_path, cache_file=None):
+        """
+        :param protocols_path: str or Path
+            Folder holding the protocol files copied from the instrument.
+        :param cache_file: str or Path
+            Json file to persist the counts between runs. If None, counts are
+            only cached in memory.
+        """
+        self.protocols_path = pathlib.Path(protocols_path)
+        self.cache_file = None if cache_file is None else pathlib.Path(cache_file)
+        self._cache = dict()
+        self._dirty = False
+
+        if self.cache_file is not None and self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r') as f:
+                    self._cache = json.load(f)
+            except (ValueError, OSError):
+                warnings.warn('Could not read protocol cache {0}, '
+                              'counts will be recalculated.'.format(self.cache_file))
+                self._cache = dict()
+
+    def count(self, filename):
+        """Return the number of measurements in a protocol file, or None if the
+        file does not exist."""
+        filename = pathlib.Path(filename)
+        try:
+            stat = filename.stat()
+        except OSError:
+            return None
+
+        key = str(filename.resolve())
+        entry = self._cache.get(key)
+        if (entry is not None and entry['mtime'] == stat.st_mtime
+                and entry['size'] == stat.st_size):
+            return entry['count']
+
+        n = count_measures(filename)
+        self._cache[key] = dict(mtime=stat.st_mtime, size=stat.st_size, count=n)
+        self._dirty = True
+        return n
+
+    def nominal_measures(self, protocol_file):
+        """Return the number of measurements in the protocol used by a task.
+
+        :param protocol_file: str
+            The ProtocolFile setting of the task. Only the basename is used, and
+            the file is looked up in protocols_path.
+
+        :return: integer
+            Number of measurements, 0 if the protocol file is not available.
+        """
+        basename = protocol_basename(protocol_file)
+        if not basename:
+            return 0
+        n = self.count(self.protocols_path / basename)
+        if n is None:
+            warnings.warn('Protocol file not found: {0}'.format(self.protocols_path / basename))
+            return 0
+        return n
+
+    def save(self):
+        """Write the cached counts to the cache file, if any were added."""
+        if self.cache_file is None or not self._dirty:
+            return
+        tmp = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._cache, f, indent=1)
+        os.replace(tmp, self.cache_file)
+        self._dirty = False
@@ -0,0 +1,132 @@
+import numpy as np
+from pandas import DataFrame, Index
+from lxml import etree
+
+
+# Electrode id returned for positions or switch addresses not found in the spread
+MISSING_ELECTRODE = -1
+
+
+def _element_number(element, tag):
+    """Return the number stored in the text of the first tag below element, or nan."""
+    child = element.find('.//' + tag)
+    if child is None:
+        return np.nan
+    try:
+        return float(''.join(child.itertext()))
+    except ValueError:
+        return np.nan
+
+
+def _position_key(x, y=None):
+    """Combine rounded x (and y) positions into one int64 key per position.
+
+    Positions are rounded to whole numbers, like the ' {0:.0f} ' formatting
+    previously used to match spread file positions with XPath.
+    """
+    key = np.round(np.asarray(x, dtype=float)).astype(np.int64) * 2**32
+    if y is not None:
+        key = key + np.round(np.asarray(y, dtype=float)).astype(np.int64)
+    return key
+
+
+class SpreadIndex():
+    """Index of the electrodes in a Terrameter LS spread file.
+
+    The spread file is parsed once, and electrode ids can then be looked up by
+    position or by switch address, either one at a time or for whole arrays of
+    positions at once.
+    """
+
+    def __init__(self, ids, x, y, z, switch_address):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.z = np.asarray(z, dtype=float)
+        self.switch_address = np.asarray(switch_address, dtype=float)
+
+        # Lookup indices. Where several electrodes share a key, the first
+        # electrode in the spread file is used.
+        self._by_x = self._make_index(_position_key(self.x))
+        self._by_xy = self._make_index(_position_key(self.x, self.y))
+        valid = ~np.isnan(self.switch_address)
+        sa = np.where(valid, self.switch_address, MISSING_ELECTRODE).astype(np.int64)
+        self._by_switch_address = self._make_index(sa, valid)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Build the index from a parsed spread file (lxml element tree)."""
+        electrodes = [e for e in tree.iter('Electrode') if e.find('.//Id') is not None]
+        return cls(ids=[_element_number(e, 'Id') for e in electrodes],
+                   x=[_element_number(e, 'X') for e in electrodes],
+                   y=[_element_number(e, 'Y') for e in electrodes],
+                   z=[_element_number(e, 'Z') for e in electrodes],
+                   switch_address=[_element_number(e, 'SwitchAddress') for e in electrodes])
+
+    @classmethod
+    def from_file(cls, filename):
+        """Parse a spread file and build the index."""
+        return cls.from_tree(etree.parse(str(filename)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _make_index(self, keys, valid=None):
+        if valid is None:
+            valid = np.ones(len(keys), dtype=bool)
+        keys = keys[valid]
+        ids = self.ids[valid]
+        keys, first = np.unique(keys, return_index=True)
+        return Index(keys), ids[first]
+
+    @staticmethod
+    def _lookup(index, keys):
+        keys_index, ids = index
+        pos = keys_index.get_indexer(np.atleast_1d(keys))
+        return np.where(pos >= 0, ids[pos], MISSING_ELECTRODE)
+
+    def ids_from_positions(self, x, y=None):
+        """Return the electrode ids at the given positions.
+
+        :param x: array_like
+            Electrode x positions.
+        :param y: array_like
+            Electrode y positions. If None, electrodes are matched on x only.
+
+        :return: numpy array of int64
+            Electrode ids, MISSING_ELECTRODE where no electrode matches.
+        """
+        if y is None:
+            return self._lookup(self._by_x, _position_key(x))
+        return self._lookup(self._by_xy, _position_key(x, y))
+
+    def ids_from_switch_addresses(self, switch_address):
+        """Return the electrode ids at the given switch addresses.
+
+        :return: numpy array of int64
+            Electrode ids, MISSING_ELECTRODE where no electrode matches.
+        """
+        sa = np.round(np.asarray(switch_address, dtype=float)).astype(np.int64)
+        return self._lookup(self._by_switch_address, sa)
+
+    def quadrupole_ids(self, quadrupoles, use_y=True):
+        """Map the A, B, M and N positions of quadrupoles to electrode ids.
+
+        :param quadrupoles: DataFrame
+            Quadrupoles with columns APosX, APosY, ..., NPosY, as returned by
+            ABEMLS_project.get_quadrupoles.
+        :param use_y: Boolean
+            If False, electrodes are matched on x positions only.
+
+        :return: DataFrame
+            Columns A, B, M and N with the electrode ids (MISSING_ELECTRODE
+            where no electrode matches), and the quadrupole ID if present.
+        """
+        result = DataFrame(index=quadrupoles.index)
+        if 'ID' in quadrupoles:
+            result['ID'] = quadrupoles['ID']
+        for pole in 'ABMN':
+            x = quadrupoles[pole + 'PosX'].values
+            y = quadrupoles[pole + 'PosY'].values if use_y else None
+            result[pole] = self.ids_from_positions(x, y)
+        return result
@@ -0,0 +1,32 @@
+"""Tests of pyabemls.catalog, on synthetic projects. Run from the app folder:
+
+    python -m pytest tests
+"""
+
+import pytest
+
+from pyabemls.catalog import ProjectCatalog
+from benchmarks.synthetic import make_projects
+
+
+@pytest.fixture
+def db_files(tmp_path):
+    return make_projects(tmp_path, n_projects=3, n_tasks=1, n_measures=5)
+
+
+def test_query(db_files):
+    df = ProjectCatalog(db_files).query('SELECT ID FROM {db}.Tasks')
+    assert list(df['project']) == [f.parent.name for f in db_files]
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_query_missing_file(db_files, batch_size):
+    missing = db_files[1]
+    missing.unlink()
+    catalog = ProjectCatalog(db_files, batch_size=batch_size)
+    with pytest.warns(UserWarning, match=missing.parent.name):
+        df = catalog.query('SELECT ID FROM {db}.Tasks')
+    assert list(df['project']) == [db_files[0].parent.name, db_files[2].parent.name]
+
+    with pytest.raises(OSError):
+        catalog.query('SELECT ID FROM {db}.Tasks', on_error='raise')
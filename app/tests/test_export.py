@@ -0,0 +1,18 @@
+"""Tests of pyabemls.export. Run from the app folder:
+
+    python -m pytest tests
+"""
+
+import numpy as np
+
+from pyabemls.export import sensor_indices
+
+
+def test_sensor_indices():
+    idx = sensor_indices([0., 10., 20.], [-5., 0., 4., 6., 15., 19., 30.])
+    # Ties go to the left sensor
+    np.testing.assert_array_equal(idx, [1, 1, 1, 2, 2, 3, 3])
+
+
+def test_sensor_indices_single_sensor():
+    np.testing.assert_array_equal(sensor_indices([0.], [-1., 0., 5.]), [1, 1, 1])
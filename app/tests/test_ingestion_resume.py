@@ -0,0 +1,85 @@
+"""Resuming an interrupted ingestion run of db_preparation_thin.py, on the
+synthetic projects of the benchmarks. Run from the app folder:
+
+    python -m pytest tests
+"""
+
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('ipdb')
+
+import db_preparation_thin as prep
+import extractors
+from benchmarks.synthetic import make_projects
+
+
+N_PROJECTS = 5
+
+
+@pytest.fixture
+def ingestion(tmp_path, monkeypatch):
+    """Point the ingestion at synthetic projects, with its outputs in tmp_path."""
+    make_projects(tmp_path, n_projects=N_PROJECTS, n_tasks=1, n_measures=20)
+    out_path = tmp_path / 'out'
+    out_path.mkdir()
+    for name, path in dict(project_path=tmp_path / 'projects',
+                           protocols_path=tmp_path / 'protocols',
+                           task_info_store=out_path / 'task_info',
+                           temperature_store=out_path / 'temperatures',
+                           ext_power_store=out_path / 'ext_power',
+                           info_db_file=out_path / 'task_info.ftr',
+                           protocol_cache_file=out_path / 'protocol_cache.json',
+                           manifest_file=out_path / 'ingest_manifest.json',
+                           listing_cache_file=out_path / 'project_listing.json',
+                           metrics_file=out_path / 'ingest_metrics.jsonl',
+                           checkpoint_file=out_path / 'ingest_checkpoint.json',
+                           quarantine_file=out_path / 'ingest_quarantine.json',
+                           ).items():
+        monkeypatch.setattr(prep, name, path)
+    return out_path
+
+
+def interrupt_at(monkeypatch, n_call):
+    """Make the ingestion stop with a KeyboardInterrupt when writing the
+    n_call-th chunk of results."""
+    calls = []
+
+    def collect_results(*args, **kwargs):
+        calls.append(None)
+        if len(calls) == n_call:
+            raise KeyboardInterrupt
+        return extractors.collect_results(*args, **kwargs)
+
+    monkeypatch.setattr(prep, 'collect_results', collect_results)
+
+
+def stored_projects(out_path):
+    df = extractors.TaskInfoStage(out_path / 'task_info', None).store.read()
+    return sorted(df['proj_name'].unique())
+
+
+@pytest.mark.parametrize('n_call', [1, 2])
+def test_resume_forced_run(ingestion, monkeypatch, n_call):
+    read = prep.ingest_projects(n_workers=1, verbose=False)
+    projects = sorted(project_name for file, project_name, proj_date in read)
+    assert len(projects) == N_PROJECTS
+
+    # A forced run interrupted before (n_call=1) or after (n_call=2) its first
+    # chunk of projects is written
+    interrupt_at(monkeypatch, n_call)
+    with pytest.raises(KeyboardInterrupt):
+        prep.ingest_projects(force_reprocessing=True, n_workers=1, verbose=False,
+                             checkpoint_every=2)
+    assert prep.checkpoint_file.exists()
+    monkeypatch.setattr(prep, 'collect_results', extractors.collect_results)
+
+    # The same command resumes the run, and reads the projects not written yet
+    read = prep.ingest_projects(force_reprocessing=True, n_workers=1, verbose=False,
+                                checkpoint_every=2)
+    assert len(read) == N_PROJECTS - 2*(n_call-1)
+    assert not prep.checkpoint_file.exists()
+    assert stored_projects(ingestion) == projects
+
+    # Nothing is left to read
+    assert prep.ingest_projects(n_workers=1, verbose=False) == []
@@ -0,0 +1,54 @@
+"""Tests of partitioned_store.PartitionedStore. Run from the app folder:
+
+    python -m pytest tests
+"""
+
+import pytest
+import pandas as pd
+
+pytest.importorskip('pyarrow')
+
+from partitioned_store import PartitionedStore
+
+
+def project_rows(proj_name, proj_date, n):
+    return pd.DataFrame({'proj_name': proj_name,
+                         'proj_date': pd.Timestamp(proj_date),
+                         'Time': pd.Timestamp(proj_date) + pd.to_timedelta(range(n), unit='min'),
+                         'Temp': range(n)})
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PartitionedStore(tmp_path / 'store', time_column='proj_date',
+                             replace_on='proj_name', order_by='Time')
+    store.append(pd.concat([project_rows('a', '2022-07-01', 3),
+                            project_rows('b', '2022-07-02', 2),
+                            project_rows('c', '2022-08-01', 2)], ignore_index=True))
+    return store
+
+
+def test_replace(store):
+    store.append(project_rows('b', '2022-07-02', 4))
+    df = store.read()
+    assert list(df.groupby('proj_name').size()) == [3, 4, 2]
+    assert df['Time'].is_monotonic_increasing
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_replace_keys_without_rows(store, compact):
+    # Projects b and c are read again, b gives no rows and c two new rows
+    keys = pd.DataFrame({'proj_name': ['b', 'c'],
+                         'proj_date': pd.to_datetime(['2022-07-02', '2022-08-01'])})
+    store.append(project_rows('c', '2022-08-01', 1), replace_keys=keys)
+    if compact:
+        store.compact()
+        assert not any(store._is_deletion(f) for f in store.part_files())
+    df = store.read()
+    assert list(df['proj_name']) == ['a', 'a', 'a', 'c']
+
+    # All rows of a partition deleted
+    store.append(pd.DataFrame(), replace_keys=keys.iloc[1:])
+    store.compact()
+    assert store.partitions() == ['2022-07']
+    assert list(store.read(columns=['proj_name'])['proj_name']) == ['a', 'a', 'a']
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+
+################################################################
+# Helpers for time series held as typed numpy arrays, with times as int64
+# nanoseconds (datetime64[ns] viewed as int64).
+################################################################
+
+
+def as_int64_times(times):
+    """Return datetime64 values (array, Series or DatetimeIndex) as int64
+    nanoseconds since the epoch."""
+    return np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+
+
+def is_sorted(values):
+    """Return True if the array is in non-decreasing order."""
+    return len(values) < 2 or bool(np.all(values[1:] >= values[:-1]))
+
+
+def take(values, order):
+    """Return values reordered by order, or values itself if order is None."""
+    return values if order is None else values[order]
+
+
+def merge_order(runs):
+    """Merge sorted runs into one sorted array.
+
+    The runs (e.g. the readings of each project, each in time order) are
+    merged stably: for equal values, elements of earlier runs come first, and
+    within a run the original order is kept. When the runs follow each other
+    without overlapping, which is the usual case for consecutive projects,
+    the concatenation is already sorted and no sort is done. Otherwise the
+    concatenation is sorted with timsort, which detects the runs and merges
+    them pairwise, i.e. a k-way merge in O(n log k).
+
+    :param runs: list of 1d arrays
+        Sorted arrays of the same dtype.
+
+    :return: tuple
+        (values, order): the merged array, and the indices into the
+        concatenated runs giving it, or None if the concatenation is sorted.
+    """
+    if len(runs) == 0:
+        return np.array([], dtype=np.int64), None
+    values = np.concatenate(runs)
+    if is_sorted(values):
+        return values, None
+    order = np.argsort(values, kind='stable')
+    return values[order], order
+
+
+def duplicate_counts(values):
+    """Return for each element the number of later elements equal to it, in
+    one sort and a few vectorized passes.
+
+    :param values: 1d array
+    :return: int64 array
+    """
+    values = np.asarray(values)
+    n = len(values)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    # A stable sort keeps equal values in their original order
+    order = np.argsort(values, kind='stable')
+    ordered = values[order]
+    run_start = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    run_end = np.r_[run_start[1:], n] - 1
+    run_id = np.repeat(np.arange(len(run_start)), np.diff(np.r_[run_start, n]))
+    counts = np.empty(n, dtype=np.int64)
+    counts[order] = run_end[run_id] - np.arange(n)
+    return counts
+
+
+def separate_duplicates(times, step=np.timedelta64(1, 'ms')):
+    """Make identical time stamps unique by moving all but the last of them
+    forward in steps of step.
+
+    Of k identical time stamps, the last is kept, the one before it is moved
+    by one step, and the first by k-1 steps, as done by repeatedly moving the
+    earlier duplicates by one step until none are left. The offsets are found
+    in one pass instead of one pass per step. Only if a moved time stamp hits
+    another existing one (a burst longer than the spacing of the time stamps
+    divided by step) is another pass made.
+
+    :param times: Series or array of datetime64
+    :param step: timedelta64
+    :return: Series or array of datetime64, like times
+    """
+    is_series = isinstance(times, pd.Series)
+    # Time zone aware series give their times in UTC
+    values = times.values if is_series else np.asarray(times)
+    while True:
+        counts = duplicate_counts(values)
+        if not counts.any():
+            break
+        values = values + counts * step
+    if not is_series:
+        return values
+    result = pd.Series(values, index=times.index, name=times.name)
+    if times.dt.tz is not None:
+        result = result.dt.tz_localize('UTC').dt.tz_convert(times.dt.tz)
+    return result
@@ -1,5 +1,6 @@
 REM SET log_file=%cd%\logfile.txt
 call D:\vapp\env\Scripts\activate
 cd D:\vapp
+REM Task info, temperatures and external power from all project files, in one pass
 python db_preparation_thin.py
 python voltage_log_processing.py
\ No newline at end of file
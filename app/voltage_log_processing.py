@@ -5,125 +5,321 @@ import numpy as np
 import datetime as dt
 import dateutil as du
 import pathlib
+import os
 import json
+import hashlib
+import warnings
 import ipdb as pdb
-import chardet
 
+from partitioned_store import PartitionedStore
+from timeseries import separate_duplicates
+
+# Please install pyarrow
+# conda install -c conda-forge pyarrow
 
-class DataFile(io.BytesIO):
-    """Defines a common interface to reading data files stored in directories and inside zip-files.
-    Reads and holds the data from the file in memory. 
-    Consider deleting the instance when it is no longer needed, if memory usage is an issue.
-    """
-    def __init__(self, filename, path=None):
-        super().__init__()
-
-        self._enc = None
-        self.encoding = None
-        self.encoding_confidence = None
-
-        if path is None:
-            self._filename = pathlib.Path(filename)
-        else:
-            self._filename = pathlib.Path(path) / filename
-        
-        if self._filename.parent.suffix == '.zip':
-            self._read_zipped_data()
-        else:
-            self._read_plain_data()
-        self.get_encoding()
-
-    def _read_zipped_data(self):
-        """Reads the contents of a file inside a zip-file and place it
-        in the StringIO buffer. 
-        Currently only files in the root of the zip file can be handled."""
-        if not self._filename.parent.exists():
-            raise FileNotFoundError('File does not exist: {0}'.format(self._filename.parent))
-
-        zf = zipfile.ZipFile(self._filename.parent)
-
-        if not self._filename.name in zf.namelist():
-            raise FileNotFoundError('File does not exist: {0}'.format(self._filename))
-
-        with zf.open(self._filename.name, 'rb') as file:
-            data = file.read()
-            data = self._clean(data)
-            self.write(data)
-
-    def _read_plain_data(self):
-        """Reads the contents of a regular file and place it in the BytesIO buffer."""
-        if not self._filename.exists():
-            raise FileNotFoundError('File does not exist: {0}'.format(self._filename))
-        
-        with open(self._filename, 'rb') as file:
-            data = file.read()
-            data = self._clean(data)
-            self.write(data)
-
-
-    def _clean(self, data):
-        return data.replace(b'\x00', b'')
-
-    def get_encoding(self, count=300):
-        """Detect the encoding of the file."""
-    
-        # If we passed an open file
-        self.seek(0)
-        dat = self.read(count)
-        self.seek(0)
-    
-        self._enc = chardet.detect(dat)
-        self.encoding = self._enc['encoding']
-        self.encoding_confidence = self._enc['confidence']
-    
 
 #SUPPLY_DAT_FILE = pathlib.Path(r'D:\data\artek\stations\QEQ-ERT-02-PC\home_root\scripts\io_scripts\supply_voltage.dat')
 SUPPLY_DAT_FILE = pathlib.Path(r'D:\data\artek\stations\QEQ-ERT-02-RPi2\logs\supply_voltage_combined.dat')
 
-SUPPLY_FTR = pathlib.Path(r'.\supply_voltage.ftr')
+SUPPLY_STORE = pathlib.Path(r'.\supply_voltage')    # monthly parquet partitions
 BATT_STATS_FTR = pathlib.Path(r'.\battery_stats.ftr')
+SUPPLY_STATE_FILE = pathlib.Path(r'.\supply_voltage_state.json')   # offset parsed up to, daily stats
+
+SUPPLY_COLUMNS = ['DateTime', 'Voltage','Unit', 'relay state', 'Comment']
+SUPPLY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S(%z)'
+CHUNK_SIZE = 8*1024*1024    # bytes of the supply voltage log parsed at a time
+HEAD_BYTES = 1024           # bytes at the start of the log compared to detect a replaced log
+COMPACT_FILES = 20          # merge the part files of a month when there are this many
+TAIL_BYTES = 64*1024        # bytes at the end of the parsed lines searched for the last time stamp
+
+
+def iter_line_blocks(filename, chunk_size=CHUNK_SIZE, offset=0):
+    """Read a file from offset in chunks of chunk_size bytes and yield blocks
+    of whole lines, with NUL bytes removed. Memory use is bounded by the chunk
+    size. A last line without a newline may still be being written, and is
+    not read.
+
+    :return: generator
+        (block, end) of each block, with end the offset in the file just
+        after the last line of the block.
+    """
+    rest = b''
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            chunk = rest + chunk
+            end = chunk.rfind(b'\n') + 1
+            rest = chunk[end:]
+            offset += end
+            if end > 0:
+                yield chunk[:end].replace(b'\x00', b''), offset
+
+
+def parse_supply_times(values):
+    """Parse time stamps of the supply voltage log with SUPPLY_TIME_FORMAT,
+    as UTC without time zone. Invalid time stamps give NaT."""
+    return pd.to_datetime(pd.Series(values, dtype='object'), format=SUPPLY_TIME_FORMAT,
+                          utc=True, errors='coerce').dt.tz_convert(None)
+
+
+def last_time_offset(filename, start, end, last_time, tail_bytes=TAIL_BYTES):
+    """Return the offset in the file of the first of the lines with time
+    stamp last_time at the end of the lines from start to end (the lines after
+    the last line with another valid time stamp). The lines are searched from
+    the end, tail_bytes at first, more if needed."""
+    with open(filename, 'rb') as f:
+        while True:
+            lo = max(start, end - tail_bytes)
+            f.seek(lo)
+            lines = f.read(end - lo)[:-1].split(b'\n')
+            starts = lo + np.r_[0, np.cumsum([len(line) + 1 for line in lines])[:-1]]
+            if lo > start:
+                # The first line may be cut
+                lines = lines[1:]
+                starts = starts[1:]
+            fields = [line.replace(b'\x00', b'').split(b';', 1)[0].decode('utf-8', 'replace')
+                      for line in lines]
+            times = parse_supply_times(fields).values
+            same = np.flatnonzero(times == last_time)
+            other = np.flatnonzero(~np.isnat(times) & (times != last_time))
+            if len(other) > 0:
+                return int(starts[same[same > other[-1]][0]])
+            if lo == start:
+                return int(starts[same[0]])
+            tail_bytes *= 2
+
+
+def parse_supply_voltage(block):
+    """Parse a block of lines of the supply voltage log into a dataframe with
+    the columns SUPPLY_COLUMNS. Time stamps are parsed with SUPPLY_TIME_FORMAT
+    and stored as UTC without time zone, as in the tables written by earlier
+    versions. Lines with invalid time stamps are dropped."""
+    df = pd.read_csv(io.BytesIO(block), sep=';', names=SUPPLY_COLUMNS, header=None,
+                     dtype={'Voltage': 'float64', 'relay state': 'float64',
+                            'Unit': 'object', 'Comment': 'object'},
+                     encoding_errors='replace')
+    df['DateTime'] = parse_supply_times(df['DateTime'])
+    bad = df['DateTime'].isna()
+    if bad.any():
+        warnings.warn('Skipping {0} lines with invalid time stamps in the supply voltage log.'.format(bad.sum()))
+        df = df[~bad.values].reset_index(drop=True)
+    return df
+
+
+def prepare_supply_voltage(df):
+    """Separate duplicate time stamps, mask invalid voltages and add the
+    "Power on" column."""
+    # This we do to correct for when two log entries were written so fast that
+    # the 1 second resolution shows no time difference. We move the earlier
+    # duplicates by 1 ms steps.
+    df['DateTime'] = separate_duplicates(df['DateTime'])
+
+    # Prepare voltage
+    df.loc[df['Voltage'] < -90, 'Voltage'] = np.nan
+
+    # Prepare "Power on" column
+    power = df[~df['relay state'].isin([-1])]['relay state'].copy()
+    power[power==1] = np.nan
+    power.name = 'Power on'
+    df['Power on'] = power
+    return df
 
 
-datf = DataFile(SUPPLY_DAT_FILE)
+class DailyVoltageStats():
+    """Daily minimum, maximum, mean and standard deviation of the voltage,
+    accumulated chunk by chunk. The count, mean and sum of squared deviations
+    of each day are kept, and those of a new chunk are combined with them
+    (Chan et al.), so the result equals that of a groupby on all data."""
 
-custom_date_parser = lambda x: dt.datetime.strptime(x, "%Y-%m-%d %H:%M:%S(%z)")
-df = pd.read_csv(datf, sep=';', parse_dates=['DateTime'], 
-                 date_parser=custom_date_parser, 
-                 names=['DateTime', 'Voltage','Unit', 'relay state', 'Comment'])
+    columns = ['count', 'mean', 'm2', 'min', 'max']
 
-#df2 = df.set_index('DateTime')
-df2 = df
+    def __init__(self):
+        self.stats = pd.DataFrame(columns=self.columns, dtype='float64')
 
-# This we do to correct for when two log entries were written 
-# so fast that the 1 second resolution shows no time difference
-# We move the last duplicates by 1 ms, until there are no more duplicates.
-idx = df2['DateTime'].duplicated(keep='last')
-while any(idx):
-    datetimes = df2['DateTime'].values
-    datetimes[idx] = datetimes[idx] + np.timedelta64(1, 'ms')
-    df2['DateTime'] = datetimes
-    idx = df2['DateTime'].duplicated(keep='last')
+    def to_dict(self):
+        """Return the accumulated statistics as a json serializable dict."""
+        return dict((d.isoformat(), [None if np.isnan(x) else x for x in row])
+                    for d, row in zip(self.stats.index, self.stats.values.tolist()))
+
+    @classmethod
+    def from_dict(cls, daily):
+        """Create from the statistics returned by to_dict."""
+        result = cls()
+        if daily:
+            result.stats = pd.DataFrame([[np.nan if x is None else x for x in row] for row in daily.values()],
+                                        index=[dt.date.fromisoformat(d) for d in daily],
+                                        columns=cls.columns, dtype='float64')
+        return result
+
+    def update(self, df):
+        """Add the voltages of a chunk of the supply voltage table."""
+        dates = df['DateTime'].dt.date
+        new = df.groupby(dates.values)['Voltage'].agg(['count', 'mean', 'var', 'min', 'max'])
+        new['m2'] = (new['var'] * (new['count'] - 1)).fillna(0.)
+        new = new[self.stats.columns].astype('float64')
+
+        index = self.stats.index.union(new.index)
+        a = self.stats.reindex(index)
+        b = new.reindex(index)
+        na = a['count'].fillna(0.).values
+        nb = b['count'].fillna(0.).values
+        n = na + nb
+        ma = a['mean'].fillna(0.).values
+        mb = b['mean'].fillna(0.).values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mb - ma
+            mean = np.where(na == 0, mb, np.where(nb == 0, ma, ma + delta * nb / n))
+            m2 = (a['m2'].fillna(0.).values + b['m2'].fillna(0.).values
+                  + np.where(n > 0, delta**2 * na * nb / n, 0.))
+        self.stats = pd.DataFrame({'count': n,
+                                   'mean': np.where(n > 0, mean, np.nan),
+                                   'm2': m2,
+                                   'min': np.fmin(a['min'].values, b['min'].values),
+                                   'max': np.fmax(a['max'].values, b['max'].values),
+                                   }, index=index)
+
+    def result(self):
+        """Return the daily statistics, as written to the battery stats file."""
+        stats = self.stats.sort_index()
+        n = stats['count'].values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.where(n > 1, np.sqrt(stats['m2'].values / (n - 1)), np.nan)
+        return pd.DataFrame({'DateTime': stats.index.values,
+                             'Voltage_min': stats['min'].values,
+                             'Voltage_max': stats['max'].values,
+                             'Voltage_mean': stats['mean'].values,
+                             'Voltage_std': std,
+                             })
+
+
+def file_head(filename, length):
+    """Return the sha1 hex digest of the first length bytes of a file."""
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def load_state(state_file):
+    """Return the saved state of the supply voltage processing, or None."""
+    if not state_file.exists():
+        return None
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        warnings.warn('Could not read {0}, the supply voltage log will be parsed again.'.format(state_file))
+        return None
+
+
+def save_state(state, state_file):
+    """Write the state atomically, so that an interrupted write leaves the
+    previous state in place."""
+    tmp = state_file.with_name(state_file.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, state_file)
+
+
+def process_supply_voltage(supply_dat_file=SUPPLY_DAT_FILE, supply_store=SUPPLY_STORE,
+                           batt_stats_ftr=BATT_STATS_FTR, state_file=SUPPLY_STATE_FILE,
+                           chunk_size=CHUNK_SIZE, rebuild=False):
+    """Convert the supply voltage log to the supply voltage and daily battery
+    statistics tables read by the web app.
+
+    The log only grows, so only the lines appended since the last run are
+    parsed, and appended to the supply voltage store. The offset in the log
+    parsed up to, and the daily statistics accumulated so far, are kept in
+    state_file, and only the statistics of the dates of the new lines change.
+    The lines are parsed chunk by chunk, so memory use does not grow with the
+    length of the log either.
+
+    The log is parsed from the start if rebuild is True, if there is no
+    state, or if the log was replaced (its start changed or it got shorter).
+    The lines with the last time stamp parsed are not written, like an
+    unfinished last line: the offset saved is that of the first of them, and
+    the next run parses them again with the lines appended meanwhile, so that
+    a burst of identical time stamps split between two runs is separated as a
+    whole.
+
+    :return: integer
+        The number of rows written.
+    """
+    supply_dat_file = pathlib.Path(supply_dat_file)
+    state_file = pathlib.Path(state_file)
+    store = PartitionedStore(supply_store, time_column='DateTime')
+    size = os.stat(supply_dat_file).st_size
 
-# Prepare voltage
-df2.loc[df2['Voltage'] < -90, 'Voltage'] = np.nan
+    state = None if rebuild else load_state(state_file)
+    if state is not None and (size < state['offset'] or size < state['head_length']
+                              or file_head(supply_dat_file, state['head_length']) != state['head']):
+        print('Supply voltage log was replaced, parsing it from the start.')
+        state = None
 
-# Prepare "Power on" column
-power = df2[~df2['relay state'].isin([-1])]['relay state'].copy()
-power[power==1] = np.nan
-power.name = 'Power on'
-df2['Power on'] = power
+    rebuild = state is None
+    if rebuild:
+        # Without a state file, an interrupted rebuild is started over
+        if state_file.exists():
+            state_file.unlink()
+        store.clear()
+        stats = DailyVoltageStats()
+        offset = 0
+    else:
+        # Part files written after the state was saved are from an
+        # interrupted run, and their lines are parsed again
+        for f in store.part_files():
+            if f.name > state['last_part']:
+                f.unlink()
+        # Keep the number of files down. Done before appending, so that only
+        # files recorded in the state are merged.
+        store.compact(min_files=COMPACT_FILES)
+        stats = DailyVoltageStats.from_dict(state['daily'])
+        offset = state['offset']
 
-df2.reset_index()
-df2.to_feather(SUPPLY_FTR)
+    def write(df):
+        df = prepare_supply_voltage(df)
+        store.append(df)
+        stats.update(df)
+        return len(df)
 
-# Extract voltage stats on a daily basis
-daily_voltage_stats = df2.groupby(df2['DateTime'].dt.date).agg({'Voltage':['min', 'max', 'mean', 'std']})
+    # The rows with the last time stamp of a chunk are held back and parsed
+    # with the next chunk, so that duplicates are separated across chunks.
+    # Those of the last chunk are left for the next run.
+    held = None
+    n_rows = 0
+    start = offset
+    for block, offset in iter_line_blocks(supply_dat_file, chunk_size=chunk_size, offset=offset):
+        df = parse_supply_voltage(block)
+        if held is not None:
+            df = pd.concat([held, df], ignore_index=True)
+        if len(df) == 0:
+            held = None
+            continue
+        times = df['DateTime'].values
+        last = np.flatnonzero(times != times[-1])
+        split = last[-1] + 1 if len(last) > 0 else 0
+        held = df.iloc[split:].reset_index(drop=True)
+        if split > 0:
+            n_rows += write(df.iloc[:split].reset_index(drop=True))
+    if held is not None and len(held) > 0:
+        offset = last_time_offset(supply_dat_file, start, offset, held['DateTime'].values[-1])
 
-# in order to be able to save as Feather...
-daily_voltage_stats = daily_voltage_stats.reset_index()  # make DateTime index a normal column
-daily_voltage_stats.columns = [("_".join(a)).strip('_') for a in daily_voltage_stats.columns.to_flat_index()]   # Flatten the multiindex columns
-daily_voltage_stats.to_feather(BATT_STATS_FTR)
+    if rebuild:
+        # One file per month
+        store.compact()
 
+    if rebuild or n_rows > 0:
+        # Daily voltage stats, only those of the dates of the new lines changed
+        stats.result().to_feather(batt_stats_ftr)
 
+    head_length = min(size, HEAD_BYTES)
+    parts = [f.name for f in store.part_files()]
+    save_state(dict(offset=offset,
+                    head=file_head(supply_dat_file, head_length),
+                    head_length=head_length,
+                    last_part=max(parts) if parts else '',
+                    daily=stats.to_dict()),
+               state_file)
+    return n_rows
 
 
+if __name__ == '__main__':
+    process_supply_voltage()